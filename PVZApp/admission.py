@@ -0,0 +1,173 @@
+import collections
+import math
+import threading
+import time
+from http import HTTPStatus
+
+# Допуск запросов к обработчикам (admission control).
+# Тяжелые выборки нескольких терминалов не должны отнимать рабочие потоки
+# у выдачи заказа, которую ждет клиент у стойки. Поэтому у классов
+# маршрутов свои бюджеты одновременных запросов: чтение (списки,
+# выгрузка, изменения, графики), запись и приоритетные выдача и отмена.
+# Ждущий запрос держит рабочий поток, поэтому очередь бюджета вдвое короче
+# его самого: по умолчанию чтению достается половина потоков сервера,
+# записи - четверть, и даже при полной очереди чтения потоки для выдачи
+# остаются.
+#
+# Сверх бюджета запрос ждет места не дольше wait секунд в очереди
+# ограниченной длины, а затем получает 503 с Retry-After - ожидание не
+# растет без предела. Кроме того, с --rate-limit у каждого клиента
+# (адреса) своя корзина токенов: превысивший свой темп получает 429 с
+# Retry-After, через сколько появится токен. По умолчанию темп не
+# ограничен: за NAT или прокси все терминалы пункта выдачи приходят с
+# одного адреса. Приоритетные запросы темпом не ограничиваются.
+# Бюджеты и корзины действуют в пределах процесса.
+BUDGETS = ('read', 'write', 'priority')
+PRIORITY = 'priority'
+DEFAULT_WAIT = 0.5            # секунд в очереди бюджета до ответа 503
+DEFAULT_RATE = 0              # запросов в секунду на клиента (0 - без ограничения)
+DEFAULT_BURST = 100           # запросов сверх темпа подряд
+MAX_CLIENTS = 10000           # корзин клиентов; самые давние вытесняются
+BUSY_RETRY_AFTER = 1          # секунд в Retry-After ответа 503
+
+
+def default_limits(workers):
+    """Бюджеты чтения, записи и приоритетных запросов для workers рабочих потоков"""
+    return max(1, workers // 2), max(1, workers // 4), workers
+
+
+class Budget:
+    """Не больше limit одновременных запросов класса и короткая очередь сверх него"""
+
+    def __init__(self, name, limit, wait=DEFAULT_WAIT):
+        self.name = name
+        self.limit = limit      # 0 - без ограничения
+        self.wait = wait
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    @property
+    def queue_size(self):
+        """Запросов, которые могут ждать места"""
+        return self.limit // 2
+
+    def acquire(self):
+        """Занять место; False - бюджет исчерпан и очередь полна или ожидание истекло"""
+        with self._cond:
+            if self.limit and self.in_flight >= self.limit:
+                if self.waiting >= self.queue_size:
+                    self.rejected += 1
+                    return False
+                self.waiting += 1
+                try:
+                    deadline = time.monotonic() + self.wait
+                    while self.in_flight >= self.limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected += 1
+                            return False
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {'limit': self.limit, 'in_flight': self.in_flight, 'waiting': self.waiting,
+                    'admitted': self.admitted, 'rejected': self.rejected}
+
+
+class RateLimiter:
+    """Корзины токенов по клиентам: rate запросов в секунду и запас burst"""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_clients=MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        # клиент -> [токенов, время пополнения]; в порядке последнего запроса
+        self._buckets = collections.OrderedDict()
+        self.limited = 0
+
+    def acquire(self, client):
+        """0, если запрос клиента допущен, иначе секунды до следующего токена"""
+        if not self.rate:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = [max(self.burst, 1), now]
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+                bucket[0] = min(max(self.burst, 1), bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            self.limited += 1
+            return (1 - bucket[0]) / self.rate
+
+    def stats(self):
+        with self._lock:
+            return {'rate': self.rate, 'burst': self.burst, 'clients': len(self._buckets), 'limited': self.limited}
+
+
+class Rejection:
+    __slots__ = ('status', 'error', 'retry_after')
+
+    def __init__(self, status, error, retry_after):
+        self.status = status
+        self.error = error
+        self.retry_after = retry_after
+
+
+class AdmissionControl:
+    """Бюджеты классов маршрутов и ограничение темпа клиентов"""
+
+    def __init__(self, workers, rate=DEFAULT_RATE, burst=DEFAULT_BURST, wait=DEFAULT_WAIT):
+        self.budgets = {name: Budget(name, limit, wait) for name, limit in zip(BUDGETS, default_limits(workers))}
+        self.rate_limiter = RateLimiter(rate, burst)
+
+    def configure(self, limits=None, rate=None, burst=None):
+        """Изменение бюджетов {класс: limit} и темпа до начала обслуживания"""
+        for name, limit in (limits or {}).items():
+            self.budgets[name].limit = limit
+        if rate is not None:
+            self.rate_limiter.rate = rate
+        if burst is not None:
+            self.rate_limiter.burst = burst
+
+    def admit(self, budget, client):
+        """Допуск запроса класса budget (None - без бюджета) от клиента.
+
+        Возвращает None, если запрос допущен (после обработки -
+        release(budget)), или Rejection с ответом клиенту.
+        """
+        if budget != PRIORITY:
+            wait = self.rate_limiter.acquire(client)
+            if wait:
+                return Rejection(HTTPStatus.TOO_MANY_REQUESTS, 'Too many requests', math.ceil(wait))
+        if budget is not None and not self.budgets[budget].acquire():
+            return Rejection(HTTPStatus.SERVICE_UNAVAILABLE, 'Server is busy', BUSY_RETRY_AFTER)
+        return None
+
+    def release(self, budget):
+        if budget is not None:
+            self.budgets[budget].release()
+
+    def stats(self):
+        return {'budgets': {name: budget.stats() for name, budget in self.budgets.items()},
+                'rate_limit': self.rate_limiter.stats()}
\ No newline at end of file
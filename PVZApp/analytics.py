@@ -0,0 +1,207 @@
+import datetime
+
+from stats import AMOUNT_CENTS_SQL
+from archive import orders_source
+
+# Свертки заказов по часам и дням с разбивкой по статусу, пункту выдачи
+# и способу доставки. Как и агрегаты stats, ведутся триггерами, поэтому
+# график за 90 дней строится по нескольким тысячам строк свертки, а не
+# по всем заказам за период. Недели собираются из дневной свертки.
+GRANULARITIES = ('hour', 'day', 'week')
+DIMENSIONS = ('status', 'pickup_point', 'delivery_method')
+DEFAULT_RANGE_DAYS = 30
+
+ROLLUPS = {
+    'rollup_hour': "strftime('%Y-%m-%dT%H:00', {order_date})",
+    'rollup_day': "date({order_date})",
+}
+
+
+def _bucket(table, order_date):
+    return f"ifnull({ROLLUPS[table].format(order_date=order_date)}, '')"
+
+
+def _apply(row, sign):
+    # Шаги триггера для обеих сверток
+    amount = AMOUNT_CENTS_SQL.format(amount=f'{row}.amount')
+    steps = []
+    for table in ROLLUPS:
+        steps.append(f'''
+        INSERT INTO {table} (bucket, status, pickup_point, delivery_method, orders, amount_cents)
+        VALUES ({_bucket(table, f'{row}.order_date')}, {row}.status, {row}.pickup_point,
+                {row}.delivery_method, {sign}1, {sign}{amount})
+        ON CONFLICT (bucket, status, pickup_point, delivery_method) DO UPDATE SET
+            orders = orders + excluded.orders,
+            amount_cents = amount_cents + excluded.amount_cents;
+        ''')
+    return ''.join(steps)
+
+
+ROLLUP_SCHEMA = [
+    f'''
+    CREATE TABLE IF NOT EXISTS {table} (
+        bucket TEXT NOT NULL,
+        status TEXT NOT NULL,
+        pickup_point TEXT NOT NULL,
+        delivery_method TEXT NOT NULL,
+        orders INTEGER NOT NULL,
+        amount_cents INTEGER NOT NULL,
+        PRIMARY KEY (bucket, status, pickup_point, delivery_method)
+    ) WITHOUT ROWID
+    '''
+    for table in ROLLUPS
+] + [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS rollup_insert AFTER INSERT ON orders BEGIN
+        {_apply('NEW', '+')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS rollup_delete AFTER DELETE ON orders BEGIN
+        {_apply('OLD', '-')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS rollup_update
+    AFTER UPDATE OF status, amount, order_date, pickup_point, delivery_method ON orders BEGIN
+        {_apply('OLD', '-')}
+        {_apply('NEW', '+')}
+    END
+    ''',
+]
+
+ROLLUP_TRIGGERS = ('rollup_insert', 'rollup_delete', 'rollup_update')
+
+
+def parse_timeseries_params(params):
+    """Разбор параметров /api/stats/timeseries. ValueError при ошибке"""
+    granularity = params.get('granularity', ['day'])[0]
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'granularity must be one of: {", ".join(GRANULARITIES)}')
+
+    try:
+        date_to = params.get('date_to', [None])[0]
+        date_to = datetime.date.fromisoformat(date_to) if date_to else datetime.date.today()
+        date_from = params.get('date_from', [None])[0]
+        if date_from:
+            date_from = datetime.date.fromisoformat(date_from)
+        else:
+            date_from = date_to - datetime.timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    except ValueError:
+        raise ValueError('date_from and date_to must be dates in YYYY-MM-DD format')
+    if date_from > date_to:
+        raise ValueError('date_from must not be later than date_to')
+
+    group_by = []
+    for dimension in (params.get('group_by', [''])[0] or '').split(','):
+        dimension = dimension.strip()
+        if not dimension:
+            continue
+        if dimension not in DIMENSIONS:
+            raise ValueError(f'Unknown group_by dimension: {dimension}')
+        if dimension not in group_by:
+            group_by.append(dimension)
+
+    filters = {dimension: params[dimension][0] for dimension in DIMENSIONS if params.get(dimension)}
+
+    return {
+        'granularity': granularity,
+        'date_from': date_from,
+        'date_to': date_to,
+        'group_by': group_by,
+        'filters': filters,
+    }
+
+
+def timeseries(conn, granularity, date_from, date_to, group_by=(), filters=None):
+    """Число заказов и сумма по интервалам времени за период [date_from, date_to]"""
+    table = 'rollup_hour' if granularity == 'hour' else 'rollup_day'
+    # Понедельник недели, в которую попадает день
+    bucket = "date(bucket, 'weekday 0', '-6 days')" if granularity == 'week' else 'bucket'
+
+    query = f"SELECT {bucket} AS period"
+    for dimension in group_by:
+        query += f", {dimension}"
+    query += f", SUM(orders) AS orders, SUM(amount_cents) AS amount_cents FROM {table}"
+    query += " WHERE bucket >= ? AND bucket < ?"
+    args = [date_from.isoformat(), (date_to + datetime.timedelta(days=1)).isoformat()]
+
+    for dimension, value in (filters or {}).items():
+        query += f" AND {dimension} = ?"
+        args.append(value)
+
+    columns = ', '.join(['period'] + list(group_by))
+    query += f" GROUP BY {columns} HAVING SUM(orders) != 0 ORDER BY {columns}"
+
+    return [
+        {
+            'period': row['period'],
+            **{dimension: row[dimension] for dimension in group_by},
+            'orders': row['orders'],
+            'amount': row['amount_cents'] / 100,
+        }
+        for row in conn.execute(query, args)
+    ]
+
+
+def combine(series, group_by=()):
+    """Ряд всех шардов из результатов timeseries по каждому"""
+    if len(series) == 1:
+        return series[0]
+    combined = {}
+    for points in series:
+        for point in points:
+            key = (point['period'], *(point[dimension] for dimension in group_by))
+            total = combined.setdefault(key, {**point, 'orders': 0, 'amount': 0})
+            total['orders'] += point['orders']
+            total['amount'] += point['amount']
+    for point in combined.values():
+        point['amount'] = round(point['amount'], 2)
+    return [combined[key] for key in sorted(combined)]
+
+
+def _compute(conn, table):
+    amount = AMOUNT_CENTS_SQL.format(amount='amount')
+    return {
+        tuple(row[:4]): (row[4], row[5])
+        for row in conn.execute(f'''
+            SELECT {_bucket(table, 'order_date')}, status, pickup_point, delivery_method,
+                   COUNT(*), SUM({amount})
+            FROM {orders_source(conn)} GROUP BY 1, 2, 3, 4
+        ''')
+    }
+
+
+def _stored(conn, table):
+    return {
+        tuple(row[:4]): (row[4], row[5])
+        for row in conn.execute(f'''
+            SELECT bucket, status, pickup_point, delivery_method, orders, amount_cents
+            FROM {table} WHERE orders != 0 OR amount_cents != 0
+        ''')
+    }
+
+
+def verify(conn):
+    """Сравнение сверток с пересчетом по orders, формат как у stats.verify"""
+    drift = []
+    for table in ROLLUPS:
+        stored = _stored(conn, table)
+        actual = _compute(conn, table)
+        for key in sorted(set(stored) | set(actual)):
+            expected = stored.get(key, (0, 0))
+            real = actual.get(key, (0, 0))
+            if expected != real:
+                drift.append((table, key, expected, real))
+    return drift
+
+
+def rebuild(conn):
+    """Пересчет сверток с нуля по заказам, включая архивные"""
+    for table in ROLLUPS:
+        rows = _compute(conn, table)
+        conn.execute(f"DELETE FROM {table}")
+        conn.executemany(f'''
+            INSERT INTO {table} (bucket, status, pickup_point, delivery_method, orders, amount_cents)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(*key, *value) for key, value in rows.items()])
\ No newline at end of file
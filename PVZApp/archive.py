@@ -0,0 +1,234 @@
+import datetime
+import json
+import os
+import re
+import threading
+import time
+
+# Архив закрытых заказов.
+# Выданные и отмененные заказы старше заданного срока переносятся большими
+# пакетами из orders в таблицу orders присоединенной БД archive - отдельного
+# файла рядом с основным. Рабочая таблица, ее индексы и поисковый индекс
+# остаются небольшими и помещаются в кэш страниц, а история доступна через
+# include_archived=1 и по id/номеру заказа.
+#
+# Перенос не считается удалением: пока в транзакции переноса установлен
+# флаг archive_state.moving, триггеры удаления статистики, сверток и
+# синхронизации не срабатывают. Агрегаты продолжают учитывать архивные
+# заказы, а клиенты синхронизации не получают для них удалений.
+ARCHIVE_STATUSES = ('Выдан', 'Отменен')
+ARCHIVE_COLUMNS = ('id', 'order_number', 'order_date', 'client_name', 'phone',
+                   'status', 'amount', 'delivery_method', 'pickup_point', 'version')
+DEFAULT_ARCHIVE_AFTER_DAYS = 90   # 0 - не переносить
+DEFAULT_BATCH_SIZE = 5000         # заказов в одной транзакции переноса
+DEFAULT_INTERVAL = 600            # секунд между проверками
+BATCH_PAUSE = 0.05                # секунд между пакетами: записи API не ждут весь перенос
+
+# Триггеры удаления из orders, которые не срабатывают при переносе в архив
+SKIPPED_TRIGGERS = ('stats_delete', 'rollup_delete', 'sync_delete')
+NOT_MOVING = "NOT (SELECT moving FROM archive_state WHERE id = 1)"
+
+_COLUMNS = ', '.join(ARCHIVE_COLUMNS)
+_STATUSES = ', '.join(f"'{status}'" for status in ARCHIVE_STATUSES)
+
+
+def _skip_triggers_while_moving(conn):
+    # Условие WHEN дописывается к уже созданным триггерам
+    for name in SKIPPED_TRIGGERS:
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,)).fetchone()
+        if row is None or NOT_MOVING in row[0]:
+            continue
+        conn.execute(f"DROP TRIGGER {name}")
+        conn.execute(re.sub(r'\bBEGIN\b', f'WHEN {NOT_MOVING} BEGIN', row[0], count=1))
+
+
+# Миграция основной БД
+ARCHIVE_STATE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS archive_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        moving INTEGER NOT NULL DEFAULT 0,
+        archived INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    "INSERT OR IGNORE INTO archive_state (id) VALUES (1)",
+    _skip_triggers_while_moving,
+]
+
+def _unique_number_index(conn):
+    # Номер заказа уникален и среди архивных. Прежний неуникальный индекс
+    # заменяется, если в архиве еще нет повторов номера (их могли оставить
+    # заказы, созданные с номером архивного до проверки при создании)
+    row = conn.execute("SELECT sql FROM archive.sqlite_master WHERE type = 'index' AND name = 'idx_orders_number'"
+                       ).fetchone()
+    if row is not None and row[0].startswith('CREATE UNIQUE'):
+        return
+    if conn.execute("SELECT 1 FROM archive.orders GROUP BY order_number HAVING count(*) > 1 LIMIT 1").fetchone():
+        print("✗ В архиве есть повторяющиеся номера заказов: индекс номеров остается неуникальным")
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_orders_number ON orders (order_number)")
+        return
+    conn.execute("DROP INDEX IF EXISTS archive.idx_orders_number")
+    conn.execute("CREATE UNIQUE INDEX archive.idx_orders_number ON orders (order_number)")
+
+
+# Схема файла архива
+ARCHIVE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS archive.orders (
+        id INTEGER PRIMARY KEY,
+        order_number TEXT NOT NULL,
+        order_date TEXT NOT NULL,
+        client_name TEXT NOT NULL,
+        phone TEXT NOT NULL,
+        status TEXT NOT NULL,
+        amount REAL NOT NULL,
+        delivery_method TEXT NOT NULL,
+        pickup_point TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        archived_at TEXT NOT NULL
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS archive.idx_orders_date ON orders (order_date)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_orders_status_date ON orders (status, order_date)",
+    _unique_number_index,
+]
+
+
+def archive_path(db_path):
+    """Файл архива рядом с основной БД"""
+    base, ext = os.path.splitext(db_path)
+    return f'{base}_archive{ext or ".db"}'
+
+
+def attachments(db_path):
+    """Присоединяемые БД для ConnectionPool(attach=...)"""
+    return {'archive': archive_path(db_path)}
+
+
+def ensure_schema(conn):
+    """Создание таблицы архива, если ее еще нет"""
+    for step in ARCHIVE_SCHEMA:
+        if callable(step):
+            step(conn)
+        else:
+            conn.execute(step)
+
+
+def is_available(conn):
+    """Присоединен ли архив к соединению и создана ли в нем таблица"""
+    if not any(row[1] == 'archive' for row in conn.execute("PRAGMA database_list")):
+        return False
+    return conn.execute(
+        "SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'orders'").fetchone() is not None
+
+
+def orders_source(conn):
+    """Источник всех заказов для пересчета агрегатов: рабочие и архивные"""
+    if not is_available(conn):
+        return 'orders'
+    return f"(SELECT {_COLUMNS} FROM orders UNION ALL SELECT {_COLUMNS} FROM archive.orders)"
+
+
+def find_order(conn, order_id=None, order_number=None):
+    """Архивный заказ по id или номеру либо None"""
+    if order_number is not None:
+        return conn.execute(f"SELECT {_COLUMNS} FROM archive.orders WHERE order_number = ?",
+                            (order_number,)).fetchone()
+    return conn.execute(f"SELECT {_COLUMNS} FROM archive.orders WHERE id = ?", (order_id,)).fetchone()
+
+
+def archive_batch(conn, cutoff, batch_size=DEFAULT_BATCH_SIZE):
+    """Перенос в архив до batch_size закрытых заказов с датой раньше cutoff.
+
+    Выполняется в транзакции записи conn. Возвращает число перенесенных.
+    """
+    # Заказ с номером другого, уже архивного заказа (созданный до проверки
+    # номеров по архиву) остается в рабочей таблице: замена в архиве
+    # удалила бы прежний
+    ids = [row[0] for row in conn.execute(f'''
+        SELECT id FROM orders
+        WHERE status IN ({_STATUSES}) AND order_date < ?
+          AND NOT EXISTS (SELECT 1 FROM archive.orders a
+                          WHERE a.order_number = orders.order_number AND a.id != orders.id)
+        ORDER BY order_date LIMIT ?
+    ''', (cutoff, batch_size))]
+    if not ids:
+        return 0
+    ids = json.dumps(ids)
+    conn.execute("UPDATE archive_state SET moving = 1 WHERE id = 1")
+    # В режиме WAL транзакция над двумя файлами фиксируется в каждом
+    # отдельно: после сбоя строки могут остаться в обоих, и следующий
+    # перенос заменит их копии в архиве
+    conn.execute(f'''
+        INSERT OR REPLACE INTO archive.orders ({_COLUMNS}, archived_at)
+        SELECT {_COLUMNS}, ? FROM orders WHERE id IN (SELECT value FROM json_each(?))
+    ''', (datetime.datetime.now().isoformat(), ids))
+    moved = conn.execute("DELETE FROM orders WHERE id IN (SELECT value FROM json_each(?))", (ids,)).rowcount
+    conn.execute("UPDATE archive_state SET moving = 0, archived = archived + ? WHERE id = 1", (moved,))
+    # Новая версия данных: ETag списков заказов меняется, изменений для
+    # синхронизации при этом нет
+    conn.execute("UPDATE sync_state SET version = version + 1 WHERE id = 1")
+    return moved
+
+
+class Archiver:
+    """Фоновый перенос закрытых заказов в архив пакетами"""
+
+    def __init__(self, pool, after_days=DEFAULT_ARCHIVE_AFTER_DAYS, batch_size=DEFAULT_BATCH_SIZE,
+                 interval=DEFAULT_INTERVAL):
+        self.pool = pool
+        self.after_days = after_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.archived = 0
+        self.runs = 0
+        self.last_run = None
+
+    def start(self):
+        if not self.after_days:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='pvz-archiver', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def run_once(self):
+        """Перенос всех подходящих заказов пакетами. Возвращает их число"""
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=self.after_days)).isoformat()
+        with self.pool.writer() as conn:
+            ensure_schema(conn)
+        total = 0
+        while not self._stop.is_set():
+            with self.pool.writer() as conn:
+                moved = archive_batch(conn, cutoff, self.batch_size)
+            total += moved
+            if moved < self.batch_size:
+                break
+            time.sleep(BATCH_PAUSE)
+        with self._lock:
+            self.archived += total
+            self.runs += 1
+            self.last_run = time.time()
+        return total
+
+    def stats(self):
+        with self._lock:
+            return {'archived': self.archived, 'runs': self.runs, 'last_run': self.last_run}
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                moved = self.run_once()
+                if moved:
+                    print(f"✓ В архив перенесено заказов: {moved}")
+            except Exception as e:
+                print(f"✗ Ошибка переноса в архив: {e}")
+            self._stop.wait(self.interval)
\ No newline at end of file
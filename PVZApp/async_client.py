@@ -0,0 +1,396 @@
+import asyncio
+import collections
+import gzip
+import json
+import random
+import sys
+import urllib.parse
+import uuid
+import zlib
+
+# Асинхронный клиент API ПВЗ для скриптов сверки: те же методы, что у
+# PVZClient, но запросы выполняются конкурентно через пул постоянных
+# соединений. Протокол HTTP/1.1 реализован поверх asyncio streams, чтобы
+# обойтись стандартной библиотекой.
+DEFAULT_MAX_CONNECTIONS = 16  # как рабочих потоков у сервера по умолчанию
+DEFAULT_RETRIES = 3
+DEFAULT_TIMEOUT = 30          # секунд на один запрос
+BACKOFF_BASE = 0.1            # секунд перед первым повтором, дальше вдвое больше
+BACKOFF_MAX = 5
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+# 503 (сервер занят) и 429 (превышен темп клиента) сервер отвечает до
+# обработки запроса, поэтому такой запрос можно повторить любым методом
+# не раньше Retry-After; 502/504 и сбой соединения -
+# только идемпотентный. POST запросы идут с Idempotency-Key: сервер не
+# выполняет повтор второй раз, поэтому их тоже можно повторять
+RETRY_ANY_STATUSES = (429, 503)
+RETRY_IDEMPOTENT_STATUSES = (502, 504)
+# Сколько последних ответов GET хранить для повторных запросов с
+# If-None-Match: get_orders_many и страницы списка не копят их без предела
+ETAG_CACHE_SIZE = 64
+
+
+class Response:
+    __slots__ = ('status', 'headers', 'body', 'keep_alive')
+
+    def __init__(self, status, headers, body, keep_alive):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.keep_alive = keep_alive
+
+
+class Connection:
+    """Одно соединение HTTP/1.1 с сервером"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        # Пришел ли хоть один байт ответа на текущий запрос
+        self.response_started = False
+
+    @classmethod
+    async def open(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    def close(self):
+        self.writer.close()
+
+    async def request(self, method, target, host, body=None, headers=None):
+        """Отправка запроса и чтение ответа целиком"""
+        self.response_started = False
+        lines = [f'{method} {target} HTTP/1.1', f'Host: {host}', 'Accept-Encoding: gzip, deflate']
+        lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        if body is not None:
+            lines.append(f'Content-Length: {len(body)}')
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b''))
+        await self.writer.drain()
+        return await self.read_response(method)
+
+    async def read_response(self, method):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by server')
+        self.response_started = True
+        version, status = status_line.decode('latin-1').split(None, 2)[:2]
+        status = int(status)
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+        if method == 'HEAD' or status in (204, 304) or status < 200:
+            body = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await self._read_chunked()
+        elif 'content-length' in headers:
+            body = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            # Тело до закрытия соединения
+            body = await self.reader.read()
+            keep_alive = False
+
+        encoding = headers.get('content-encoding')
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        elif encoding == 'deflate':
+            body = zlib.decompress(body)
+        return Response(status, headers, body, keep_alive)
+
+    async def _read_chunked(self):
+        parts = []
+        while True:
+            size = int((await self.reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # Необязательные заголовки после последнего блока
+                while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(parts)
+            parts.append(await self.reader.readexactly(size))
+            await self.reader.readexactly(2)
+
+
+class ConnectionPool:
+    """Ограниченный пул постоянных соединений с одним сервером"""
+
+    def __init__(self, host, port, max_connections=DEFAULT_MAX_CONNECTIONS):
+        self.host = host
+        self.port = port
+        self._slots = asyncio.Semaphore(max_connections)
+        self._idle = []
+
+    async def request(self, method, target, body=None, headers=None):
+        """Запрос по свободному соединению; ждет, если все соединения заняты"""
+        async with self._slots:
+            while True:
+                connection, reused = self._take()
+                if connection is None:
+                    connection = await Connection.open(self.host, self.port)
+                try:
+                    response = await connection.request(method, target, f'{self.host}:{self.port}', body, headers)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    connection.close()
+                    # Сервер закрыл простаивавшее соединение, не получив
+                    # запроса: повторяем по новому соединению
+                    if reused and not connection.response_started:
+                        continue
+                    raise
+                except BaseException:
+                    connection.close()
+                    raise
+                if response.keep_alive:
+                    self._idle.append(connection)
+                else:
+                    connection.close()
+                return response
+
+    def _take(self):
+        # Последнее возвращенное соединение - с наименьшей вероятностью закрыто сервером
+        while self._idle:
+            connection = self._idle.pop()
+            if not connection.reader.at_eof():
+                return connection, True
+            connection.close()
+        return None, False
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+            try:
+                await connection.writer.wait_closed()
+            except OSError:
+                pass
+
+
+class AsyncPVZClient:
+    """Асинхронный клиент API с методами PVZClient.
+
+    Используется как async with AsyncPVZClient() as client. Запросы
+    ограничены пулом из max_connections соединений; временные ошибки
+    (сбой соединения, 429, 503, таймаут) повторяются до retries раз с
+    экспоненциальной задержкой.
+    """
+
+    def __init__(self, host='localhost', port=8000, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 concurrency=None, retries=DEFAULT_RETRIES, timeout=DEFAULT_TIMEOUT):
+        self.base_url = f'http://{host}:{port}'
+        self.concurrency = concurrency or max_connections
+        self.retries = retries
+        self.timeout = timeout
+        self._pool = ConnectionPool(host, port, max_connections)
+        # Последние ответы на GET запросы с их ETag: при 304 ответ берется
+        # отсюда. В порядке последнего обращения, не больше ETAG_CACHE_SIZE
+        self._etag_cache = collections.OrderedDict()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Закрытие соединений пула"""
+        await self._pool.close()
+
+    async def make_request(self, method, endpoint, data=None):
+        """Выполнение HTTP запроса с повторами при временных ошибках"""
+        headers = {}
+        body = None
+        if data:
+            body = json.dumps(data).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if method == 'POST':
+            # Один ключ на все попытки одной операции
+            headers['Idempotency-Key'] = uuid.uuid4().hex
+        safe = method in IDEMPOTENT_METHODS or 'Idempotency-Key' in headers
+
+        cached = self._etag_cache.get(endpoint) if method == 'GET' else None
+        if cached:
+            self._etag_cache.move_to_end(endpoint)
+            headers['If-None-Match'] = cached[0]
+
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            try:
+                response = await asyncio.wait_for(
+                    self._pool.request(method, endpoint, body, headers), self.timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                # Запрос мог быть выполнен: неидемпотентный не повторяем
+                if last_attempt or not safe:
+                    print(f"Error: {e!r}")
+                    return None
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+
+            retryable = response.status in RETRY_ANY_STATUSES or (
+                response.status in RETRY_IDEMPOTENT_STATUSES and safe)
+            if retryable and not last_attempt:
+                await asyncio.sleep(self._backoff(attempt, response.headers.get('retry-after')))
+                continue
+            break
+
+        if response.status == 304 and cached:
+            # Данные не изменились с прошлого запроса
+            return cached[1]
+        if response.status >= 300:
+            print(f"HTTP Error {response.status}: {response.body.decode('utf-8')}")
+            return None
+
+        result = json.loads(response.body.decode('utf-8'))
+        etag = response.headers.get('etag')
+        if method == 'GET' and etag:
+            self._etag_cache[endpoint] = (etag, result)
+            self._etag_cache.move_to_end(endpoint)
+            if len(self._etag_cache) > ETAG_CACHE_SIZE:
+                self._etag_cache.popitem(last=False)
+        return result
+
+    @staticmethod
+    def _backoff(attempt, retry_after=None):
+        # Случайная доля задержки, чтобы повторы многих запросов не приходили разом
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1)
+        try:
+            return max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            return delay
+
+    async def fan_out(self, function, items):
+        """Конкурентный вызов function(item) для всех items.
+
+        Одновременно выполняется не больше concurrency вызовов. Результаты
+        возвращаются в порядке items.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(item):
+            async with semaphore:
+                return await function(item)
+
+        return await asyncio.gather(*(run(item) for item in items))
+
+    async def get_orders(self, status=None, search=None, limit=None, cursor=None, fields=None):
+        """Получение списка заказов (одна страница, если задан limit или cursor)"""
+        params = {}
+        if status:
+            params['status'] = status
+        if search:
+            params['search'] = search
+        if limit:
+            params['limit'] = limit
+        if cursor:
+            params['cursor'] = cursor
+        if fields:
+            params['fields'] = ','.join(fields)
+        endpoint = f'/api/orders?{urllib.parse.urlencode(params)}' if params else '/api/orders'
+        return await self.make_request('GET', endpoint)
+
+    async def iter_orders(self, status=None, search=None, page_size=500, fields=None):
+        """Постраничный обход заказов (async for)"""
+        cursor = None
+        while True:
+            page = await self.get_orders(status=status, search=search, limit=page_size,
+                                         cursor=cursor, fields=fields)
+            if not page:
+                return
+            for order in page['orders']:
+                yield order
+            cursor = page['next_cursor']
+            if not cursor:
+                return
+
+    async def get_changes(self, since=0, limit=None):
+        """Изменения заказов после версии since"""
+        params = {'since': since}
+        if limit:
+            params['limit'] = limit
+        return await self.make_request('GET', f'/api/orders/changes?{urllib.parse.urlencode(params)}')
+
+    async def sync_replica(self, replica, version=0):
+        """Обновление локальной копии заказов {id: заказ}. Возвращает новую версию"""
+        while True:
+            result = await self.get_changes(since=version)
+            if not result:
+                return version
+            for order in result['changes']:
+                replica[order['id']] = order
+            for order in result['deleted']:
+                replica.pop(order['id'], None)
+            version = result['version']
+            if not result['has_more']:
+                return version
+
+    async def get_order(self, order_id):
+        """Получение конкретного заказа"""
+        return await self.make_request('GET', f'/api/orders/{order_id}')
+
+    async def get_order_by_number(self, order_number):
+        """Получение заказа по номеру"""
+        return await self.make_request('GET', f'/api/orders/by-number/{urllib.parse.quote(order_number)}')
+
+    async def get_orders_many(self, order_ids):
+        """Заказы по списку id (None для ненайденных) в том же порядке"""
+        return await self.fan_out(self.get_order, order_ids)
+
+    async def get_stats(self):
+        """Получение статистики"""
+        return await self.make_request('GET', '/api/stats')
+
+    async def create_order(self, order_data):
+        """Создание заказа"""
+        return await self.make_request('POST', '/api/orders', order_data)
+
+    async def issue_order(self, order_id):
+        """Выдача заказа"""
+        return await self.make_request('POST', '/api/orders/issue', {'order_id': order_id})
+
+    async def cancel_order(self, order_id, reason=''):
+        """Отмена заказа"""
+        return await self.make_request('POST', '/api/orders/cancel', {'order_id': order_id, 'reason': reason})
+
+    async def create_orders(self, orders):
+        """Создание пакета заказов: {'results': [...], 'created': N, 'failed': M}"""
+        return await self.make_request('POST', '/api/orders/bulk', orders)
+
+    async def issue_orders(self, order_ids):
+        """Выдача пакета заказов одним запросом"""
+        return await self.make_request('POST', '/api/orders/issue/bulk', {'order_ids': list(order_ids)})
+
+    async def cancel_orders(self, order_ids):
+        """Отмена пакета заказов одним запросом"""
+        return await self.make_request('POST', '/api/orders/cancel/bulk', {'order_ids': list(order_ids)})
+
+    async def update_status(self, order_id, status):
+        """Обновление статуса"""
+        return await self.make_request('PUT', f'/api/orders/{order_id}/status', {'status': status})
+
+    async def update_status_many(self, updates):
+        """Обновление статусов {id: статус} или [(id, статус), ...]; результаты по порядку"""
+        items = updates.items() if isinstance(updates, dict) else updates
+        return await self.fan_out(lambda item: self.update_status(*item), list(items))
+
+    async def delete_order(self, order_id):
+        """Удаление заказа"""
+        return await self.make_request('DELETE', f'/api/orders/{order_id}')
+
+
+async def main(order_ids):
+    """Пример: конкурентная загрузка заказов по id"""
+    async with AsyncPVZClient() as client:
+        orders = await client.get_orders_many(order_ids)
+        found = [order for order in orders if order]
+        print(f"✓ Получено {len(found)} из {len(order_ids)} заказов")
+        for order in found[:10]:
+            print(f"  {order['order_number']:<12} {order['status']:<15} {order['amount']:>10.2f}")
+
+
+if __name__ == '__main__':
+    ids = [int(value) for value in sys.argv[1:]] or list(range(1, 7))
+    asyncio.run(main(ids))
\ No newline at end of file
@@ -0,0 +1,325 @@
+import asyncio
+import concurrent.futures
+import io
+import json
+import socket
+import sys
+import threading
+import traceback
+
+# HTTP сервер на asyncio для обработчиков http.server.
+# Соединения обслуживает один цикл событий: простаивающее постоянное
+# соединение или подписчик /api/events - это корутина, а не занятый поток,
+# поэтому открытых соединений могут быть тысячи. Цикл читает запрос
+# целиком (заголовки и тело по Content-Length) и передает его обработчику
+# в ограниченный пул потоков: маршруты, проверки и работа с SQLite
+# остаются прежними и блокирующими, но потоков ровно workers, а ждать
+# потока могут не больше queue_size запросов (сверх них - 503). Ответ
+# обработчика копится в памяти и отправляется циклом; большие потоковые
+# ответы уходят частями по FLUSH_SIZE с ожиданием отправки, как раньше.
+#
+# Обработчик - подкласс http.server.BaseHTTPRequestHandler с примесью
+# AsyncHandlerMixin: вместо сокета он получает AsyncConnection с тем же
+# интерфейсом, а долгие ответы передает циклу через detach_request().
+DEFAULT_WORKERS = 16             # потоков для обработчиков
+DEFAULT_MAX_CONNECTIONS = 10000  # открытых соединений, сверх них - 503
+DEFAULT_KEEPALIVE_TIMEOUT = 60   # секунд простоя постоянного соединения
+DEFAULT_BACKLOG = 1024           # очередь ядра на listen()
+DEFAULT_QUEUE_SIZE = 64          # запросов, ждущих свободного потока, сверх них - 503
+MAX_HEADER_SIZE = 64 * 1024      # байт в строке запроса и заголовках
+FLUSH_SIZE = 256 * 1024          # байт ответа, после которых обработчик ждет отправки
+DRAIN_TIMEOUT = 30
+
+
+def _canned_response(status, reason, error, headers=b''):
+    body = json.dumps({'error': error}).encode()
+    return (b'HTTP/1.0 %d %s\r\nContent-Type: application/json\r\n%sContent-Length: %d\r\n\r\n%s'
+            % (status, reason, headers, len(body), body))
+
+
+BUSY_RESPONSE = _canned_response(503, b'Service Unavailable', 'Server is busy', b'Retry-After: 1\r\n')
+HEADER_TOO_LARGE_RESPONSE = _canned_response(431, b'Request Header Fields Too Large', 'Request header too large')
+
+
+def request_framing(head):
+    """Длина тела запроса по заголовкам и нужен ли ответ 100 Continue.
+
+    Возвращает (length, expect_continue, framed): framed=False - конец
+    тела неизвестен (chunked или неверный Content-Length), и соединение
+    закрывается после ответа.
+    """
+    length = 0
+    expect_continue = False
+    framed = True
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'content-length':
+            try:
+                length = int(value)
+            except ValueError:
+                framed = False
+            if length < 0:
+                length = 0
+                framed = False
+        elif name == b'transfer-encoding':
+            framed = False
+        elif name == b'expect':
+            expect_continue = value.strip().lower() == b'100-continue'
+    if not framed:
+        length = 0
+    return length, expect_continue, framed
+
+
+class AsyncConnection:
+    """Соединение asyncio с интерфейсом сокета для обработчика http.server.
+
+    Методы сокета вызываются обработчиком в рабочем потоке. Ответ копится
+    в буфере, который цикл событий отправляет после обработчика; если
+    буфер вырос до FLUSH_SIZE, обработчик ждет его отправки (не дольше
+    таймаута сокета).
+    """
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+        self.timeout = None
+        self.busy = False
+        # (target, args) долгого ответа, переданного циклу (detach_request)
+        self.detached = None
+        self._output = []
+        self._size = 0
+
+    # Интерфейс socket для socketserver.StreamRequestHandler.setup()
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def setsockopt(self, *args):
+        pass
+
+    def makefile(self, mode, buffering=None):
+        # Запрос обработчик получает в handle_request(); ответ пишется через sendall()
+        return io.BytesIO()
+
+    def sendall(self, data):
+        self._output.append(bytes(data))
+        self._size += len(data)
+        if self._size >= FLUSH_SIZE:
+            future = asyncio.run_coroutine_threadsafe(self.flush(), self.loop)
+            try:
+                future.result(self.timeout)
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                raise TimeoutError('timed out')
+
+    def close(self):
+        pass
+
+    async def flush(self):
+        """Отправка накопленного ответа (в цикле событий)"""
+        if not self._output:
+            return
+        data = b''.join(self._output)
+        self._output = []
+        self._size = 0
+        self.writer.write(data)
+        await self.writer.drain()
+
+
+class AsyncHandlerMixin:
+    """Примесь к обработчику http.server для AsyncHTTPServer.
+
+    Обработчик создается на соединение, но не обслуживает его сам:
+    каждый запрос сервер передает в handle_request() в рабочем потоке.
+    """
+
+    def handle(self):
+        pass
+
+    def finish(self):
+        pass
+
+    def handle_request(self, data):
+        """Обработка запроса data (заголовки и тело). Возвращает close_connection"""
+        self.rfile = io.BytesIO(data)
+        self.close_connection = True
+        self.handle_one_request()
+        return self.close_connection
+
+    def handle_expect_100(self):
+        # 100 Continue уже отправил цикл событий, прежде чем читать тело
+        return True
+
+    def close(self):
+        """Завершение обработчика при закрытии соединения"""
+        super().finish()
+
+
+class AsyncHTTPServer:
+    """HTTP сервер на asyncio с ограниченным пулом потоков для обработчиков.
+
+    Интерфейс как у socketserver: serve_forever() в основном потоке,
+    shutdown() из другого, затем drain() и server_close().
+    """
+
+    def __init__(self, server_address, handler_class, workers=DEFAULT_WORKERS,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT,
+                 queue_size=DEFAULT_QUEUE_SIZE, reuse_port=False):
+        self.handler_class = handler_class
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.socket = socket.create_server(server_address, backlog=DEFAULT_BACKLOG, reuse_port=reuse_port)
+        self.server_address = self.socket.getsockname()
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='pvz-worker')
+        self._loop = asyncio.new_event_loop()
+        self._stop = asyncio.Event()
+        self._stopped = threading.Event()
+        self._closing = False
+        self._connections = {}
+        # Запросов у пула потоков: обрабатываемых и ждущих потока (только в цикле событий)
+        self._pending = 0
+
+    def serve_forever(self):
+        """Прием соединений до shutdown()"""
+        self._stopped.clear()
+        try:
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._stopped.set()
+
+    def shutdown(self):
+        """Остановка приема соединений (из другого потока); ждет выхода из serve_forever"""
+        self._loop.call_soon_threadsafe(self._stop.set)
+        self._stopped.wait()
+
+    def drain(self, timeout=DRAIN_TIMEOUT):
+        """Закрытие простаивающих соединений и ожидание обрабатываемых запросов.
+
+        Вызывается после shutdown(). Возвращает True, если все запросы
+        успели завершиться.
+        """
+        return self._loop.run_until_complete(self._drain(timeout))
+
+    def server_close(self):
+        self.socket.close()
+        self._executor.shutdown(wait=False)
+        if not self._loop.is_running():
+            self._loop.close()
+
+    def keep_alive_allowed(self):
+        """Постоянные соединения держатся до остановки сервера"""
+        return not self._closing
+
+    def detach_request(self, request, target, *args):
+        """Передача соединения корутине target(writer, *args) после ответа обработчика.
+
+        Для долгих ответов (поток событий): корутина сама закрывает
+        writer, а рабочий поток сразу освобождается.
+        """
+        request.detached = (target, args)
+
+    def handle_error(self, client_address):
+        """Ошибка обработчика, как в socketserver"""
+        print('-' * 40, file=sys.stderr)
+        print('Exception occurred during processing of request from', client_address, file=sys.stderr)
+        traceback.print_exc()
+        print('-' * 40, file=sys.stderr)
+
+    async def _serve(self):
+        self._closing = False
+        server = await asyncio.start_server(self._handle_connection, sock=self.socket, limit=MAX_HEADER_SIZE)
+        try:
+            await self._stop.wait()
+        finally:
+            self._closing = True
+            # Новые соединения больше не принимаются; открытые обслуживаются в drain()
+            server.close()
+
+    async def _drain(self, timeout):
+        # Простаивающее соединение закрывается: ожидание запроса в нем
+        # завершится концом потока
+        for connection in list(self._connections.values()):
+            if not connection.busy:
+                connection.writer.close()
+        pending = set()
+        if self._connections:
+            _, pending = await asyncio.wait(list(self._connections), timeout=timeout)
+            for task in pending:
+                task.cancel()
+        # Закрытые транспорты освобождают сокеты на следующих итерациях цикла
+        await asyncio.sleep(0)
+        return not pending
+
+    async def _handle_connection(self, reader, writer):
+        if len(self._connections) >= self.max_connections or self._closing:
+            writer.write(BUSY_RESPONSE)
+            await self._close(writer)
+            return
+
+        loop = asyncio.get_running_loop()
+        connection = AsyncConnection(loop, writer)
+        client_address = writer.get_extra_info('peername')
+        self._connections[asyncio.current_task()] = connection
+        handler = self.handler_class(connection, client_address, self)
+        try:
+            while not self._closing:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keepalive_timeout)
+                except asyncio.LimitOverrunError:
+                    writer.write(HEADER_TOO_LARGE_RESPONSE)
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, OSError):
+                    # Клиент закрыл соединение или молчит дольше keepalive_timeout
+                    break
+
+                connection.busy = True
+                length, expect_continue, framed = request_framing(head)
+                body = b''
+                try:
+                    if length:
+                        if expect_continue:
+                            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+                        body = await asyncio.wait_for(reader.readexactly(length), connection.timeout)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, OSError):
+                    break
+
+                if self._pending >= self.workers + self.queue_size:
+                    # Потоки заняты и очередь к ним полна: отказ сразу, а не ожидание без предела
+                    writer.write(BUSY_RESPONSE)
+                    break
+                self._pending += 1
+                try:
+                    close = await loop.run_in_executor(self._executor, handler.handle_request, head + body)
+                except Exception:
+                    self.handle_error(client_address)
+                    close = True
+                finally:
+                    self._pending -= 1
+                await connection.flush()
+
+                if connection.detached:
+                    target, args = connection.detached
+                    await target(writer, *args)
+                    return
+                if close or not framed:
+                    break
+                connection.busy = False
+        except (OSError, asyncio.TimeoutError, asyncio.CancelledError):
+            # CancelledError - запрос не завершился за время drain()
+            pass
+        finally:
+            self._connections.pop(asyncio.current_task(), None)
+            handler.close()
+            if not connection.detached:
+                await self._close(writer)
+
+    @staticmethod
+    async def _close(writer):
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except (OSError, asyncio.CancelledError):
+            pass
\ No newline at end of file
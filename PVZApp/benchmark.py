@@ -0,0 +1,639 @@
+import argparse
+import concurrent.futures
+import datetime
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+from db_pool import ConnectionPool
+from migrations import migrate
+import import_orders
+import orders
+import split_shards
+
+# Нагрузочный тест API на синтетической базе.
+#
+# База нужного размера генерируется один раз и хранится в DATA_DIR;
+# перед каждым прогоном она копируется в отдельный каталог, где
+# запускается server.py, поэтому все прогоны начинаются с одних и тех
+# же данных. Клиенты - несколько процессов с потоками, каждый поток
+# отправляет следующий запрос сразу после ответа на предыдущий
+# (замкнутый цикл). Вид запроса выбирается случайно по весам смеси.
+#
+# Результат - пропускная способность, перцентили задержки по видам
+# запросов и память сервера - сохраняется в JSON; --compare сравнивает
+# его с прошлым прогоном и завершается с кодом 1 при регрессии.
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+DATA_DIR = 'bench_data'
+RESULTS_DIR = 'bench_results'
+DEFAULT_ORDERS = 100000
+DEFAULT_DURATION = 30        # секунд измерения
+DEFAULT_WARMUP = 5           # секунд прогрева, не входящих в результат
+DEFAULT_CONCURRENCY = 32     # одновременных запросов (потоков клиентов)
+DEFAULT_CLIENT_PROCESSES = min(4, os.cpu_count() or 1)
+DEFAULT_MIX = 'list=30,search=10,get=25,stats=10,create=10,issue=10,cancel=5'
+DEFAULT_TOLERANCE = 10       # допустимое ухудшение при сравнении, %
+DEFAULT_SEED = 1
+GENERATE_BATCH = 50000
+OPEN_ORDERS_SAMPLE = 200000  # открытых заказов для выдачи и отмены на прогон
+HOT_ORDERS = 1000            # последние заказы, которые запрашивают чаще остальных
+HOT_SHARE = 0.8
+SERVER_START_TIMEOUT = 300   # секунд, включая миграции большой базы
+MEMORY_SAMPLE_INTERVAL = 0.5
+REQUEST_TIMEOUT = 60
+PERCENTILES = (50, 90, 95, 99)
+
+OPERATIONS = ('list', 'search', 'get', 'stats', 'create', 'issue', 'cancel')
+
+# Синтетические заказы
+LAST_NAMES = ('Иванов', 'Петров', 'Сидоров', 'Козлов', 'Николаев', 'Соколов', 'Смирнов',
+              'Кузнецов', 'Попов', 'Васильев', 'Морозов', 'Новиков', 'Федоров', 'Волков')
+FIRST_NAMES = ('Иван', 'Анна', 'Алексей', 'Елена', 'Дмитрий', 'Мария', 'Сергей', 'Ольга')
+PICKUP_POINTS = tuple(f'ПВЗ №{number:03d}' for number in range(1, 51))
+DELIVERY_METHODS = ('Самовывоз', 'Курьер')
+# Большая часть истории - уже закрытые заказы
+STATUS_WEIGHTS = {'Выдан': 70, 'Отменен': 8, 'Ожидает выдачи': 10, 'Готов к выдаче': 12}
+HISTORY_DAYS = 365
+
+
+def generate_orders(count, seed):
+    """Параметры INSERT_ORDER_SQL для count синтетических заказов"""
+    rng = random.Random(seed)
+    now = datetime.datetime.now()
+    statuses = list(STATUS_WEIGHTS)
+    weights = list(itertools.accumulate(STATUS_WEIGHTS.values()))
+    for number in range(1, count + 1):
+        last_name = rng.choice(LAST_NAMES)
+        yield (
+            f'BN-{number:08d}',
+            (now - datetime.timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))).isoformat(),
+            f'{last_name} {rng.choice(FIRST_NAMES)}',
+            f'+7 (9{rng.randrange(100):02d}) {rng.randrange(1000):03d}-{rng.randrange(100):02d}-{rng.randrange(100):02d}',
+            rng.choices(statuses, cum_weights=weights)[0],
+            round(rng.uniform(100, 50000), 2),
+            rng.choice(DELIVERY_METHODS),
+            rng.choice(PICKUP_POINTS),
+        )
+
+
+def build_database(path, count, seed):
+    """Создание базы с count заказами.
+
+    Заказы пишутся так же, как в import_orders: без вторичных индексов и
+    триггеров, которые затем создаются и пересчитываются за один проход.
+    База собирается во временном файле, поэтому прерванная генерация не
+    оставляет неполной базы.
+    """
+    temporary = path + '.tmp'
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(temporary + suffix):
+            os.remove(temporary + suffix)
+
+    started = time.monotonic()
+    pool = ConnectionPool(temporary)
+    try:
+        with pool.writer() as conn:
+            for _ in migrate(conn):
+                pass
+            deferred = import_orders.defer_schema(conn)
+
+        rows = generate_orders(count, seed)
+        written = 0
+        while True:
+            batch = list(itertools.islice(rows, GENERATE_BATCH))
+            if not batch:
+                break
+            with pool.writer() as conn:
+                conn.executemany(orders.INSERT_ORDER_SQL, batch)
+            written += len(batch)
+            print(f"  {written} заказов, {written / (time.monotonic() - started):.0f} заказов/с")
+
+        print("Восстановление индексов, поиска и статистики...")
+        with pool.writer() as conn:
+            import_orders.restore_schema(conn, deferred, 0)
+    finally:
+        # Закрытие последнего соединения переносит журнал WAL в файл базы
+        pool.close_all()
+
+    os.replace(temporary, path)
+    print(f"✓ База на {count} заказов создана за {time.monotonic() - started:.1f} с")
+
+
+def prepare_run(data_dir, orders_count, seed, regenerate=False):
+    """Копия исходной базы нужного размера в каталоге прогона. Возвращает путь к каталогу"""
+    os.makedirs(data_dir, exist_ok=True)
+    source = os.path.join(data_dir, f'orders-{orders_count}-seed{seed}.db')
+    if regenerate or not os.path.exists(source):
+        print(f"Генерация базы на {orders_count} заказов...")
+        build_database(source, orders_count, seed)
+
+    run_dir = os.path.join(data_dir, 'run')
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+    shutil.copyfile(source, os.path.join(run_dir, 'pvz_database.db'))
+    return run_dir
+
+
+def load_workload_data(db_path, seed):
+    """Наибольший id и случайная выборка открытых заказов для выдачи и отмены"""
+    conn = sqlite3.connect(db_path)
+    try:
+        max_id = conn.execute("SELECT ifnull(max(id), 0) FROM orders").fetchone()[0]
+        open_ids = [row[0] for row in conn.execute(
+            f"SELECT id FROM orders WHERE status NOT IN ({', '.join('?' * len(orders.CLOSED_STATUSES))})",
+            orders.CLOSED_STATUSES)]
+    finally:
+        conn.close()
+    rng = random.Random(seed)
+    if len(open_ids) > OPEN_ORDERS_SAMPLE:
+        open_ids = rng.sample(open_ids, OPEN_ORDERS_SAMPLE)
+    else:
+        rng.shuffle(open_ids)
+    return max_id, open_ids
+
+
+def start_server(run_dir, server_args):
+    """Запуск server.py в каталоге прогона. Возвращает (процесс, адрес)"""
+    log_path = os.path.join(run_dir, 'server.log')
+    env = dict(os.environ, PYTHONIOENCODING='utf-8')
+    # Вывод сервера (и журнал запросов) идет в файл: канал без читателя
+    # переполнился бы и остановил сервер
+    with open(log_path, 'wb') as log:
+        process = subprocess.Popen([sys.executable, '-u', SERVER_SCRIPT, *server_args],
+                                   cwd=run_dir, stdout=log, stderr=subprocess.STDOUT, env=env)
+
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    address = None
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        with open(log_path, encoding='utf-8', errors='replace') as f:
+            match = re.search(r'Адрес: (http://\S+)', f.read())
+        if match:
+            address = match.group(1)
+            if probe(address):
+                return process, address
+        time.sleep(0.2)
+
+    stop_server(process)
+    raise RuntimeError(f"сервер не запустился, см. {log_path}")
+
+
+def probe(address):
+    """Отвечает ли сервер на запрос статистики"""
+    url = urllib.parse.urlsplit(address)
+    try:
+        conn = http.client.HTTPConnection(url.hostname, url.port, timeout=5)
+        conn.request('GET', '/api/stats')
+        ok = conn.getresponse().status == 200
+        conn.close()
+        return ok
+    except OSError:
+        return False
+
+
+def stop_server(process):
+    """Остановка сервера с завершением обрабатываемых запросов"""
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def process_memory(pid):
+    """Резидентная память процесса и его потомков, байт (None, если нет /proc)"""
+    if not os.path.isdir('/proc'):
+        return None
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(name))
+
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, ()))
+        try:
+            with open(f'/proc/{current}/statm') as f:
+                total += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+class MemorySampler(threading.Thread):
+    """Замеры памяти сервера во время прогона: начало, максимум, конец"""
+
+    def __init__(self, pid):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.start_bytes = process_memory(pid)
+        self.peak_bytes = self.last_bytes = self.start_bytes
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(MEMORY_SAMPLE_INTERVAL):
+            value = process_memory(self.pid)
+            if value is not None:
+                self.last_bytes = value
+                self.peak_bytes = max(self.peak_bytes or 0, value)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        return {'start_bytes': self.start_bytes, 'peak_bytes': self.peak_bytes, 'end_bytes': self.last_bytes}
+
+
+def parse_mix(text):
+    """Смесь запросов 'list=30,get=20,...' в словарь весов"""
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"неизвестный вид запроса {name!r}, допустимы: {', '.join(OPERATIONS)}")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise ValueError(f"вес {name} должен быть числом")
+        if mix[name] < 0:
+            raise ValueError(f"вес {name} не может быть отрицательным")
+    if not sum(mix.values()):
+        raise ValueError("все веса смеси нулевые")
+    return mix
+
+
+class Workload:
+    """Построение запросов одного потока клиента"""
+
+    def __init__(self, rng, max_id, open_ids, prefix):
+        self.rng = rng
+        self.max_id = max_id
+        # Общий для потоков процесса список: list.pop и append атомарны
+        self.open_ids = open_ids
+        self.prefix = prefix
+        self.created = 0
+
+    def request(self, operation):
+        """(метод, путь, тело) для запроса вида operation"""
+        rng = self.rng
+        if operation == 'list':
+            params = {'limit': 100}
+            if rng.random() < 0.7:
+                params['status'] = rng.choice(orders.STATUSES)
+            if rng.random() < 0.5:
+                params['pickup_point'] = rng.choice(PICKUP_POINTS)
+            if rng.random() < 0.3:
+                params['date_from'] = (datetime.date.today() - datetime.timedelta(days=rng.randrange(1, 31))).isoformat()
+            return 'GET', '/api/orders?' + urllib.parse.urlencode(params), None
+        if operation == 'search':
+            params = {'search': rng.choice(LAST_NAMES), 'limit': 50}
+            return 'GET', '/api/orders?' + urllib.parse.urlencode(params), None
+        if operation == 'get':
+            # Чаще всего смотрят недавние заказы
+            if rng.random() < HOT_SHARE:
+                order_id = max(1, self.max_id - rng.randrange(HOT_ORDERS))
+            else:
+                order_id = rng.randint(1, max(self.max_id, 1))
+            return 'GET', f'/api/orders/{order_id}', None
+        if operation == 'stats':
+            return 'GET', '/api/stats', None
+        if operation == 'create':
+            self.created += 1
+            return 'POST', '/api/orders', {
+                'order_number': f'{self.prefix}-{self.created}',
+                'client_name': f'{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)}',
+                'phone': '+7 (999) 000-00-00',
+                'amount': round(rng.uniform(100, 50000), 2),
+                'delivery_method': rng.choice(DELIVERY_METHODS),
+                'pickup_point': rng.choice(PICKUP_POINTS),
+            }
+        order_id = self.open_ids.pop() if self.open_ids else rng.randint(1, max(self.max_id, 1))
+        if operation == 'issue':
+            return 'POST', '/api/orders/issue', {'order_id': order_id}
+        return 'POST', '/api/orders/cancel', {'order_id': order_id, 'reason': 'benchmark'}
+
+
+def run_client(config):
+    """Один процесс клиентов: config['threads'] потоков до конца прогона.
+
+    Возвращает по видам запросов задержки (с) запросов, начатых в окне
+    измерения, число ответов по кодам и число сетевых ошибок.
+    """
+    address = urllib.parse.urlsplit(config['address'])
+    names = list(config['mix'])
+    weights = list(itertools.accumulate(config['mix'].values()))
+    measure_from = config['start_at'] + config['warmup']
+    stop_at = measure_from + config['duration']
+    open_ids = config['open_ids']
+    results = {name: {'latencies': [], 'statuses': {}, 'failures': 0} for name in names}
+    lock = threading.Lock()
+
+    def worker(index):
+        rng = random.Random(config['seed'] * 1000 + index)
+        workload = Workload(rng, config['max_id'], open_ids, f"BENCH-{config['run_id']}-{index}")
+        local = {name: {'latencies': [], 'statuses': {}, 'failures': 0} for name in names}
+        conn = http.client.HTTPConnection(address.hostname, address.port, timeout=REQUEST_TIMEOUT)
+        time.sleep(max(0, config['start_at'] - time.time()))
+        while True:
+            began = time.time()
+            if began >= stop_at:
+                break
+            operation = rng.choices(names, cum_weights=weights)[0]
+            method, path, body = workload.request(operation)
+            data = json.dumps(body).encode() if body is not None else None
+            headers = {'Content-Type': 'application/json'} if data is not None else {}
+            stats = local[operation]
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                response = conn.getresponse()
+                payload = response.read()
+                if response.will_close:
+                    conn.close()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                if began >= measure_from:
+                    stats['failures'] += 1
+                continue
+            elapsed = time.perf_counter() - started
+            if operation == 'create' and response.status == 201:
+                open_ids.append(json.loads(payload)['id'])
+            if began >= measure_from:
+                stats['latencies'].append(elapsed)
+                stats['statuses'][response.status] = stats['statuses'].get(response.status, 0) + 1
+        conn.close()
+        with lock:
+            for name, stats in local.items():
+                results[name]['latencies'].extend(stats['latencies'])
+                results[name]['failures'] += stats['failures']
+                for status, count in stats['statuses'].items():
+                    results[name]['statuses'][status] = results[name]['statuses'].get(status, 0) + count
+
+    threads = [threading.Thread(target=worker, args=(config['first_thread'] + i,))
+               for i in range(config['threads'])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def percentile(sorted_values, p):
+    """Перцентиль p (0-100) отсортированного списка, метод ближайшего ранга"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(latencies, statuses, failures, duration):
+    """Сводка по группе запросов; задержки в миллисекундах"""
+    latencies = sorted(latencies)
+    errors = failures + sum(count for status, count in statuses.items() if status >= 400)
+    summary = {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / duration,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'latency_ms': {f'p{p}': _ms(percentile(latencies, p)) for p in PERCENTILES},
+    }
+    summary['latency_ms']['mean'] = _ms(sum(latencies) / len(latencies)) if latencies else None
+    summary['latency_ms']['max'] = _ms(latencies[-1]) if latencies else None
+    return summary
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def run_benchmark(args, mix):
+    """Прогон: база, сервер, клиенты. Возвращает результат для JSON"""
+    run_dir = prepare_run(args.data_dir, args.orders, args.seed, args.regenerate)
+    max_id, open_ids = load_workload_data(os.path.join(run_dir, 'pvz_database.db'), args.seed)
+
+    # Бюджеты одновременных запросов остаются как в работе
+    server_args = ['--mode', args.mode, '--workers', str(args.workers)]
+    if args.processes:
+        server_args += ['--processes', str(args.processes)]
+    if args.shards:
+        # Заказы сохраняют id, поэтому выборка открытых заказов подходит и шардам
+        if split_shards.split_database(os.path.join(run_dir, 'pvz_database.db'),
+                                       os.path.join(run_dir, 'shards'), args.shards):
+            raise RuntimeError('не удалось разделить базу на шарды')
+        server_args += ['--shards-dir', 'shards']
+    for extra in args.server_arg:
+        server_args += extra.split()
+
+    process, address = start_server(run_dir, server_args)
+    print(f"✓ Сервер {address} ({' '.join(server_args)})")
+    try:
+        client_processes = max(1, min(args.client_processes, args.concurrency))
+        run_id = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        start_at = time.time() + 1
+        configs = []
+        for index in range(client_processes):
+            threads = args.concurrency // client_processes + (index < args.concurrency % client_processes)
+            configs.append({
+                'address': address,
+                'mix': mix,
+                'threads': threads,
+                'first_thread': sum(config['threads'] for config in configs),
+                'open_ids': open_ids[index::client_processes],
+                'max_id': max_id,
+                'seed': args.seed,
+                'run_id': run_id,
+                'start_at': start_at,
+                'warmup': args.warmup,
+                'duration': args.duration,
+            })
+
+        print(f"Нагрузка: {args.concurrency} потоков в {client_processes} процессах, "
+              f"прогрев {args.warmup:g} с, измерение {args.duration:g} с")
+        sampler = MemorySampler(process.pid)
+        sampler.start()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=client_processes) as executor:
+            parts = list(executor.map(run_client, configs))
+        memory = sampler.stop()
+    finally:
+        stop_server(process)
+
+    operations = {}
+    all_latencies, all_statuses, all_failures = [], {}, 0
+    for name in mix:
+        latencies = [value for part in parts for value in part[name]['latencies']]
+        statuses = {}
+        for part in parts:
+            for status, count in part[name]['statuses'].items():
+                statuses[status] = statuses.get(status, 0) + count
+                all_statuses[status] = all_statuses.get(status, 0) + count
+        failures = sum(part[name]['failures'] for part in parts)
+        operations[name] = summarize(latencies, statuses, failures, args.duration)
+        all_latencies += latencies
+        all_failures += failures
+
+    return {
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'orders': args.orders,
+            'seed': args.seed,
+            'concurrency': args.concurrency,
+            'client_processes': client_processes,
+            'duration': args.duration,
+            'warmup': args.warmup,
+            'mix': mix,
+            'server_args': server_args,
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'total': summarize(all_latencies, all_statuses, all_failures, args.duration),
+        'operations': operations,
+        'server_memory': memory,
+    }
+
+
+def print_report(result):
+    """Таблица результатов прогона"""
+    print("\n" + "=" * 86)
+    print(f"{'Запрос':<8} {'Запросов':>9} {'Ошибок':>7} {'Запр/с':>9} "
+          + ' '.join(f"{f'p{p} мс':>9}" for p in PERCENTILES) + f" {'max мс':>9}")
+    print("-" * 86)
+    rows = list(result['operations'].items()) + [('всего', result['total'])]
+    for name, summary in rows:
+        latency = summary['latency_ms']
+        print(f"{name:<8} {summary['requests']:>9} {summary['errors']:>7} {summary['throughput']:>9.1f} "
+              + ' '.join(_cell(latency[f'p{p}']) for p in PERCENTILES) + f" {_cell(latency['max'])}")
+    print("=" * 86)
+    memory = result['server_memory']
+    if memory['start_bytes'] is not None:
+        print(f"Память сервера: {memory['start_bytes'] / 2**20:.1f} МБ в начале, "
+              f"максимум {memory['peak_bytes'] / 2**20:.1f} МБ, в конце {memory['end_bytes'] / 2**20:.1f} МБ")
+    else:
+        print("Память сервера: недоступно на этой платформе")
+
+
+def _cell(value):
+    return f"{'-':>9}" if value is None else f"{value:>9.2f}"
+
+
+def compare(baseline, result, tolerance):
+    """Сравнение с прошлым прогоном. Возвращает число регрессий.
+
+    Регрессия - падение пропускной способности или рост p95 больше чем
+    на tolerance процентов.
+    """
+    if baseline['config'] != result['config']:
+        print("⚠ Параметры прогонов различаются, сравнение может быть неточным")
+    regressions = 0
+    print(f"\nСравнение с прогоном {baseline['created_at']} (допуск {tolerance:g}%):")
+    rows = [('всего', baseline['total'], result['total'])]
+    rows += [(name, baseline['operations'][name], summary)
+             for name, summary in result['operations'].items() if name in baseline['operations']]
+    for name, old, new in rows:
+        throughput = _change(old['throughput'], new['throughput'])
+        p95 = _change(old['latency_ms']['p95'], new['latency_ms']['p95'])
+        worse = (throughput is not None and throughput < -tolerance) or (p95 is not None and p95 > tolerance)
+        regressions += worse
+        print(f"  {'✗' if worse else '✓'} {name:<8} запр/с {old['throughput']:.1f} → {new['throughput']:.1f} "
+              f"({_percent(throughput)}), p95 {old['latency_ms']['p95']} → {new['latency_ms']['p95']} мс "
+              f"({_percent(p95)})")
+    return regressions
+
+
+def _change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) * 100 / old
+
+
+def _percent(value):
+    return '-' if value is None else f'{value:+.1f}%'
+
+
+def parse_args(argv=None):
+    """Разбор параметров командной строки"""
+    parser = argparse.ArgumentParser(description='Нагрузочный тест API ПВЗ на синтетической базе')
+    parser.add_argument('--orders', type=int, default=DEFAULT_ORDERS,
+                        help='заказов в синтетической базе (например, от 10000 до 10000000)')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='время измерения, с')
+    parser.add_argument('--warmup', type=float, default=DEFAULT_WARMUP, help='время прогрева, с')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='одновременных запросов')
+    parser.add_argument('--client-processes', type=int, default=DEFAULT_CLIENT_PROCESSES,
+                        help='процессов клиентов, между которыми делятся потоки')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help=f"веса видов запросов ({', '.join(OPERATIONS)})")
+    parser.add_argument('--mode', default='threads', help='режим сервера (--mode server.py)')
+    parser.add_argument('--workers', type=int, default=16, help='потоков в процессе сервера')
+    parser.add_argument('--processes', type=int, help='процессов сервера в режиме processes')
+    parser.add_argument('--shards', type=int, help='разделить базу на столько шардов по пунктам выдачи')
+    parser.add_argument('--server-arg', action='append', default=[],
+                        help="дополнительные параметры server.py, например '--write-batch 128'")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='зерно генерации данных и нагрузки')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='каталог синтетических баз')
+    parser.add_argument('--regenerate', action='store_true', help='создать синтетическую базу заново')
+    parser.add_argument('--output', help=f'файл результата (по умолчанию в {RESULTS_DIR}/)')
+    parser.add_argument('--compare', help='результат прошлого прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='допустимое ухудшение при сравнении, %%')
+    args = parser.parse_args(argv)
+    try:
+        args.mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.orders < 1 or args.concurrency < 1 or args.duration <= 0 or args.warmup < 0:
+        parser.error("--orders, --concurrency и --duration должны быть положительными")
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    try:
+        result = run_benchmark(args, args.mix)
+    except KeyboardInterrupt:
+        print("\n⏹ Прогон прерван")
+        sys.exit(130)
+    except RuntimeError as e:
+        print(f"✗ Ошибка: {e}")
+        sys.exit(1)
+
+    print_report(result)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"bench-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"✓ Результат сохранен в {output}")
+
+    if baseline and compare(baseline, result, args.tolerance):
+        sys.exit(1)
\ No newline at end of file
@@ -1,141 +1,348 @@
-﻿import urllib.request
-import urllib.parse
-import json
-import sys
-
-class PVZClient:
-    def __init__(self, host='localhost', port=8000):
-        self.base_url = f'http://{host}:{port}'
-    
-    def make_request(self, method, endpoint, data=None):
-        """Выполнение HTTP запроса"""
-        url = f'{self.base_url}{endpoint}'
-        
-        request = urllib.request.Request(url, method=method)
-        
-        if data:
-            data_bytes = json.dumps(data).encode('utf-8')
-            request.add_header('Content-Type', 'application/json')
-            request.data = data_bytes
-        
-        try:
-            with urllib.request.urlopen(request) as response:
-                response_data = response.read().decode('utf-8')
-                return json.loads(response_data)
-        except urllib.error.HTTPError as e:
-            error_data = e.read().decode('utf-8')
-            print(f"HTTP Error {e.code}: {error_data}")
-            return None
-        except Exception as e:
-            print(f"Error: {e}")
-            return None
-    
-    def get_orders(self, status=None, search=None):
-        """Получение списка заказов"""
-        params = {}
-        if status:
-            params['status'] = status
-        if search:
-            params['search'] = search
-        
-        query_string = urllib.parse.urlencode(params)
-        endpoint = f'/api/orders?{query_string}' if params else '/api/orders'
-        
-        return self.make_request('GET', endpoint)
-    
-    def get_order(self, order_id):
-        """Получение конкретного заказа"""
-        return self.make_request('GET', f'/api/orders/{order_id}')
-    
-    def get_stats(self):
-        """Получение статистики"""
-        return self.make_request('GET', '/api/stats')
-    
-    def create_order(self, order_data):
-        """Создание заказа"""
-        return self.make_request('POST', '/api/orders', order_data)
-    
-    def issue_order(self, order_id):
-        """Выдача заказа"""
-        return self.make_request('POST', '/api/orders/issue', {'order_id': order_id})
-    
-    def cancel_order(self, order_id, reason=''):
-        """Отмена заказа"""
-        return self.make_request('POST', '/api/orders/cancel', {'order_id': order_id, 'reason': reason})
-    
-    def update_status(self, order_id, status):
-        """Обновление статуса"""
-        return self.make_request('PUT', f'/api/orders/{order_id}/status', {'status': status})
-    
-    def delete_order(self, order_id):
-        """Удаление заказа"""
-        return self.make_request('DELETE', f'/api/orders/{order_id}')
-
-def print_orders(orders):
-    """Вывод заказов в консоль"""
-    if not orders:
-        print("Заказы не найдены")
-        return
-    
-    print("\n" + "="*100)
-    print(f"{'№':<4} {'Номер заказа':<12} {'Дата':<12} {'Клиент':<25} {'Статус':<15} {'Сумма':<10}")
-    print("-"*100)
-    
-    for i, order in enumerate(orders, 1):
-        print(f"{i:<4} {order['order_number']:<12} {order['order_date'][:10]:<12} "
-              f"{order['client_name'][:24]:<25} {order['status']:<15} {order['amount']:<10.2f}")
-    print("="*100)
-
-def main():
-    """Пример использования клиента"""
-    client = PVZClient()
-    
-    print("📦 Тестирование API ПВЗ")
-    print("="*50)
-    
-    # Получение статистики
-    print("\n📊 Статистика:")
-    stats = client.get_stats()
-    if stats:
-        for key, value in stats.items():
-            print(f"  {key}: {value}")
-    
-    # Получение всех заказов
-    print("\n📋 Все заказы:")
-    orders = client.get_orders()
-    print_orders(orders)
-    
-    # Фильтрация по статусу
-    print("\n🔍 Заказы со статусом 'Готов к выдаче':")
-    ready_orders = client.get_orders(status='Готов к выдаче')
-    print_orders(ready_orders)
-    
-    # Создание нового заказа
-    print("\n➕ Создание нового заказа:")
-    new_order = {
-        'order_number': 'ORD-007',
-        'client_name': 'Тестовый Клиент',
-        'phone': '+7 (999) 888-77-66',
-        'amount': 9999.99,
-        'delivery_method': 'Самовывоз',
-        'pickup_point': 'ПВЗ №001'
-    }
-    result = client.create_order(new_order)
-    if result:
-        print(f"✓ Заказ создан: {result}")
-    
-    # Поиск заказа
-    print("\n🔎 Поиск заказа 'ORD-001':")
-    found_orders = client.get_orders(search='ORD-001')
-    print_orders(found_orders)
-    
-    # Выдача заказа
-    if found_orders:
-        order_id = found_orders[0]['id']
-        print(f"\n📤 Выдача заказа ID {order_id}:")
-        result = client.issue_order(order_id)
-        if result:
-            print(f"✓ {result['message']}")
-
-if __name__ == '__main__':
+import collections
+import http.client
+import urllib.request
+import urllib.parse
+import gzip
+import json
+import sys
+import time
+import uuid
+import zlib
+
+# Повтор запроса после сбоя соединения или ответа 503/429 (не раньше
+# Retry-After). POST запросы
+# отправляются с Idempotency-Key, поэтому повтор уже выполненной записи
+# возвращает ее сохраненный ответ, а не выполняет ее второй раз
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+RETRY_DELAY = 0.2  # секунд перед первым повтором, дальше вдвое больше
+RETRY_STATUSES = (429, 503)
+# Сколько последних ответов GET хранить для повторных запросов с
+# If-None-Match: страницы списка и заказы по id не копятся без предела
+ETAG_CACHE_SIZE = 64
+
+class PVZClient:
+    def __init__(self, host='localhost', port=8000, timeout=30, retries=2):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.base_url = f'http://{host}:{port}'
+        # Одно постоянное соединение на все запросы клиента
+        self._connection = None
+        # Последние ответы на GET запросы с их ETag: при 304 ответ берется
+        # отсюда. В порядке последнего обращения, не больше ETAG_CACHE_SIZE
+        self._etag_cache = collections.OrderedDict()
+    
+    def close(self):
+        """Закрытие соединения с сервером"""
+        if self._connection:
+            self._connection.close()
+            self._connection = None
+    
+    def send(self, method, endpoint, body=None, headers=None):
+        """Запрос по постоянному соединению: (ответ, распакованное тело)"""
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            reused = self._connection.sock is not None
+            try:
+                self._connection.request(method, endpoint, body=body, headers=headers or {})
+                response = self._connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                # Сервер закрывает простаивающие соединения только между
+                # запросами, поэтому запрос по закрытому соединению не был
+                # выполнен и его можно повторить по новому
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                self.close()
+                raise
+            if response.will_close:
+                self.close()
+            
+            encoding = response.getheader('Content-Encoding')
+            if encoding == 'gzip':
+                data = gzip.decompress(data)
+            elif encoding == 'deflate':
+                data = zlib.decompress(data)
+            return response, data
+    
+    def make_request(self, method, endpoint, data=None):
+        """Выполнение HTTP запроса"""
+        headers = {'Accept-Encoding': 'gzip, deflate'}
+        body = None
+        if data:
+            body = json.dumps(data).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        
+        if method == 'POST':
+            # Один ключ на все попытки одной операции
+            headers['Idempotency-Key'] = uuid.uuid4().hex
+        
+        cached = self._etag_cache.get(endpoint) if method == 'GET' else None
+        if cached:
+            self._etag_cache.move_to_end(endpoint)
+            headers['If-None-Match'] = cached[0]
+        
+        for attempt in range(self.retries + 1):
+            retry = attempt < self.retries
+            delay = RETRY_DELAY * 2 ** attempt
+            try:
+                response, response_data = self.send(method, endpoint, body, headers)
+            except (OSError, http.client.HTTPException) as e:
+                if not retry or not (method in IDEMPOTENT_METHODS or 'Idempotency-Key' in headers):
+                    print(f"Error: {e}")
+                    return None
+            except Exception as e:
+                print(f"Error: {e}")
+                return None
+            else:
+                # 503 и 429 сервер отвечает, не начав обработку запроса
+                if response.status not in RETRY_STATUSES or not retry:
+                    break
+                retry_after = response.getheader('Retry-After', '')
+                if retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+            time.sleep(delay)
+        
+        if response.status == 304 and cached:
+            # Данные не изменились с прошлого запроса
+            return cached[1]
+        if response.status >= 300:
+            print(f"HTTP Error {response.status}: {response_data.decode('utf-8')}")
+            return None
+        
+        result = json.loads(response_data.decode('utf-8'))
+        etag = response.getheader('ETag')
+        if method == 'GET' and etag:
+            self._etag_cache[endpoint] = (etag, result)
+            self._etag_cache.move_to_end(endpoint)
+            if len(self._etag_cache) > ETAG_CACHE_SIZE:
+                self._etag_cache.popitem(last=False)
+        return result
+    
+    def get_orders(self, status=None, search=None, limit=None, cursor=None, fields=None):
+        """Получение списка заказов.
+        
+        Если задан limit или cursor, возвращается одна страница:
+        {'orders': [...], 'next_cursor': ...}
+        """
+        params = {}
+        if status:
+            params['status'] = status
+        if search:
+            params['search'] = search
+        if limit:
+            params['limit'] = limit
+        if cursor:
+            params['cursor'] = cursor
+        if fields:
+            params['fields'] = ','.join(fields)
+        
+        query_string = urllib.parse.urlencode(params)
+        endpoint = f'/api/orders?{query_string}' if params else '/api/orders'
+        
+        return self.make_request('GET', endpoint)
+    
+    def iter_orders(self, status=None, search=None, page_size=500, fields=None):
+        """Постраничный обход заказов: следующая страница запрашивается по мере чтения"""
+        cursor = None
+        while True:
+            page = self.get_orders(status=status, search=search, limit=page_size,
+                                   cursor=cursor, fields=fields)
+            if not page:
+                return
+            yield from page['orders']
+            cursor = page['next_cursor']
+            if not cursor:
+                return
+    
+    def get_changes(self, since=0, limit=None):
+        """Изменения заказов после версии since"""
+        params = {'since': since}
+        if limit:
+            params['limit'] = limit
+        return self.make_request('GET', f'/api/orders/changes?{urllib.parse.urlencode(params)}')
+    
+    def sync_replica(self, replica, version=0):
+        """Обновление локальной копии заказов {id: заказ} до текущей версии.
+        
+        Возвращает версию, которую нужно передать при следующей синхронизации.
+        """
+        while True:
+            result = self.get_changes(since=version)
+            if not result:
+                return version
+            for order in result['changes']:
+                replica[order['id']] = order
+            for order in result['deleted']:
+                replica.pop(order['id'], None)
+            version = result['version']
+            if not result['has_more']:
+                return version
+    
+    def iter_events(self, status=None, pickup_point=None, last_event_id=None):
+        """Изменения заказов по мере появления (/api/events).
+        
+        Генерирует (id, action, order); action='reset' означает, что часть
+        событий пропущена и локальную копию нужно догрузить через
+        sync_replica. При разрыве соединения переподключается с последним
+        полученным id. id события - непрозрачная строка (у сервера с
+        шардами это позиции шардов через точку, например "12.40"): она
+        возвращается серверу без изменений в Last-Event-ID.
+        """
+        params = {}
+        if status:
+            params['status'] = status
+        if pickup_point:
+            params['pickup_point'] = pickup_point
+        url = f'{self.base_url}/api/events?{urllib.parse.urlencode(params)}'
+        
+        while True:
+            request = urllib.request.Request(url)
+            if last_event_id is not None:
+                request.add_header('Last-Event-ID', last_event_id)
+            try:
+                with urllib.request.urlopen(request) as response:
+                    event_type, event_id, data = None, None, []
+                    for line in response:
+                        line = line.decode('utf-8').rstrip('\r\n')
+                        if line:
+                            field, _, value = line.partition(':')
+                            value = value[1:] if value.startswith(' ') else value
+                            if field == 'event':
+                                event_type = value
+                            elif field == 'id':
+                                event_id = value
+                            elif field == 'data':
+                                data.append(value)
+                            continue
+                        # Пустая строка завершает событие
+                        if event_type == 'reset':
+                            yield last_event_id, 'reset', None
+                        elif event_type == 'order' and data:
+                            event = json.loads('\n'.join(data))
+                            last_event_id = event_id
+                            yield event_id, event['action'], event['order']
+                        event_type, event_id, data = None, None, []
+            except (urllib.error.URLError, ConnectionError) as e:
+                print(f"Поток событий прерван: {e}")
+                time.sleep(3)
+    
+    def get_order(self, order_id):
+        """Получение конкретного заказа"""
+        return self.make_request('GET', f'/api/orders/{order_id}')
+    
+    def get_order_by_number(self, order_number):
+        """Получение заказа по номеру"""
+        return self.make_request('GET', f'/api/orders/by-number/{urllib.parse.quote(order_number)}')
+    
+    def get_stats(self):
+        """Получение статистики"""
+        return self.make_request('GET', '/api/stats')
+    
+    def create_order(self, order_data):
+        """Создание заказа"""
+        return self.make_request('POST', '/api/orders', order_data)
+    
+    def issue_order(self, order_id):
+        """Выдача заказа"""
+        return self.make_request('POST', '/api/orders/issue', {'order_id': order_id})
+    
+    def cancel_order(self, order_id, reason=''):
+        """Отмена заказа"""
+        return self.make_request('POST', '/api/orders/cancel', {'order_id': order_id, 'reason': reason})
+    
+    def create_orders(self, orders):
+        """Создание пакета заказов: {'results': [...], 'created': N, 'failed': M}"""
+        return self.make_request('POST', '/api/orders/bulk', orders)
+
+    def issue_orders(self, order_ids):
+        """Выдача пакета заказов"""
+        return self.make_request('POST', '/api/orders/issue/bulk', {'order_ids': list(order_ids)})
+
+    def cancel_orders(self, order_ids):
+        """Отмена пакета заказов"""
+        return self.make_request('POST', '/api/orders/cancel/bulk', {'order_ids': list(order_ids)})
+
+    def update_status(self, order_id, status):
+        """Обновление статуса"""
+        return self.make_request('PUT', f'/api/orders/{order_id}/status', {'status': status})
+    
+    def delete_order(self, order_id):
+        """Удаление заказа"""
+        return self.make_request('DELETE', f'/api/orders/{order_id}')
+
+def print_orders(orders):
+    """Вывод заказов в консоль"""
+    if not orders:
+        print("Заказы не найдены")
+        return
+    
+    print("\n" + "="*100)
+    print(f"{'№':<4} {'Номер заказа':<12} {'Дата':<12} {'Клиент':<25} {'Статус':<15} {'Сумма':<10}")
+    print("-"*100)
+    
+    for i, order in enumerate(orders, 1):
+        print(f"{i:<4} {order['order_number']:<12} {order['order_date'][:10]:<12} "
+              f"{order['client_name'][:24]:<25} {order['status']:<15} {order['amount']:<10.2f}")
+    print("="*100)
+
+def main():
+    """Пример использования клиента"""
+    client = PVZClient()
+    
+    print("📦 Тестирование API ПВЗ")
+    print("="*50)
+    
+    # Получение статистики
+    print("\n📊 Статистика:")
+    stats = client.get_stats()
+    if stats:
+        for key, value in stats.items():
+            print(f"  {key}: {value}")
+    
+    # Получение всех заказов
+    print("\n📋 Все заказы:")
+    orders = list(client.iter_orders(page_size=100))
+    print_orders(orders)
+    
+    # Фильтрация по статусу
+    print("\n🔍 Заказы со статусом 'Готов к выдаче':")
+    ready_orders = client.get_orders(status='Готов к выдаче')
+    print_orders(ready_orders)
+    
+    # Создание нового заказа
+    print("\n➕ Создание нового заказа:")
+    new_order = {
+        'order_number': 'ORD-007',
+        'client_name': 'Тестовый Клиент',
+        'phone': '+7 (999) 888-77-66',
+        'amount': 9999.99,
+        'delivery_method': 'Самовывоз',
+        'pickup_point': 'ПВЗ №001'
+    }
+    result = client.create_order(new_order)
+    if result:
+        print(f"✓ Заказ создан: {result}")
+    
+    # Поиск заказа
+    print("\n🔎 Поиск заказа 'ORD-001':")
+    found_orders = client.get_orders(search='ORD-001')
+    print_orders(found_orders)
+    
+    # Выдача заказа
+    if found_orders:
+        order_id = found_orders[0]['id']
+        print(f"\n📤 Выдача заказа ID {order_id}:")
+        result = client.issue_order(order_id)
+        if result:
+            print(f"✓ {result['message']}")
+    
+    client.close()
+
+if __name__ == '__main__':
     main()
\ No newline at end of file
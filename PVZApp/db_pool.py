@@ -0,0 +1,198 @@
+import sqlite3
+import threading
+import os
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# Настройки соединений SQLite
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 64 * 1024          # кэш страниц на соединение
+MMAP_SIZE = 256 * 1024 * 1024      # отображение файла БД в память
+SYNCHRONOUS = 'NORMAL'             # в режиме WAL достаточно для сохранности при сбое процесса
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, относящий время выполнения и чтения строк к фазе SQL запроса.
+
+    Если запрос HTTP запоминает свои SQL запросы (журнал медленных
+    запросов), время чтения строк добавляется к записи о запросе курсора.
+    """
+    _query = None
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._query = metrics.add_query(self.connection.pool, sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            self._query = metrics.add_query(self.connection.pool, sql, None, time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = None
+        try:
+            row = super().fetchone()
+            return row
+        finally:
+            metrics.add_rows(self._query, time.perf_counter() - started, row is not None)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = ()
+        try:
+            rows = super().fetchmany(self.arraysize if size is None else size)
+            return rows
+        finally:
+            metrics.add_rows(self._query, time.perf_counter() - started, len(rows))
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = ()
+        try:
+            rows = super().fetchall()
+            return rows
+        finally:
+            metrics.add_rows(self._query, time.perf_counter() - started, len(rows))
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, запросы которого идут через TimedCursor"""
+    # Пул, читатель которого это соединение (None - соединение записи)
+    pool = None
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            metrics.add('sql', time.perf_counter() - started)
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений с БД с разделением чтения и записи.
+
+    Каждый поток получает собственное соединение для чтения, которое живет
+    столько же, сколько поток. Запись идет через одно соединение,
+    защищенное блокировкой: SQLite все равно допускает только одного
+    писателя, а очередь на блокировке внутри процесса дешевле, чем
+    повторные попытки по SQLITE_BUSY. Благодаря WAL читатели не ждут
+    писателя и видят последнее зафиксированное состояние.
+
+    attach - присоединяемые к каждому соединению БД {схема: файл}.
+    """
+
+    def __init__(self, path, attach=None):
+        self.path = path
+        self.attach = attach or {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._writer = None
+        self._connections = []
+        self._pid = os.getpid()
+
+    def connect(self, readonly=False):
+        """Открытие нового соединения с настроенными параметрами"""
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                               factory=TimedConnection)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA synchronous = {SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        for schema, path in self.attach.items():
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+            conn.execute(f"PRAGMA {schema}.journal_mode = WAL")
+            conn.execute(f"PRAGMA {schema}.synchronous = {SYNCHRONOUS}")
+        if readonly:
+            conn.execute("PRAGMA query_only = ON")
+            conn.pool = self
+        return conn
+
+    def _check_pid(self):
+        # После fork() соединения родителя использовать нельзя
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._lock = threading.Lock()
+            self._write_lock = threading.Lock()
+            self._writer = None
+            self._connections = []
+            self._pid = os.getpid()
+
+    def _track(self, conn):
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """Соединение текущего потока для чтения"""
+        self._check_pid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._track(self.connect(readonly=True))
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+
+    @contextmanager
+    def writer(self):
+        """Транзакция записи: BEGIN IMMEDIATE, COMMIT при успехе, ROLLBACK при ошибке"""
+        self._check_pid()
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._track(self.connect())
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                try:
+                    conn.commit()
+                except BaseException:
+                    # Неудавшийся COMMIT (SQLITE_BUSY, нет места) оставляет
+                    # транзакцию открытой, и следующий BEGIN IMMEDIATE не выполнится
+                    if conn.in_transaction:
+                        conn.rollback()
+                    raise
+
+    def stats(self):
+        """Число открытых соединений"""
+        with self._lock:
+            return {'connections': len(self._connections), 'writer': self._writer is not None}
+
+    def close_all(self):
+        """Закрытие всех соединений пула"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._writer = None
+        self._local = threading.local()
\ No newline at end of file
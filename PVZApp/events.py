@@ -0,0 +1,331 @@
+import asyncio
+import collections
+import json
+import queue
+import threading
+
+from sync import current_version, changes_since, format_version
+
+# Рассылка изменений заказов подписчикам (Server-Sent Events).
+# Источник событий - журнал версий в БД (orders.version и order_tombstones),
+# поэтому подписчик получает изменения из всех рабочих процессов, а
+# идентификатор события (версия) подходит для Last-Event-ID при
+# переподключении к любому процессу. Обработчики записи вызывают
+# notify(): это будит опрос сразу и сообщает, что именно произошло
+# (created, issued, ...). Изменения из других процессов приходят с
+# задержкой не больше POLL_INTERVAL и с action='changed'.
+#
+# У каждого шарда (shards.py) свой журнал и своя рассылка. Подписчик
+# шардов подписан на все рассылки сразу, а идентификатор события для него -
+# версии всех шардов через точку (sync.format_version).
+RING_SIZE = 1000            # последних событий для Last-Event-ID
+POLL_INTERVAL = 1.0         # секунд между опросами журнала без notify()
+POLL_BATCH = 500
+# Неотправленных событий, после которых подписчик отключается. Очередь
+# хранит ссылки на общие для всех подписчиков события, поэтому запас на
+# целый пакет заказов (orders.MAX_BULK_ITEMS) стоит порядка 80 КБ
+SUBSCRIBER_QUEUE = 10000
+HEARTBEAT_INTERVAL = 15     # секунд тишины до комментария keepalive
+SEND_TIMEOUT = 10           # секунд на отправку одного события
+MAX_SUBSCRIBERS = 256
+# Подписчиков без отдельных потоков (stream_events_async): предел задает
+# уже стоимость рассылки каждого события всем подписчикам
+MAX_ASYNC_SUBSCRIBERS = 2048
+
+
+class Event:
+    __slots__ = ('id', 'shard', 'action', 'order', '_encoded')
+
+    def __init__(self, event_id, action, order, shard=0):
+        self.id = event_id
+        self.shard = shard
+        self.action = action
+        self.order = order
+        self._encoded = None
+
+    def encode(self):
+        """Событие в формате text/event-stream без строки id (сериализуется один раз на всех подписчиков)"""
+        if self._encoded is None:
+            data = json.dumps({'action': self.action, 'order': self.order})
+            self._encoded = f'event: order\ndata: {data}\n\n'.encode()
+        return self._encoded
+
+
+class Subscription:
+    """Подписчик с ограниченной очередью событий"""
+
+    def __init__(self, statuses=None, pickup_points=None, shards=1):
+        self.statuses = set(statuses or ())
+        self.pickup_points = set(pickup_points or ())
+        # Версия последнего отправленного события каждого шарда
+        self.positions = [0] * shards
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+        self.evicted = False
+        self.closed = False
+        # Вызывается из потока рассылки после каждого события в очереди
+        # (stream_events_async ждет событий без потока)
+        self.wakeup = None
+
+    def matches(self, event):
+        if self.statuses and event.order.get('status') not in self.statuses:
+            return False
+        if self.pickup_points and event.order.get('pickup_point') not in self.pickup_points:
+            return False
+        return True
+
+    def offer(self, event):
+        """Постановка события в очередь; при переполнении подписчик отключается"""
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.evicted = True
+            self.closed = True
+        if self.wakeup:
+            self.wakeup()
+
+    def close(self):
+        self.closed = True
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        if self.wakeup:
+            self.wakeup()
+
+
+class EventHub:
+    """Журнал последних событий и рассылка их подписчикам"""
+
+    def __init__(self, pool, shard=0):
+        self.pool = pool
+        self.shard = shard
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._ring = collections.deque(maxlen=RING_SIZE)
+        self._subscribers = set()
+        self._hints = {}
+        self._thread = None
+        # Функции, получающие каждую порцию новых событий (например, сброс кэша)
+        self.listeners = []
+        # Версия, начиная с которой журнал полон, и последняя прочитанная
+        self._ring_start = 0
+        self._last_version = 0
+        self.max_subscribers = MAX_SUBSCRIBERS
+
+    def start(self):
+        """Запуск опроса журнала изменений"""
+        with self.pool.reader() as conn:
+            self._last_version = self._ring_start = current_version(conn)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='pvz-events', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Остановка опроса и отключение всех подписчиков"""
+        self._stopped.set()
+        self._wake.set()
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, set()
+        for subscription in subscribers:
+            subscription.close()
+
+    def notify(self, version, action):
+        """Сообщение от обработчика записи: версия version появилась из-за action"""
+        self.notify_range(version, version, action)
+
+    def notify_range(self, first, last, action):
+        """То же для пакетной записи, создавшей версии first..last"""
+        with self._lock:
+            for version in range(first, last + 1):
+                self._hints[version] = action
+        self._wake.set()
+
+    def subscribe(self, statuses=None, pickup_points=None, last_event_id=None, subscription=None):
+        """Новый подписчик (или подписка уже созданного subscription).
+
+        Возвращает (subscription, backlog, complete): backlog - пропущенные
+        события после last_event_id из журнала, complete=False - журнал
+        уже не содержит всех пропущенных событий.
+        """
+        subscription = subscription or Subscription(statuses, pickup_points, shards=self.shard + 1)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None, [], True
+            self._subscribers.add(subscription)
+            subscription.positions[self.shard] = self._last_version if last_event_id is None else last_event_id
+            backlog = []
+            complete = True
+            if last_event_id is not None:
+                complete = last_event_id >= self._ring_start
+                backlog = [event for event in self._ring
+                           if event.id > last_event_id and subscription.matches(event)]
+        return subscription, backlog, complete
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+        subscription.closed = True
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subscribers), 'buffered': len(self._ring),
+                    'version': self._last_version}
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+            if self._stopped.is_set():
+                return
+            try:
+                self._poll()
+            except Exception as e:
+                print(f"✗ Ошибка чтения журнала изменений: {e}")
+
+    def _poll(self):
+        has_more = True
+        while has_more:
+            with self.pool.reader() as conn:
+                conn.execute("BEGIN")
+                changes, deleted, version, has_more = changes_since(conn, self._last_version, POLL_BATCH)
+
+            if version == self._last_version:
+                return
+
+            with self._lock:
+                events = [Event(order['version'], self._hints.get(order['version'], 'changed'), order, self.shard)
+                          for order in changes]
+                events += [Event(order['version'], 'deleted', order, self.shard) for order in deleted]
+                events.sort(key=lambda event: event.id)
+
+                for event in events:
+                    if len(self._ring) == self._ring.maxlen:
+                        self._ring_start = self._ring[0].id
+                    self._ring.append(event)
+                self._last_version = version
+                self._hints = {key: value for key, value in self._hints.items() if key > version}
+                subscribers = list(self._subscribers)
+
+            for listener in self.listeners:
+                listener(events)
+            for event in events:
+                for subscription in subscribers:
+                    if subscription.matches(event):
+                        subscription.offer(event)
+
+
+def subscribe_all(hubs, statuses=None, pickup_points=None, last_event_ids=None):
+    """Подписка на события всех шардов одним подписчиком.
+
+    last_event_ids - версии по шардам из Last-Event-ID. Возвращает
+    (subscription, backlog, complete), как EventHub.subscribe, или
+    (None, [], True), если подписчиков уже слишком много.
+    """
+    subscription = Subscription(statuses, pickup_points, shards=len(hubs))
+    backlog = []
+    complete = True
+    for index, hub in enumerate(hubs):
+        subscribed, events, hub_complete = hub.subscribe(
+            last_event_id=last_event_ids[index] if last_event_ids else None, subscription=subscription)
+        if not subscribed:
+            for other in hubs[:index]:
+                other.unsubscribe(subscription)
+            return None, [], True
+        backlog += events
+        complete = complete and hub_complete
+    return subscription, backlog, complete
+
+
+def _encode(subscription, event):
+    # Идентификатор события - позиция подписчика во всех шардах после него
+    subscription.positions[event.shard] = event.id
+    return f'id: {format_version(subscription.positions)}\n'.encode() + event.encode()
+
+
+def stream_events(sock, hubs, subscription, backlog, complete):
+    """Отправка событий подписчику до отключения (в отдельном потоке).
+
+    Пишет прямо в сокет, чтобы соединение не занимало рабочий поток
+    сервера. Медленный клиент отключается, как только его очередь
+    переполняется или отправка не укладывается в SEND_TIMEOUT.
+    """
+    def send(event):
+        sock.sendall(_encode(subscription, event))
+
+    sock.settimeout(SEND_TIMEOUT)
+    try:
+        if not complete:
+            # Часть пропущенных событий уже вытеснена из журнала: клиенту
+            # нужно догрузить изменения через /api/orders/changes
+            sock.sendall(b'event: reset\ndata: {}\n\n')
+        for event in backlog:
+            send(event)
+
+        while not subscription.closed:
+            try:
+                event = subscription.queue.get(timeout=HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                sock.sendall(b': keepalive\n\n')
+                continue
+            if event is None or subscription.evicted:
+                break
+            send(event)
+    except OSError:
+        pass
+    finally:
+        for hub in hubs:
+            hub.unsubscribe(subscription)
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+async def stream_events_async(writer, hubs, subscription, backlog, complete):
+    """То же, что stream_events, для сервера на asyncio (async_server.py).
+
+    Ожидание событий не занимает поток: рассылка будит подписчика через
+    цикл событий, а отправка идет в writer (asyncio.StreamWriter).
+    """
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    subscription.wakeup = lambda: loop.call_soon_threadsafe(ready.set)
+
+    async def send(data):
+        writer.write(data)
+        await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+
+    try:
+        if not complete:
+            await send(b'event: reset\ndata: {}\n\n')
+        for event in backlog:
+            await send(_encode(subscription, event))
+
+        while not subscription.closed:
+            # Флаг сбрасывается до разбора очереди: событие, пришедшее
+            # после него, снова разбудит подписчика
+            ready.clear()
+            events = []
+            try:
+                while True:
+                    events.append(subscription.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if None in events or subscription.evicted:
+                break
+            if events:
+                await send(b''.join(_encode(subscription, event) for event in events))
+                continue
+            try:
+                await asyncio.wait_for(ready.wait(), HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                await send(b': keepalive\n\n')
+    except (OSError, asyncio.TimeoutError):
+        pass
+    finally:
+        subscription.wakeup = None
+        for hub in hubs:
+            hub.unsubscribe(subscription)
+        writer.close()
\ No newline at end of file
@@ -0,0 +1,192 @@
+import os
+import queue
+import threading
+import time
+
+import metrics
+
+# Групповая фиксация записей.
+# Обработчики передают операцию записи - функцию от соединения - и ждут
+# ее результата. Один поток записи собирает операции, пришедшие за
+# window секунд (не больше max_batch), и выполняет их в одной транзакции:
+# под нагрузкой одна фиксация (и один fsync) приходится на пакет, а не на
+# каждую выдачу заказа. Каждая операция идет в своей точке сохранения,
+# поэтому ошибка одной откатывает только ее.
+DEFAULT_WINDOW = 0.002
+DEFAULT_MAX_BATCH = 64
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+# Период проверки, жив ли поток записи, пока операция ждет фиксации
+ALIVE_CHECK_INTERVAL = 0.5
+
+
+class _Pending:
+    __slots__ = ('operation', 'done', 'result', 'error')
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GroupCommitWriter:
+    """Очередь операций записи с фиксацией пакетами"""
+
+    def __init__(self, pool, window=DEFAULT_WINDOW, max_batch=DEFAULT_MAX_BATCH):
+        self.pool = pool
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._failure = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._batches = 0
+        self._operations = 0
+        self._failed = 0
+        self._commit_seconds = 0.0
+        self._largest = 0
+        self._histogram = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+
+    def submit(self, operation):
+        """Выполнение operation(conn) в транзакции записи.
+
+        Возвращает результат operation после фиксации транзакции или
+        выбрасывает исключение операции (или фиксации). Если поток записи
+        остановлен ошибкой, выбрасывает RuntimeError, не дожидаясь пакета.
+        """
+        thread, operations = self._ensure_thread()
+        pending = _Pending(operation)
+        started = time.perf_counter()
+        operations.put(pending)
+        while not pending.done.wait(ALIVE_CHECK_INTERVAL):
+            # Операцию из очереди остановленного потока никто не выполнит
+            if not thread.is_alive():
+                raise self._stopped_error()
+        # Ожидание пакета и его фиксации - это время запроса в БД
+        metrics.add('sql', time.perf_counter() - started)
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def close(self):
+        """Выполнение уже поставленных операций и остановка потока записи"""
+        with self._lock:
+            thread = self._thread if self._pid == os.getpid() else None
+            self._thread = None
+            if thread and not thread.is_alive():
+                # Операции из очереди остановленного потока уже завершились
+                # ошибкой у вызывающих - новый поток их не выполняет
+                self._queue = queue.Queue()
+                self._failure = None
+                thread = None
+        if thread:
+            self._queue.put(None)
+            thread.join()
+
+    def stats(self):
+        """Счетчики пакетов: число, размеры и гистограмма размеров"""
+        with self._lock:
+            return {
+                'batches': self._batches,
+                'operations': self._operations,
+                'failed': self._failed,
+                'largest_batch': self._largest,
+                'average_batch': self._operations / self._batches if self._batches else 0,
+                'commit_seconds': self._commit_seconds,
+                'batch_size_buckets': list(zip(BATCH_SIZE_BUCKETS + (None,), self._histogram)),
+            }
+
+    def _ensure_thread(self):
+        with self._lock:
+            # После fork() поток родителя в дочернем процессе не существует
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = None
+                self._pid = os.getpid()
+                self._failure = None
+                self._reset_stats()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pvz-writer', daemon=True)
+                self._thread.start()
+            elif not self._thread.is_alive():
+                raise self._stopped_error()
+            return self._thread, self._queue
+
+    def _stopped_error(self):
+        error = RuntimeError('Writer thread has stopped')
+        error.__cause__ = self._failure
+        return error
+
+    def _collect(self, first):
+        # Операции, уже стоящие в очереди, и пришедшие за window после первой
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get_nowait() if timeout <= 0 else self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            committed = False
+            try:
+                batch = self._collect(first)
+                started = time.monotonic()
+                self._execute(batch)
+                committed = True
+                self._count(batch, time.monotonic() - started)
+            except BaseException as e:
+                # Поток записи останавливается: следующие операции сразу
+                # завершаются ошибкой, а не ждут пакета
+                self._failure = e
+                if not committed:
+                    for pending in batch:
+                        pending.result = None
+                        pending.error = e
+                raise
+            finally:
+                for pending in batch:
+                    pending.done.set()
+
+    def _execute(self, batch):
+        try:
+            with self.pool.writer() as conn:
+                for pending in batch:
+                    conn.execute("SAVEPOINT operation")
+                    try:
+                        pending.result = pending.operation(conn)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO operation")
+                        pending.error = e
+                    conn.execute("RELEASE operation")
+        except Exception as e:
+            # Транзакция не зафиксирована: ошибка достается всем операциям пакета
+            for pending in batch:
+                pending.result = None
+                pending.error = e
+
+    def _count(self, batch, elapsed):
+        with self._lock:
+            self._batches += 1
+            self._operations += len(batch)
+            self._failed += sum(1 for pending in batch if pending.error is not None)
+            self._commit_seconds += elapsed
+            self._largest = max(self._largest, len(batch))
+            index = next((i for i, bound in enumerate(BATCH_SIZE_BUCKETS) if len(batch) <= bound),
+                         len(BATCH_SIZE_BUCKETS))
+            self._histogram[index] += 1
\ No newline at end of file
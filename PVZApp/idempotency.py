@@ -0,0 +1,136 @@
+import hashlib
+import json
+import threading
+import time
+
+# Ключи идемпотентности (заголовок Idempotency-Key) для POST запросов записи.
+# Ключ, хэш запроса и готовый ответ сохраняются в той же транзакции, что и
+# сама запись. Повтор запроса с тем же ключом получает сохраненный ответ без
+# повторного выполнения SQL, а тот же ключ с другим запросом отклоняется.
+# Ключи живут в БД, поэтому общие для всех рабочих процессов; устаревшие и
+# самые старые сверх max_keys удаляются при сохранении новых.
+#
+# Ответы хранятся в шарде, где выполнена запись. Чтобы тот же ключ с другим
+# запросом, ушедшим в другой шард, не выполнился заново, при шардах ключ
+# сначала закрепляется за отпечатком запроса в каталоге (idempotency_claims).
+DEFAULT_TTL = 24 * 3600      # секунд
+DEFAULT_MAX_KEYS = 100000
+MAX_KEY_LENGTH = 255
+PRUNE_EVERY = 100            # сохранений между очистками таблицы
+
+IDEMPOTENCY_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        key TEXT PRIMARY KEY,
+        request_hash TEXT NOT NULL,
+        status INTEGER NOT NULL,
+        headers TEXT NOT NULL,
+        body BLOB NOT NULL,
+        created_at REAL NOT NULL
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)",
+]
+
+# Отпечатки запросов по ключам в каталоге шардов
+IDEMPOTENCY_CLAIMS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS idempotency_claims (
+        key TEXT PRIMARY KEY,
+        request_hash TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_idempotency_claims_created ON idempotency_claims (created_at)",
+]
+
+
+def request_hash(method, path, body):
+    """Отпечаток запроса: метод, путь с параметрами и тело"""
+    digest = hashlib.sha256(f'{method} {path}\n'.encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class StoredResponse:
+    __slots__ = ('request_hash', 'status', 'headers', 'body')
+
+    def __init__(self, request_hash, status, headers, body):
+        self.request_hash = request_hash
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class IdempotencyStore:
+    """Сохраненные ответы на запросы записи по Idempotency-Key"""
+
+    def __init__(self, ttl=DEFAULT_TTL, max_keys=DEFAULT_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._stored = 0
+        self._claimed = 0
+        self.replays = 0
+        self.conflicts = 0
+
+    def lookup(self, conn, key):
+        """Сохраненный ответ по ключу или None (в том числе для устаревшего)"""
+        row = conn.execute(
+            "SELECT request_hash, status, headers, body FROM idempotency_keys WHERE key = ? AND created_at > ?",
+            (key, time.time() - self.ttl)).fetchone()
+        if row is None:
+            return None
+        return StoredResponse(row[0], row[1], json.loads(row[2]), bytes(row[3]))
+
+    def store(self, conn, key, request_hash, status, headers, body):
+        """Сохранение ответа в транзакции записи conn"""
+        conn.execute(
+            "INSERT OR REPLACE INTO idempotency_keys (key, request_hash, status, headers, body, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, request_hash, int(status), json.dumps(headers or {}), body, time.time()))
+        with self._lock:
+            self._stored += 1
+            prune = self._stored % PRUNE_EVERY == 0
+        if prune:
+            self.prune(conn)
+
+    def claim(self, conn, key, request_hash):
+        """Закрепление ключа за отпечатком запроса в транзакции записи каталога conn.
+
+        Возвращает False, если ключ уже закреплен за другим запросом.
+        """
+        row = conn.execute(
+            "SELECT request_hash FROM idempotency_claims WHERE key = ? AND created_at > ?",
+            (key, time.time() - self.ttl)).fetchone()
+        if row is not None:
+            return row[0] == request_hash
+        conn.execute(
+            "INSERT OR REPLACE INTO idempotency_claims (key, request_hash, created_at) VALUES (?, ?, ?)",
+            (key, request_hash, time.time()))
+        with self._lock:
+            self._claimed += 1
+            prune = self._claimed % PRUNE_EVERY == 0
+        if prune:
+            self.prune(conn, 'idempotency_claims')
+        return True
+
+    def prune(self, conn, table='idempotency_keys'):
+        """Удаление устаревших ключей и самых старых сверх max_keys"""
+        conn.execute(f"DELETE FROM {table} WHERE created_at <= ?", (time.time() - self.ttl,))
+        conn.execute(
+            f"DELETE FROM {table} WHERE key IN ("
+            f"SELECT key FROM {table} ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_keys,))
+
+    def record_replay(self):
+        with self._lock:
+            self.replays += 1
+
+    def record_conflict(self):
+        with self._lock:
+            self.conflicts += 1
+
+    def stats(self):
+        with self._lock:
+            return {'stored': self._stored, 'replays': self.replays, 'conflicts': self.conflicts}
\ No newline at end of file
@@ -0,0 +1,287 @@
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import os
+import sys
+import time
+
+from db_pool import ConnectionPool
+from migrations import migrate
+from search import rebuild_index
+import stats
+import analytics
+import archive
+import orders
+from sync import current_version
+
+# Загрузка заказов из файлов CSV (как /api/orders/export) и NDJSON
+# (как /api/orders с Accept: application/x-ndjson).
+#
+# Файл читается построчно, заказы пишутся пакетами по batch_size строк
+# в одной транзакции. На время загрузки удаляются вторичные индексы и
+# триггеры orders (поиск, статистика, свертки, версии) - их SQL
+# сохраняется в import_jobs, а в конце они создаются заново и
+# пересчитываются по всей таблице за один проход. Поэтому загружать
+# следует при остановленном сервере.
+#
+# После каждого пакета в той же транзакции сохраняется позиция в файле:
+# повторный запуск с тем же файлом продолжает с места остановки.
+DB_PATH = 'pvz_database.db'
+FORMATS = ('csv', 'ndjson')
+DEFAULT_BATCH_SIZE = 50000
+MAX_REPORTED_ERRORS = 20
+
+INSERT_OR_IGNORE_SQL = orders.INSERT_ORDER_SQL.replace('INSERT INTO', 'INSERT OR IGNORE INTO', 1)
+
+
+class LineReader:
+    """Строки файла, открытого в двоичном режиме, с текущей позицией.
+
+    csv.reader не читает вперед, поэтому после каждой записи offset
+    указывает ровно на начало следующей.
+    """
+
+    def __init__(self, f, offset, line):
+        self.f = f
+        self.offset = offset
+        self.line = line
+        f.seek(offset)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        raw = self.f.readline()
+        if not raw:
+            raise StopIteration
+        self.offset += len(raw)
+        self.line += 1
+        return raw.decode('utf-8')
+
+
+def detect_format(path):
+    """Формат по расширению файла"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    return None
+
+
+def read_csv_header(f):
+    """Заголовок CSV и позиция первой строки данных"""
+    f.seek(0)
+    raw = f.readline()
+    return next(csv.reader([raw.decode('utf-8-sig')])), len(raw)
+
+
+def iter_records(reader, fmt, header=None):
+    """Записи файла: (номер строки, заказ или None, ошибка или None)"""
+    if fmt == 'csv':
+        for row in csv.reader(reader):
+            if not row:
+                continue
+            if len(row) != len(header):
+                yield reader.line, None, 'Wrong number of columns'
+                continue
+            yield reader.line, csv_order(dict(zip(header, row))), None
+        return
+
+    for text in reader:
+        if not text.strip():
+            continue
+        try:
+            yield reader.line, json.loads(text), None
+        except ValueError:
+            yield reader.line, None, 'Invalid JSON'
+
+
+def csv_order(row):
+    # В CSV все значения строки: сумму приводим к числу, пустой статус - по умолчанию
+    try:
+        row['amount'] = float(row['amount'])
+    except (KeyError, ValueError):
+        pass
+    if not row.get('status'):
+        row.pop('status', None)
+    return row
+
+
+def prepare_order(data):
+    """Параметры INSERT для заказа из файла: (values, None) или (None, ошибка).
+
+    Проверки те же, что у POST /api/orders; дата заказа берется из файла.
+    """
+    error = orders.validate_order(data)
+    if error:
+        return None, error
+
+    order_date = data.get('order_date')
+    if order_date:
+        try:
+            datetime.datetime.fromisoformat(order_date)
+        except (TypeError, ValueError):
+            return None, 'Invalid order_date'
+    return orders.order_values(data, order_date), None
+
+
+def defer_schema(conn):
+    """Удаление вторичных индексов и триггеров orders. Возвращает их SQL"""
+    objects = conn.execute('''
+        SELECT type, name, sql FROM sqlite_master
+        WHERE tbl_name = 'orders' AND type IN ('index', 'trigger') AND sql IS NOT NULL
+        ORDER BY type, name
+    ''').fetchall()
+    for type_, name, _ in objects:
+        conn.execute(f"DROP {type_.upper()} {name}")
+    return [list(item) for item in objects]
+
+
+def restore_schema(conn, deferred, last_id):
+    """Возврат индексов и триггеров и пересчет всего, что они ведут"""
+    # Загруженные заказы получают одну новую версию для синхронизации
+    conn.execute("UPDATE sync_state SET version = version + 1 WHERE id = 1")
+    conn.execute("UPDATE orders SET version = ? WHERE id > ?", (current_version(conn), last_id))
+
+    for _, _, sql in deferred:
+        conn.execute(sql)
+    rebuild_index(conn)
+    stats.rebuild(conn)
+    analytics.rebuild(conn)
+    conn.execute("ANALYZE orders")
+
+
+def start_job(conn, source, fmt, size, header_size):
+    """Новая загрузка: запись в import_jobs и удаление индексов и триггеров"""
+    last_id = conn.execute("SELECT ifnull(max(id), 0) FROM orders").fetchone()[0]
+    deferred = defer_schema(conn)
+    conn.execute("DELETE FROM import_jobs WHERE source = ?", (source,))
+    conn.execute('''
+        INSERT INTO import_jobs (source, format, file_size, byte_offset, line, last_id, deferred_schema, started_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (source, fmt, size, header_size, 1 if header_size else 0, last_id,
+          json.dumps(deferred), datetime.datetime.now().isoformat()))
+    return conn.execute("SELECT * FROM import_jobs WHERE source = ?", (source,)).fetchone()
+
+
+def import_file(pool, path, fmt, batch_size=DEFAULT_BATCH_SIZE, force=False):
+    """Загрузка файла с продолжением прерванной загрузки. Возвращает код выхода"""
+    source = os.path.abspath(path)
+    size = os.path.getsize(source)
+
+    with open(source, 'rb') as f:
+        header, header_size = read_csv_header(f) if fmt == 'csv' else (None, 0)
+        if fmt == 'csv':
+            missing = [field for field in orders.REQUIRED_FIELDS if field not in header]
+            if missing:
+                print(f"✗ В заголовке CSV нет столбцов: {', '.join(missing)}")
+                return 1
+
+        with pool.writer() as conn:
+            for version, description in migrate(conn):
+                print(f"✓ Миграция {version}: {description}")
+
+            other = conn.execute(
+                "SELECT source FROM import_jobs WHERE finished_at IS NULL AND source != ?", (source,)).fetchone()
+            if other:
+                print(f"✗ Не завершена загрузка {other[0]}: сначала продолжите ее")
+                return 1
+
+            job = conn.execute("SELECT * FROM import_jobs WHERE source = ?", (source,)).fetchone()
+            if job and job['finished_at'] and not force:
+                print(f"✓ Файл уже загружен {job['finished_at']}: {job['imported']} заказов "
+                      f"(--force - загрузить заново)")
+                return 0
+            if job and not job['finished_at']:
+                if job['file_size'] != size or job['format'] != fmt:
+                    print("✗ Файл изменился после начала загрузки")
+                    return 1
+                print(f"✓ Продолжение загрузки со строки {job['line'] + 1}: "
+                      f"уже загружено {job['imported']}, отклонено {job['rejected']}")
+            else:
+                job = start_job(conn, source, fmt, size, header_size)
+
+        reader = LineReader(f, job['byte_offset'], job['line'])
+        records = iter_records(reader, fmt, header)
+        imported = rejected = reported = 0
+        started = time.monotonic()
+
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+
+            rows = []
+            for line, data, error in batch:
+                if not error:
+                    values, error = prepare_order(data)
+                if error:
+                    if reported < MAX_REPORTED_ERRORS:
+                        print(f"  ✗ Строка {line}: {error}")
+                        reported += 1
+                    continue
+                rows.append(values)
+
+            with pool.writer() as conn:
+                # Номера архивных заказов UNIQUE в orders не видит
+                taken = orders.existing_numbers(conn, (values[0] for values in rows))
+                before = conn.total_changes
+                conn.executemany(INSERT_OR_IGNORE_SQL, [values for values in rows if values[0] not in taken])
+                inserted = conn.total_changes - before
+                conn.execute('''
+                    UPDATE import_jobs
+                    SET byte_offset = ?, line = ?, imported = imported + ?, rejected = rejected + ?
+                    WHERE source = ?
+                ''', (reader.offset, reader.line, inserted, len(batch) - inserted, source))
+
+            imported += inserted
+            rejected += len(batch) - inserted
+            elapsed = time.monotonic() - started
+            print(f"  {imported + rejected} строк, {(imported + rejected) / elapsed:.0f} строк/с, "
+                  f"{reader.offset * 100 // max(size, 1)}%")
+
+    print("Восстановление индексов, поиска и статистики...")
+    with pool.writer() as conn:
+        job = conn.execute("SELECT * FROM import_jobs WHERE source = ?", (source,)).fetchone()
+        restore_schema(conn, json.loads(job['deferred_schema']), job['last_id'])
+        conn.execute("UPDATE import_jobs SET finished_at = ? WHERE source = ?",
+                     (datetime.datetime.now().isoformat(), source))
+
+    elapsed = time.monotonic() - started
+    print(f"✓ Загружено {job['imported']} заказов, отклонено {job['rejected']} "
+          f"(ошибки и дубликаты номеров) за {elapsed:.1f} с")
+    return 0
+
+
+def parse_args(argv=None):
+    """Разбор параметров командной строки"""
+    parser = argparse.ArgumentParser(description='Загрузка заказов из CSV или NDJSON')
+    parser.add_argument('path', help='файл с заказами')
+    parser.add_argument('--format', choices=FORMATS,
+                        help='формат файла (по умолчанию по расширению)')
+    parser.add_argument('--db', default=DB_PATH, help='файл базы данных')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='строк в одной транзакции')
+    parser.add_argument('--force', action='store_true',
+                        help='загрузить заново уже загруженный файл')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    fmt = args.format or detect_format(args.path)
+    if not fmt:
+        print("✗ Не удалось определить формат файла, укажите --format")
+        sys.exit(2)
+
+    pool = ConnectionPool(args.db, attach=archive.attachments(args.db))
+    try:
+        sys.exit(import_file(pool, args.path, fmt, batch_size=args.batch_size, force=args.force))
+    except KeyboardInterrupt:
+        print("\n⏹ Загрузка прервана, повторный запуск продолжит ее с последнего пакета")
+        sys.exit(130)
+    finally:
+        pool.close_all()
\ No newline at end of file
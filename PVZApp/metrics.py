@@ -0,0 +1,317 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Метрики запросов в памяти процесса и их вывод в формате Prometheus.
+# Время запроса делится на фазы: SQL (выполнение запросов и чтение
+# строк), сериализация ответа и запись в сокет. Фазы копятся в объекте
+# текущего запроса (contextvar), а в общий реестр попадают один раз в
+# конце запроса - под одной блокировкой. Если включен журнал медленных
+# запросов (profiling.py), запрос запоминает еще и свои SQL запросы.
+PHASES = ('sql', 'serialize', 'write')
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_current = contextvars.ContextVar('pvz_request_timer', default=None)
+
+
+class RequestTimer:
+    """Время одного запроса по фазам, отправленные байты и SQL запросы (если нужны)"""
+    __slots__ = ('started', 'sql', 'serialize', 'write', 'status', 'sent', 'queries')
+
+    def __init__(self, queries=None):
+        self.started = time.perf_counter()
+        self.sql = 0.0
+        self.serialize = 0.0
+        self.write = 0.0
+        self.status = None
+        self.sent = 0
+        self.queries = queries
+
+
+class QueryRecord:
+    """Выполненный SQL запрос: время выполнения и чтения строк, число строк"""
+    __slots__ = ('sql', 'parameters', 'seconds', 'rows', 'pool')
+
+    def __init__(self, sql, parameters, seconds, pool):
+        self.sql = sql
+        self.parameters = parameters
+        self.seconds = seconds
+        self.rows = 0
+        # Пул соединения для чтения (None для записи): план запроса строится
+        # на читателе этого пула в потоке, который пишет журнал
+        self.pool = pool
+
+
+def start_request(record_queries=False):
+    """Начало учета запроса в текущем контексте. Возвращает (timer, token)"""
+    timer = RequestTimer([] if record_queries else None)
+    return timer, _current.set(timer)
+
+
+def reset(token):
+    """Завершение учета запроса, начатого start_request()"""
+    _current.reset(token)
+
+
+def current():
+    """Учет текущего запроса или None вне запроса"""
+    return _current.get()
+
+
+def add(phase, seconds):
+    """Добавление времени к фазе текущего запроса"""
+    timer = _current.get()
+    if timer is not None:
+        setattr(timer, phase, getattr(timer, phase) + seconds)
+
+
+def add_query(pool, sql, parameters, seconds):
+    """Время выполнения SQL запроса на соединении для чтения пула pool (None - записи).
+
+    Возвращает QueryRecord, если запросы запоминаются.
+    """
+    timer = _current.get()
+    if timer is None:
+        return None
+    timer.sql += seconds
+    if timer.queries is None:
+        return None
+    record = QueryRecord(sql, parameters, seconds, pool)
+    timer.queries.append(record)
+    return record
+
+
+def add_rows(record, seconds, rows):
+    """Время чтения rows строк результата запроса record (None - не запоминается)"""
+    timer = _current.get()
+    if timer is not None:
+        timer.sql += seconds
+    if record is not None:
+        record.seconds += seconds
+        record.rows += rows
+
+
+def propagate(function):
+    """function для вызова в другом потоке: ее SQL запросы запоминаются в текущем запросе.
+
+    Время вызова поток запроса учитывает сам, как ожидание.
+    """
+    timer = _current.get()
+    if timer is None or timer.queries is None:
+        return function
+
+    def run(*args):
+        token = _current.set(RequestTimer(timer.queries))
+        try:
+            return function(*args)
+        finally:
+            _current.reset(token)
+    return run
+
+
+@contextmanager
+def phase(name):
+    """Учет времени блока как фазы name текущего запроса"""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(timer, name, getattr(timer, name) + time.perf_counter() - started)
+
+
+class TimedWriter:
+    """Обертка над wfile обработчика: время записи относится к фазе write"""
+    __slots__ = ('raw',)
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def write(self, data):
+        started = time.perf_counter()
+        try:
+            return self.raw.write(data)
+        finally:
+            timer = _current.get()
+            if timer is not None:
+                timer.write += time.perf_counter() - started
+                timer.sent += len(data)
+
+    def flush(self):
+        return self.raw.flush()
+
+    def close(self):
+        return self.raw.close()
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами (не накопительная внутри)"""
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+                upper = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else lower * 2
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return LATENCY_BUCKETS[-1]
+
+
+class RouteStats:
+    __slots__ = ('statuses', 'duration', 'phases')
+
+    def __init__(self):
+        self.statuses = {}
+        self.duration = Histogram()
+        self.phases = {name: Histogram() for name in PHASES}
+
+
+class Registry:
+    """Счетчики и гистограммы запросов по (метод, маршрут)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._in_flight = 0
+        self.started = time.time()
+        # Функции, возвращающие дополнительные строки метрик (пул, кэш, ...)
+        self.collectors = []
+
+    def request_started(self):
+        with self._lock:
+            self._in_flight += 1
+
+    def request_finished(self, method, route, timer):
+        """Учет завершенного запроса. Возвращает его длительность"""
+        duration = time.perf_counter() - timer.started
+        with self._lock:
+            self._in_flight -= 1
+            stats = self._routes.get((method, route))
+            if stats is None:
+                stats = self._routes[(method, route)] = RouteStats()
+            status = timer.status or 0
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.duration.observe(duration)
+            for name in PHASES:
+                stats.phases[name].observe(getattr(timer, name))
+        return duration
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus"""
+        with self._lock:
+            routes = sorted(self._routes.items())
+            in_flight = self._in_flight
+            lines = [
+                '# HELP pvz_http_requests_total HTTP requests by route and status code.',
+                '# TYPE pvz_http_requests_total counter',
+            ]
+            for (method, route), stats in routes:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(f'pvz_http_requests_total{{{_labels(method, route)},code="{status}"}} {count}')
+
+            lines += [
+                '# HELP pvz_http_request_duration_seconds Request latency from parsed headers to last byte written.',
+                '# TYPE pvz_http_request_duration_seconds histogram',
+            ]
+            for (method, route), stats in routes:
+                lines += _histogram('pvz_http_request_duration_seconds', _labels(method, route), stats.duration)
+
+            lines += [
+                '# HELP pvz_http_request_latency_seconds Latency quantiles estimated from the histogram.',
+                '# TYPE pvz_http_request_latency_seconds summary',
+            ]
+            for (method, route), stats in routes:
+                labels = _labels(method, route)
+                for q in QUANTILES:
+                    lines.append(f'pvz_http_request_latency_seconds{{{labels},quantile="{q}"}} '
+                                 f'{stats.duration.quantile(q):.6f}')
+                lines.append(f'pvz_http_request_latency_seconds_sum{{{labels}}} {stats.duration.total:.6f}')
+                lines.append(f'pvz_http_request_latency_seconds_count{{{labels}}} {stats.duration.count}')
+
+            lines += [
+                '# HELP pvz_http_request_phase_seconds Time per request spent in SQL, serialization and socket writes.',
+                '# TYPE pvz_http_request_phase_seconds histogram',
+            ]
+            for (method, route), stats in routes:
+                for name in PHASES:
+                    lines += _histogram('pvz_http_request_phase_seconds',
+                                        f'{_labels(method, route)},phase="{name}"', stats.phases[name])
+
+        lines += [
+            '# HELP pvz_http_requests_in_flight Requests being processed by this process.',
+            '# TYPE pvz_http_requests_in_flight gauge',
+            f'pvz_http_requests_in_flight {in_flight}',
+            '# HELP pvz_process_start_time_seconds Start time of this process.',
+            '# TYPE pvz_process_start_time_seconds gauge',
+            f'pvz_process_start_time_seconds {self.started:.0f}',
+        ]
+        for collector in self.collectors:
+            lines += collector()
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(method, route):
+    return f'method="{method}",route="{route}"'
+
+
+def _histogram(name, labels, histogram):
+    # В формате Prometheus корзины накопительные
+    lines = []
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f'{name}_sum{{{labels}}} {histogram.total:.6f}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+    return lines
+
+
+def gauge(name, help_text, value, labels=''):
+    """Строки одной метрики-датчика для сборщиков"""
+    return [
+        f'# HELP {name} {help_text}',
+        f'# TYPE {name} gauge',
+        f'{name}{{{labels}}} {value}' if labels else f'{name} {value}',
+    ]
+
+
+def labeled(name, kind, help_text, label, values):
+    """Строки метрики kind (gauge или counter) с рядом на каждое значение метки: {значение: число}"""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    lines += [f'{name}{{{label}="{key}"}} {value}' for key, value in values.items()]
+    return lines
+
+
+def counter(name, help_text, value):
+    """Строки одного счетчика для сборщиков"""
+    return [f'# HELP {name} {help_text}', f'# TYPE {name} counter', f'{name} {value}']
+
+
+registry = Registry()
\ No newline at end of file
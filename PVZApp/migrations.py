@@ -0,0 +1,98 @@
+from search import FTS_SCHEMA, PHONE_DIGITS_MIGRATION, rebuild_index
+import stats
+import analytics
+from sync import SYNC_SCHEMA, TOMBSTONE_DETAILS
+from idempotency import IDEMPOTENCY_SCHEMA
+from archive import ARCHIVE_STATE_SCHEMA
+from orders import SHARD_INFO_SCHEMA
+
+# Версионные миграции схемы БД.
+# Текущая версия схемы хранится в PRAGMA user_version. Каждая миграция -
+# номер, описание и список шагов: SQL-строк или функций, принимающих
+# соединение. Миграции применяются внутри транзакции вызывающего кода,
+# поэтому прерванная миграция не оставляет схему в промежуточном состоянии.
+MIGRATIONS = [
+    (1, 'Таблица заказов', [
+        '''
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_number TEXT UNIQUE NOT NULL,
+            order_date TEXT NOT NULL,
+            client_name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            status TEXT NOT NULL,
+            amount REAL NOT NULL,
+            delivery_method TEXT NOT NULL,
+            pickup_point TEXT NOT NULL
+        )
+        ''',
+    ]),
+    (2, 'Индексы для фильтров списка заказов и статистики', [
+        # Список без фильтров и диапазон дат: ORDER BY order_date DESC без сортировки
+        "CREATE INDEX IF NOT EXISTS idx_orders_date ON orders (order_date)",
+        # Фильтр по статусу (+ диапазон дат) с сортировкой по дате
+        "CREATE INDEX IF NOT EXISTS idx_orders_status_date ON orders (status, order_date)",
+        # То же в рамках одного пункта выдачи
+        "CREATE INDEX IF NOT EXISTS idx_orders_point_status_date ON orders (pickup_point, status, order_date)",
+        # Заказы за день: date(order_date) = ? превращается в поиск по индексу
+        "CREATE INDEX IF NOT EXISTS idx_orders_day ON orders (date(order_date))",
+        "ANALYZE orders",
+    ]),
+    (3, 'Полнотекстовый поиск по номеру, ФИО и телефону', FTS_SCHEMA + [rebuild_index]),
+    (4, 'Агрегаты статистики по статусам и дням', stats.STATS_SCHEMA + [stats.rebuild]),
+    (5, 'Почасовые и дневные свертки для графиков', analytics.ROLLUP_SCHEMA + [analytics.rebuild]),
+    (6, 'Версии изменений и удаленные заказы для синхронизации', SYNC_SCHEMA),
+    (7, 'Статус и пункт выдачи удаленных заказов для событий', TOMBSTONE_DETAILS),
+    (8, 'Контрольные точки загрузки заказов из файлов', [
+        # Позиция в файле обновляется в той же транзакции, что и загруженный
+        # пакет, поэтому прерванная загрузка продолжается без потерь и повторов
+        '''
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            source TEXT PRIMARY KEY,
+            format TEXT NOT NULL,
+            file_size INTEGER NOT NULL,
+            byte_offset INTEGER NOT NULL,
+            line INTEGER NOT NULL,
+            imported INTEGER NOT NULL DEFAULT 0,
+            rejected INTEGER NOT NULL DEFAULT 0,
+            last_id INTEGER NOT NULL,
+            deferred_schema TEXT NOT NULL,
+            started_at TEXT NOT NULL,
+            finished_at TEXT
+        )
+        ''',
+    ]),
+    (9, 'Ключи идемпотентности запросов записи', IDEMPOTENCY_SCHEMA),
+    (10, 'Перенос закрытых заказов в архив', ARCHIVE_STATE_SCHEMA),
+    (11, 'Номер шарда и выдача id заказов в шардах', SHARD_INFO_SCHEMA),
+    (12, 'Телефон в индексе поиска нормализуется так же, как строка поиска',
+     PHONE_DIGITS_MIGRATION + [rebuild_index]),
+    (13, 'Триггеры индекса поиска без пользовательских функций SQL',
+     PHONE_DIGITS_MIGRATION + [rebuild_index]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    """Текущая версия схемы"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, target=LATEST_VERSION):
+    """Применение недостающих миграций. Возвращает список примененных версий"""
+    current = get_schema_version(conn)
+    applied = []
+
+    for version, description, steps in MIGRATIONS:
+        if version <= current or version > target:
+            continue
+        for step in steps:
+            if callable(step):
+                step(conn)
+            else:
+                conn.execute(step)
+        conn.execute(f"PRAGMA user_version = {version}")
+        applied.append((version, description))
+
+    return applied
\ No newline at end of file
@@ -0,0 +1,136 @@
+import collections
+import threading
+import time
+
+# Кэш готовых JSON-ответов GET /api/orders/{id} в памяти процесса.
+# Записи вытесняются по LRU, когда суммарный размер превышает бюджет, и
+# устаревают через TTL. Обработчики записи сбрасывают измененные заказы
+# сразу, а изменения из других процессов приходят через журнал событий
+# (EventHub) - TTL лишь страховка на случай, если он отстал.
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+DEFAULT_TTL = 60             # секунд
+ENTRY_OVERHEAD = 200         # байт на словари и объект записи сверх самого JSON
+INVALIDATION_HISTORY = 4096  # последних сброшенных заказов для проверки put()
+
+
+def _key(order_id):
+    # id из пути запроса приходит строкой, из JSON и БД - числом
+    try:
+        return int(order_id)
+    except (TypeError, ValueError):
+        return order_id
+
+
+class CachedOrder:
+    __slots__ = ('id', 'order_number', 'version', 'body', 'expires')
+
+    def __init__(self, order_id, order_number, version, body, expires):
+        self.id = order_id
+        self.order_number = order_number
+        self.version = version
+        self.body = body
+        self.expires = expires
+
+    @property
+    def size(self):
+        return len(self.body) + len(self.order_number) + ENTRY_OVERHEAD
+
+
+class OrderCache:
+    """LRU/TTL кэш сериализованных заказов по id и order_number"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._by_number = {}
+        self._bytes = 0
+        # Растет при каждом сбросе. put() с меткой старше последнего сброса
+        # своего заказа отбрасывается, чтобы прочитанная до изменения строка
+        # не вернулась в кэш; сбросы других заказов его не затрагивают
+        self._generation = 0
+        # id -> метка сброса, в порядке сбросов. Забытый сброс поднимает
+        # _floor: put() с меткой старше него отбрасывается для любого заказа
+        self._invalidated = collections.OrderedDict()
+        self._floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def generation(self):
+        """Метка для put(): берется до чтения заказа из БД"""
+        return self._generation
+
+    def get(self, order_id=None, order_number=None):
+        """Запись по id или номеру заказа либо None"""
+        with self._lock:
+            order_id = self._by_number.get(order_number) if order_id is None else _key(order_id)
+            entry = self._entries.get(order_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires <= time.monotonic():
+                self._remove(entry)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(order_id)
+            self.hits += 1
+            return entry
+
+    def put(self, generation, order_id, order_number, version, body):
+        """Сохранение сериализованного заказа, прочитанного после generation()"""
+        if not self.max_bytes:
+            return
+        entry = CachedOrder(order_id, order_number, version, body, time.monotonic() + self.ttl)
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if generation < max(self._floor, self._invalidated.get(_key(order_id), 0)):
+                return
+            old = self._entries.get(order_id)
+            if old is not None:
+                self._remove(old)
+            self._entries[order_id] = entry
+            self._by_number[order_number] = order_id
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries.values())))
+                self.evictions += 1
+
+    def invalidate(self, *order_ids):
+        """Сброс заказов после их изменения"""
+        with self._lock:
+            self._generation += 1
+            for order_id in order_ids:
+                order_id = _key(order_id)
+                self._invalidated[order_id] = self._generation
+                self._invalidated.move_to_end(order_id)
+                if len(self._invalidated) > INVALIDATION_HISTORY:
+                    _, self._floor = self._invalidated.popitem(last=False)
+                entry = self._entries.get(order_id)
+                if entry is not None:
+                    self._remove(entry)
+                    self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+    def _remove(self, entry):
+        del self._entries[entry.id]
+        if self._by_number.get(entry.order_number) == entry.id:
+            del self._by_number[entry.order_number]
+        self._bytes -= entry.size
\ No newline at end of file
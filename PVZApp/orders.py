@@ -0,0 +1,162 @@
+import datetime
+import json
+
+import archive
+
+# Правила заказов, общие для одиночных и пакетных операций
+REQUIRED_FIELDS = ('order_number', 'client_name', 'phone', 'amount', 'delivery_method', 'pickup_point')
+STATUSES = ('Ожидает выдачи', 'Готов к выдаче', 'Выдан', 'Отменен')
+DEFAULT_STATUS = 'Ожидает выдачи'
+CLOSED_STATUSES = ('Выдан', 'Отменен')
+MAX_BULK_ITEMS = 10000
+
+# Порядок значений в order_values
+ORDER_COLUMNS = ('order_number', 'order_date', 'client_name', 'phone', 'status',
+                 'amount', 'delivery_method', 'pickup_point')
+
+# Номер шарда БД (см. shards.py). Шард k из N выдает новым заказам только id
+# с остатком k от деления на N и больше legacy_max_id - наибольшего id
+# единой БД, из которой получены шарды, поэтому id уникальны во всех
+# шардах. В единой БД (shard_count = 1) id выдает обычный AUTOINCREMENT
+SHARD_INFO_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS shard_info (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        shard INTEGER NOT NULL DEFAULT 0,
+        shard_count INTEGER NOT NULL DEFAULT 1,
+        legacy_max_id INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    "INSERT OR IGNORE INTO shard_info (id) VALUES (1)",
+]
+NEXT_ID_SQL = '''(
+    SELECT CASE WHEN shard_count > 1 THEN
+        (max(ifnull((SELECT seq FROM sqlite_sequence WHERE name = 'orders'), 0), legacy_max_id)
+         / shard_count + 1) * shard_count + shard
+    END
+    FROM shard_info WHERE id = 1
+)'''
+INSERT_ORDER_SQL = f'''
+    INSERT INTO orders (id, {', '.join(ORDER_COLUMNS)})
+    VALUES ({NEXT_ID_SQL}, {', '.join('?' * len(ORDER_COLUMNS))})
+'''
+
+
+def validate_order(data):
+    """Проверка данных нового заказа. Возвращает текст ошибки или None"""
+    if not isinstance(data, dict):
+        return 'Order must be an object'
+    for field in REQUIRED_FIELDS:
+        if field not in data:
+            return f'Missing field: {field}'
+    for field in REQUIRED_FIELDS:
+        if field != 'amount' and not isinstance(data[field], str):
+            return f'Field {field} must be a string'
+    amount = data['amount']
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)):
+        return 'Field amount must be a number'
+    if data.get('status', DEFAULT_STATUS) not in STATUSES:
+        return 'Invalid status'
+    return None
+
+
+def order_values(data, order_date=None):
+    """Параметры INSERT_ORDER_SQL для проверенного заказа"""
+    return (
+        data['order_number'],
+        order_date or datetime.datetime.now().isoformat(),
+        data['client_name'],
+        data['phone'],
+        data.get('status', DEFAULT_STATUS),
+        data['amount'],
+        data['delivery_method'],
+        data['pickup_point'],
+    )
+
+
+def existing_numbers(conn, numbers):
+    """Номера из numbers, уже занятые рабочими или архивными заказами.
+
+    UNIQUE в orders не видит архив: без этой проверки номер перенесенного
+    в архив заказа достался бы новому.
+    """
+    tables = ['orders', 'archive.orders'] if archive.is_available(conn) else ['orders']
+    sql = ' UNION ALL '.join(f"SELECT order_number FROM {table} WHERE order_number IN (SELECT value FROM json_each(?))"
+                             for table in tables)
+    numbers = json.dumps(list(numbers))
+    return {row[0] for row in conn.execute(sql, [numbers] * len(tables))}
+
+
+def create_orders(conn, items, taken=()):
+    """Создание заказов одним executemany в транзакции вызывающего кода.
+
+    Некорректные заказы и дубликаты order_number (с уже существующими
+    заказами, в том числе архивными, или внутри пакета) не прерывают
+    пакет, а получают ошибку в своем элементе результата: {'index',
+    'order_number', 'id'} или {'index', 'order_number', 'error'}. taken -
+    номера, уже занятые вне этой БД (в других шардах).
+    """
+    results = []
+    valid = []
+    for index, data in enumerate(items):
+        error = validate_order(data)
+        result = {'index': index, 'order_number': data.get('order_number') if isinstance(data, dict) else None}
+        if error:
+            result['error'] = error
+        else:
+            valid.append((result, data))
+        results.append(result)
+
+    existing = existing_numbers(conn, (data['order_number'] for _, data in valid)) | set(taken)
+
+    rows = []
+    for result, data in valid:
+        if data['order_number'] in existing:
+            result['error'] = 'Duplicate order_number'
+            continue
+        existing.add(data['order_number'])
+        rows.append((result, order_values(data)))
+
+    conn.executemany(INSERT_ORDER_SQL, [values for _, values in rows])
+
+    ids = dict(conn.execute(
+        "SELECT order_number, id FROM orders WHERE order_number IN (SELECT value FROM json_each(?))",
+        (json.dumps([values[0] for _, values in rows]),)))
+    for result, values in rows:
+        result['id'] = ids[values[0]]
+
+    return results
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def close_orders(conn, order_ids, status):
+    """Перевод заказов в закрытый статус ('Выдан' или 'Отменен').
+
+    Как и одиночные выдача и отмена, не трогает уже выданные и отмененные
+    заказы. Возвращает по элементу на каждый order_id: {'order_id'} или
+    {'order_id', 'error'}.
+    """
+    ids = [order_id for order_id in order_ids if _is_id(order_id)]
+    current = dict(conn.execute(
+        "SELECT id, status FROM orders WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(ids),)))
+
+    results = []
+    updates = []
+    for order_id in order_ids:
+        result = {'order_id': order_id}
+        if not _is_id(order_id):
+            result['error'] = 'Invalid order_id'
+        elif order_id not in current:
+            result['error'] = 'Order not found'
+        elif current[order_id] in CLOSED_STATUSES:
+            result['error'] = f'Order already {current[order_id].lower()}'
+        else:
+            current[order_id] = status
+            updates.append((status, order_id))
+        results.append(result)
+
+    conn.executemany("UPDATE orders SET status = ? WHERE id = ?", updates)
+    return results
\ No newline at end of file
@@ -0,0 +1,229 @@
+import collections
+import cProfile
+import datetime
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+# Профилирование запросов по требованию.
+#
+# Журнал медленных запросов: запрос дольше порога попадает в журнал с
+# маршрутом, параметрами, статусом, временем по фазам (SQL, сериализация,
+# запись в сокет), размером ответа и своими SQL запросами - с временем,
+# числом строк и планом EXPLAIN QUERY PLAN. Пока журнал включен, каждый
+# запрос запоминает свои SQL запросы (metrics.QueryRecord), а планы
+# строятся только для медленных, уже после ответа клиенту. С порогом 0
+# журнал выключен, и учет запросов стоит не больше, чем раньше.
+#
+# Профилирование: следующие N запросов (или их случайная доля sample,
+# можно только одного маршрута) выполняются под cProfile, и профиль
+# каждого сохраняется в файл .pstats для python -m pstats или snakeviz.
+# Профилируется один запрос за раз. Пока профилирование не запущено,
+# запрос проверяет лишь один счетчик.
+#
+# Журнал и профилирование действуют в пределах процесса.
+DEFAULT_SLOW_THRESHOLD = 0         # секунд; 0 - журнал выключен
+SLOW_LOG_SIZE = 100                # последних медленных запросов в памяти
+MAX_LOGGED_QUERIES = 50            # разных SQL запросов в записи журнала
+MAX_LOGGED_PARAMETERS = 20         # параметров SQL запроса в записи журнала
+MAX_PARAMETER_LENGTH = 200         # символов строкового параметра в записи журнала
+DEFAULT_PROFILE_DIR = 'profiles'
+MAX_PROFILE_REQUESTS = 1000
+PROFILE_FILES_SIZE = 100           # последних файлов профилей в ответе о состоянии
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def plan_mark(detail):
+    """Оценка шага плана: ✓ поиск по индексу, ~ просмотр всего индекса, ✗ просмотр всей таблицы"""
+    if not detail.startswith('SCAN') or 'VIRTUAL TABLE' in detail:
+        return '✓'
+    if 'USING' in detail:
+        return '~'
+    return '✗'
+
+
+def explain(conn, sql, parameters=()):
+    """План выполнения SQL запроса: строки вида '✓ SEARCH orders USING INDEX ...'"""
+    return [f"{plan_mark(row[3])} {row[3]}" for row in conn.execute("EXPLAIN QUERY PLAN " + sql, parameters)]
+
+
+def _plan(record):
+    # План строится только для запросов чтения и на читателе того же пула
+    # в текущем потоке: запрос мог выполниться на соединении потока scatter,
+    # которое сейчас занято другим запросом, а соединение записи
+    # принадлежит потоку групповой записи
+    if record.parameters is None or record.pool is None:
+        return None
+    if not record.sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    try:
+        with record.pool.reader() as conn:
+            return explain(conn, record.sql, record.parameters)
+    except sqlite3.Error as e:
+        return [f"✗ {e}"]
+
+
+def _parameter(value):
+    # Двоичные значения (сохраненные ответы) и длинные строки - сокращенно
+    if isinstance(value, (bytes, memoryview)):
+        return f'<{len(value)} bytes>'
+    if isinstance(value, str) and len(value) > MAX_PARAMETER_LENGTH:
+        return value[:MAX_PARAMETER_LENGTH] + '…'
+    return value
+
+
+def _parameters(parameters):
+    if parameters is None:
+        return None
+    if isinstance(parameters, dict):
+        return {name: _parameter(value) for name, value in list(parameters.items())[:MAX_LOGGED_PARAMETERS]}
+    return [_parameter(value) for value in list(parameters)[:MAX_LOGGED_PARAMETERS]]
+
+
+def summarize_queries(records):
+    """Одинаковые SQL запросы вместе: число вызовов, время, строки, параметры первого и план"""
+    queries = {}
+    for record in records:
+        query = queries.get(record.sql)
+        if query is None:
+            if len(queries) >= MAX_LOGGED_QUERIES:
+                continue
+            query = queries[record.sql] = {'record': record, 'calls': 0, 'seconds': 0.0, 'rows': 0}
+        query['calls'] += 1
+        query['seconds'] += record.seconds
+        query['rows'] += record.rows
+    summary = []
+    for sql, query in sorted(queries.items(), key=lambda item: -item[1]['seconds']):
+        record = query['record']
+        summary.append({
+            'sql': _WHITESPACE.sub(' ', sql).strip(),
+            'calls': query['calls'],
+            'ms': round(query['seconds'] * 1000, 3),
+            'rows': query['rows'],
+            'parameters': _parameters(record.parameters),
+            'plan': _plan(record),
+        })
+    return summary
+
+
+class SlowRequestLog:
+    """Последние запросы дольше threshold секунд; path - файл журнала JSON Lines"""
+
+    def __init__(self, threshold=DEFAULT_SLOW_THRESHOLD, path=None, size=SLOW_LOG_SIZE):
+        self.threshold = threshold
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = collections.deque(maxlen=size)
+        self.logged = 0
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def record(self, method, path, route, timer, duration):
+        """Запись медленного запроса (после ответа клиенту). Возвращает запись журнала"""
+        queries = timer.queries or []
+        entry = {
+            'time': datetime.datetime.now().isoformat(timespec='milliseconds'),
+            'method': method,
+            'route': route,
+            'path': path,
+            'status': timer.status,
+            'ms': round(duration * 1000, 3),
+            'phases_ms': {'sql': round(timer.sql * 1000, 3), 'serialize': round(timer.serialize * 1000, 3),
+                          'write': round(timer.write * 1000, 3)},
+            'response_bytes': timer.sent,
+            'sql_queries': len(queries),
+            'queries': summarize_queries(queries),
+        }
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            self._entries.append(entry)
+            self.logged += 1
+            if self.path:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+        return entry
+
+    def entries(self):
+        """Записи журнала, новые первыми"""
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def stats(self):
+        with self._lock:
+            return {'threshold_ms': self.threshold * 1000, 'path': self.path, 'logged': self.logged}
+
+
+class Profiler:
+    """Профилирование cProfile следующих запросов с сохранением в файлы .pstats"""
+
+    def __init__(self, directory=DEFAULT_PROFILE_DIR):
+        self.directory = directory
+        # Сколько запросов еще профилировать; 0 - профилирование выключено
+        self.remaining = 0
+        self.sample = 1.0
+        self.route = None
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+        self._files = collections.deque(maxlen=PROFILE_FILES_SIZE)
+        self._sequence = 0
+
+    def start(self, requests, sample=1.0, route=None):
+        """Профилирование следующих requests запросов (доли sample, только маршрута route)"""
+        if not 0 < requests <= MAX_PROFILE_REQUESTS:
+            raise ValueError(f'requests must be between 1 and {MAX_PROFILE_REQUESTS}')
+        if not 0 < sample <= 1:
+            raise ValueError('sample must be in (0, 1]')
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self.sample = sample
+            self.route = route
+            self.remaining = requests
+
+    def stop(self):
+        with self._lock:
+            self.remaining = 0
+
+    def begin(self, route):
+        """cProfile.Profile для запроса маршрута route или None, если он не профилируется"""
+        with self._lock:
+            if not self.remaining or (self.route and route != self.route):
+                return None
+            if self.sample < 1 and random.random() >= self.sample:
+                return None
+            # Одновременно профилируется один запрос: cProfile не везде
+            # допускает несколько активных профилей
+            if not self._active.acquire(blocking=False):
+                return None
+            self.remaining -= 1
+            self._sequence += 1
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, profile, method, route, status):
+        """Остановка профиля запроса и сохранение в файл. Возвращает путь файла"""
+        profile.disable()
+        try:
+            with self._lock:
+                sequence = self._sequence
+            name = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+            path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+                                                f"{sequence:04d}-{method}-{name}-{status}.pstats")
+            profile.dump_stats(path)
+            with self._lock:
+                self._files.append(path)
+            return path
+        finally:
+            self._active.release()
+
+    def stats(self):
+        with self._lock:
+            return {'remaining': self.remaining, 'sample': self.sample, 'route': self.route,
+                    'directory': self.directory, 'files': list(reversed(self._files))}
\ No newline at end of file
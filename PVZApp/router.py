@@ -0,0 +1,122 @@
+import re
+import urllib.parse
+
+# Таблица маршрутов HTTP API.
+#
+# Маршрут - метод, шаблон пути и обработчик. Шаблон состоит из
+# постоянных частей и параметров {name} или {name:type} (типы - в
+# CONVERTERS). При compile() маршруты без параметров складываются в
+# словарь путей, а шаблоны с параметрами - в одно регулярное выражение
+# из ветвей; имя сработавшей ветви указывает на маршрут. Поэтому поиск
+# стоит одно обращение к словарю и не больше одного сопоставления с
+# выражением, сколько бы маршрутов ни было объявлено.
+CONVERTERS = {
+    'str': (r'[^/]+', urllib.parse.unquote),
+    'int': (r'[0-9]+', int),
+    'path': (r'.+', urllib.parse.unquote),
+}
+PARAMETER = re.compile(r'\{(\w+)(?::(\w+))?\}')
+
+
+class Route:
+    """Обработчик одного метода для шаблона пути"""
+    __slots__ = ('method', 'template', 'handler', 'defaults', 'summary', 'budget')
+
+    def __init__(self, method, template, handler, defaults=None, summary=None, budget=None):
+        self.method = method
+        self.template = template
+        self.handler = handler
+        # Постоянные аргументы обработчика в дополнение к параметрам пути
+        self.defaults = defaults or {}
+        self.summary = summary
+        # Класс маршрута для допуска запросов (admission.BUDGETS) или None
+        self.budget = budget
+
+
+class Router:
+    """Маршруты API и их поиск по методу и пути"""
+
+    def __init__(self):
+        self._templates = {}
+        self._static = {}
+        self._branches = []
+        self._pattern = None
+        self._compiled = False
+
+    def add(self, method, template, handler, defaults=None, summary=None, budget=None):
+        """Объявление маршрута; summary выводится в списке адресов при запуске,
+        budget - класс маршрута для допуска запросов"""
+        methods = self._templates.setdefault(template, {})
+        if method in methods:
+            raise ValueError(f'Route {method} {template} is already declared')
+        for name, kind in PARAMETER.findall(template):
+            if (kind or 'str') not in CONVERTERS:
+                raise ValueError(f'Unknown parameter type {kind!r} in {template}')
+        methods[method] = Route(method, template, handler, defaults, summary, budget)
+        self._compiled = False
+
+    def routes(self):
+        """Все маршруты в порядке объявления"""
+        return [route for methods in self._templates.values() for route in methods.values()]
+
+    def compile(self):
+        """Построение словаря постоянных путей и общего выражения для шаблонов"""
+        static = {}
+        branches = []
+        alternatives = []
+        for template, methods in self._templates.items():
+            if not PARAMETER.search(template):
+                static[template] = methods
+                continue
+            index = len(branches)
+            converters = []
+            regex = []
+            position = 0
+            for match in PARAMETER.finditer(template):
+                name, kind = match.group(1), match.group(2) or 'str'
+                group = f'r{index}_{name}'
+                regex.append(re.escape(template[position:match.start()]))
+                regex.append(f'(?P<{group}>{CONVERTERS[kind][0]})')
+                converters.append((name, group, CONVERTERS[kind][1]))
+                position = match.end()
+            regex.append(re.escape(template[position:]))
+            alternatives.append(f"(?P<r{index}>{''.join(regex)})")
+            branches.append((template, methods, converters))
+
+        self._static = static
+        self._branches = branches
+        self._pattern = re.compile('(?:' + '|'.join(alternatives) + r')\Z') if alternatives else None
+        self._compiled = True
+
+    def match(self, method, path):
+        """Поиск маршрута для запроса.
+
+        Возвращает (маршрут, параметры пути, шаблон): маршрут None, если
+        путь известен, но метод для него не объявлен (405), и шаблон None,
+        если путь не найден (404).
+        """
+        if not self._compiled:
+            self.compile()
+
+        methods = self._static.get(path)
+        params = {}
+        template = path
+        if methods is None:
+            match = self._pattern.match(path) if self._pattern else None
+            if match is None:
+                return None, None, None
+            # Внешняя группа ветви закрывается последней
+            template, methods, converters = self._branches[int(match.lastgroup[1:])]
+            try:
+                params = {name: convert(match.group(group)) for name, group, convert in converters}
+            except ValueError:
+                return None, None, None
+
+        route = methods.get(method)
+        if route is None:
+            return None, None, template
+        return route, params, template
+
+    def allowed_methods(self, template):
+        """Методы, объявленные для шаблона (заголовок Allow ответа 405)"""
+        return list(self._templates.get(template, ()))
\ No newline at end of file
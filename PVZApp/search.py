@@ -0,0 +1,103 @@
+import re
+
+# Триграммы не строятся для строк короче трех символов
+MIN_TERM_LENGTH = 3
+
+# Телефон без оформления: "+7 (999) 123-45-67" -> "79991234567".
+# Выражение используется в триггерах, поэтому обходится без
+# пользовательских функций и работает в любом клиенте SQLite. Удаляются
+# разделители, которые встречаются в записи телефонов (в том числе
+# подчеркивание, длинное тире и неразрывный пробел); строка поиска
+# очищается normalize_phone от всех нецифровых символов.
+PHONE_SEPARATORS = (' ', "char(160)", '(', ')', '-', '–', '—', '+', '.', ',', '/', '_')
+
+
+def _strip_separators(expression):
+    for separator in PHONE_SEPARATORS:
+        literal = separator if separator.startswith('char(') else "'" + separator + "'"
+        expression = f"replace({expression}, {literal}, '')"
+    return expression
+
+
+PHONE_DIGITS_SQL = _strip_separators('{phone}')
+
+# Полнотекстовый индекс по номеру заказа, ФИО и цифрам телефона.
+# rowid строки индекса совпадает с orders.id. Имена столбцов отличаются
+# от столбцов orders, чтобы в JOIN не было неоднозначности.
+FTS_INSERT_TRIGGER = f'''
+    CREATE TRIGGER IF NOT EXISTS orders_fts_insert AFTER INSERT ON orders BEGIN
+        INSERT INTO orders_fts (rowid, number, name, phone_digits)
+        VALUES (NEW.id, NEW.order_number, NEW.client_name, {PHONE_DIGITS_SQL.format(phone='NEW.phone')});
+    END
+    '''
+FTS_UPDATE_TRIGGER = f'''
+    CREATE TRIGGER IF NOT EXISTS orders_fts_update AFTER UPDATE OF order_number, client_name, phone ON orders BEGIN
+        UPDATE orders_fts
+        SET number = NEW.order_number, name = NEW.client_name,
+            phone_digits = {PHONE_DIGITS_SQL.format(phone='NEW.phone')}
+        WHERE rowid = NEW.id;
+    END
+    '''
+FTS_SCHEMA = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5(
+        number, name, phone_digits,
+        tokenize = 'trigram'
+    )
+    ''',
+    FTS_INSERT_TRIGGER,
+    '''
+    CREATE TRIGGER IF NOT EXISTS orders_fts_delete AFTER DELETE ON orders BEGIN
+        DELETE FROM orders_fts WHERE rowid = OLD.id;
+    END
+    ''',
+    FTS_UPDATE_TRIGGER,
+]
+
+FTS_TRIGGERS = ('orders_fts_insert', 'orders_fts_delete', 'orders_fts_update')
+
+# Пересоздание триггеров, которые нормализовали телефон иначе (индекс
+# затем перестраивается)
+PHONE_DIGITS_MIGRATION = [
+    "DROP TRIGGER IF EXISTS orders_fts_insert",
+    "DROP TRIGGER IF EXISTS orders_fts_update",
+    FTS_INSERT_TRIGGER,
+    FTS_UPDATE_TRIGGER,
+]
+
+def normalize_phone(phone):
+    """Только цифры телефона"""
+    return re.sub(r'\D', '', phone)
+
+
+def _quote(term):
+    # Строка FTS5 в двойных кавычках ищется как подстрока
+    return '"' + term.replace('"', '""') + '"'
+
+
+def match_expression(search):
+    """Выражение для orders_fts MATCH или None, если строка слишком короткая.
+
+    Строка ищется как подстрока во всех столбцах индекса. Если в ней есть
+    цифры, дополнительно ищется ее цифровая часть в телефоне, чтобы
+    "9991234567" находил "+7 (999) 123-45-67" и наоборот.
+    """
+    term = search.strip()
+    if len(term) < MIN_TERM_LENGTH:
+        return None
+
+    parts = [_quote(term)]
+    digits = normalize_phone(term)
+    if len(digits) >= MIN_TERM_LENGTH and digits != term:
+        parts.append('phone_digits : ' + _quote(digits))
+    return ' OR '.join(parts)
+
+
+def rebuild_index(conn):
+    """Полное перестроение индекса по таблице orders"""
+    conn.execute("DELETE FROM orders_fts")
+    conn.execute(f'''
+        INSERT INTO orders_fts (rowid, number, name, phone_digits)
+        SELECT id, order_number, client_name, {PHONE_DIGITS_SQL.format(phone='phone')} FROM orders
+    ''')
+    conn.execute("INSERT INTO orders_fts (orders_fts) VALUES ('optimize')")
\ No newline at end of file
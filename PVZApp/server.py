@@ -1,515 +1,2057 @@
-﻿import http.server
-import socketserver
-import json
-import sqlite3
-import datetime
-import urllib.parse
-from http import HTTPStatus
-import re
-
-# Конфигурация сервера
-PORT = 8000
-HOST = 'localhost'
-
-class PVZHandler(http.server.SimpleHTTPRequestHandler):
-    
-    def do_GET(self):
-        """Обработка GET запросов"""
-        parsed_path = urllib.parse.urlparse(self.path)
-        
-        # Отдаем статические файлы
-        if parsed_path.path.startswith('/static/'):
-            return super().do_GET()
-        
-        # API endpoints
-        if parsed_path.path == '/api/orders':
-            self.handle_get_orders(parsed_path.query)
-        elif parsed_path.path == '/api/stats':
-            self.handle_get_stats()
-        elif parsed_path.path.startswith('/api/orders/'):
-            order_id = parsed_path.path.replace('/api/orders/', '')
-            self.handle_get_order(order_id)
-        else:
-            self.send_response(HTTPStatus.NOT_FOUND)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Endpoint not found'}).encode())
-    
-    def do_POST(self):
-        """Обработка POST запросов"""
-        parsed_path = urllib.parse.urlparse(self.path)
-        
-        if parsed_path.path == '/api/orders':
-            self.handle_create_order()
-        elif parsed_path.path == '/api/orders/issue':
-            self.handle_issue_order()
-        elif parsed_path.path == '/api/orders/cancel':
-            self.handle_cancel_order()
-        else:
-            self.send_response(HTTPStatus.NOT_FOUND)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Endpoint not found'}).encode())
-    
-    def do_PUT(self):
-        """Обработка PUT запросов"""
-        parsed_path = urllib.parse.urlparse(self.path)
-        
-        if parsed_path.path.startswith('/api/orders/'):
-            order_id = parsed_path.path.replace('/api/orders/', '').replace('/status', '')
-            self.handle_update_order_status(order_id)
-        else:
-            self.send_response(HTTPStatus.NOT_FOUND)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Endpoint not found'}).encode())
-    
-    def do_DELETE(self):
-        """Обработка DELETE запросов"""
-        parsed_path = urllib.parse.urlparse(self.path)
-        
-        if parsed_path.path.startswith('/api/orders/'):
-            order_id = parsed_path.path.replace('/api/orders/', '')
-            self.handle_delete_order(order_id)
-        else:
-            self.send_response(HTTPStatus.NOT_FOUND)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Endpoint not found'}).encode())
-    
-    def handle_get_orders(self, query_string):
-        """Получение списка заказов с фильтрацией"""
-        params = urllib.parse.parse_qs(query_string)
-        
-        # Параметры фильтрации
-        status = params.get('status', [None])[0]
-        search = params.get('search', [None])[0]
-        date_from = params.get('date_from', [None])[0]
-        date_to = params.get('date_to', [None])[0]
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        query = "SELECT * FROM orders WHERE 1=1"
-        args = []
-        
-        if status:
-            query += " AND status = ?"
-            args.append(status)
-        
-        if search:
-            query += " AND (order_number LIKE ? OR client_name LIKE ? OR phone LIKE ?)"
-            search_term = f"%{search}%"
-            args.extend([search_term, search_term, search_term])
-        
-        if date_from:
-            query += " AND order_date >= ?"
-            args.append(date_from)
-        
-        if date_to:
-            query += " AND order_date <= ?"
-            args.append(date_to)
-        
-        query += " ORDER BY order_date DESC"
-        
-        cursor.execute(query, args)
-        orders = cursor.fetchall()
-        conn.close()
-        
-        self.send_response(HTTPStatus.OK)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(orders, default=json_serializer).encode())
-    
-    def handle_get_order(self, order_id):
-        """Получение конкретного заказа"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM orders WHERE id = ?", (order_id,))
-        order = cursor.fetchone()
-        conn.close()
-        
-        if order:
-            self.send_response(HTTPStatus.OK)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(order, default=json_serializer).encode())
-        else:
-            self.send_response(HTTPStatus.NOT_FOUND)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Order not found'}).encode())
-    
-    def handle_get_stats(self):
-        """Получение статистики"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Общая статистика
-        cursor.execute("SELECT COUNT(*) FROM orders")
-        total_orders = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM orders WHERE status = 'Готов к выдаче'")
-        ready_orders = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM orders WHERE status = 'Ожидает выдачи'")
-        pending_orders = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM orders WHERE status = 'Выдан'")
-        completed_orders = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM orders WHERE status = 'Отменен'")
-        cancelled_orders = cursor.fetchone()[0]
-        
-        # Заказы за сегодня
-        today = datetime.date.today().isoformat()
-        cursor.execute("SELECT COUNT(*) FROM orders WHERE date(order_date) = ?", (today,))
-        today_orders = cursor.fetchone()[0]
-        
-        # Общая сумма всех заказов
-        cursor.execute("SELECT SUM(amount) FROM orders WHERE status != 'Отменен'")
-        total_amount = cursor.fetchone()[0] or 0
-        
-        conn.close()
-        
-        stats = {
-            'total_orders': total_orders,
-            'ready_orders': ready_orders,
-            'pending_orders': pending_orders,
-            'completed_orders': completed_orders,
-            'cancelled_orders': cancelled_orders,
-            'today_orders': today_orders,
-            'total_amount': float(total_amount)
-        }
-        
-        self.send_response(HTTPStatus.OK)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(stats).encode())
-    
-    def handle_create_order(self):
-        """Создание нового заказа"""
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length)
-        order_data = json.loads(post_data.decode())
-        
-        # Валидация данных
-        required_fields = ['order_number', 'client_name', 'phone', 'amount', 'delivery_method', 'pickup_point']
-        for field in required_fields:
-            if field not in order_data:
-                self.send_response(HTTPStatus.BAD_REQUEST)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'error': f'Missing field: {field}'}).encode())
-                return
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO orders (order_number, order_date, client_name, phone, status, amount, delivery_method, pickup_point)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            order_data['order_number'],
-            datetime.datetime.now().isoformat(),
-            order_data['client_name'],
-            order_data['phone'],
-            order_data.get('status', 'Ожидает выдачи'),
-            order_data['amount'],
-            order_data['delivery_method'],
-            order_data['pickup_point']
-        ))
-        
-        conn.commit()
-        order_id = cursor.lastrowid
-        conn.close()
-        
-        self.send_response(HTTPStatus.CREATED)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Location', f'/api/orders/{order_id}')
-        self.end_headers()
-        self.wfile.write(json.dumps({'id': order_id, 'message': 'Order created successfully'}).encode())
-    
-    def handle_issue_order(self):
-        """Выдача заказа"""
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length)
-        data = json.loads(post_data.decode())
-        
-        order_id = data.get('order_id')
-        if not order_id:
-            self.send_response(HTTPStatus.BAD_REQUEST)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'order_id is required'}).encode())
-            return
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Проверяем существование заказа
-        cursor.execute("SELECT status FROM orders WHERE id = ?", (order_id,))
-        order = cursor.fetchone()
-        
-        if not order:
-            conn.close()
-            self.send_response(HTTPStatus.NOT_FOUND)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Order not found'}).encode())
-            return
-        
-        if order[0] in ['Выдан', 'Отменен']:
-            conn.close()
-            self.send_response(HTTPStatus.BAD_REQUEST)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': f'Order already {order[0].lower()}'}).encode())
-            return
-        
-        cursor.execute("UPDATE orders SET status = 'Выдан' WHERE id = ?", (order_id,))
-        conn.commit()
-        conn.close()
-        
-        self.send_response(HTTPStatus.OK)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps({'message': 'Order issued successfully'}).encode())
-    
-    def handle_cancel_order(self):
-        """Отмена заказа"""
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length)
-        data = json.loads(post_data.decode())
-        
-        order_id = data.get('order_id')
-        reason = data.get('reason', '')
-        
-        if not order_id:
-            self.send_response(HTTPStatus.BAD_REQUEST)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'order_id is required'}).encode())
-            return
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT status FROM orders WHERE id = ?", (order_id,))
-        order = cursor.fetchone()
-        
-        if not order:
-            conn.close()
-            self.send_response(HTTPStatus.NOT_FOUND)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Order not found'}).encode())
-            return
-        
-        if order[0] in ['Выдан', 'Отменен']:
-            conn.close()
-            self.send_response(HTTPStatus.BAD_REQUEST)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': f'Order already {order[0].lower()}'}).encode())
-            return
-        
-        cursor.execute("UPDATE orders SET status = 'Отменен' WHERE id = ?", (order_id,))
-        conn.commit()
-        conn.close()
-        
-        self.send_response(HTTPStatus.OK)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps({'message': 'Order cancelled successfully'}).encode())
-    
-    def handle_update_order_status(self, order_id):
-        """Обновление статуса заказа"""
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length)
-        data = json.loads(post_data.decode())
-        
-        new_status = data.get('status')
-        valid_statuses = ['Ожидает выдачи', 'Готов к выдаче', 'Выдан', 'Отменен']
-        
-        if not new_status or new_status not in valid_statuses:
-            self.send_response(HTTPStatus.BAD_REQUEST)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Invalid status'}).encode())
-            return
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("UPDATE orders SET status = ? WHERE id = ?", (new_status, order_id))
-        conn.commit()
-        
-        if cursor.rowcount == 0:
-            conn.close()
-            self.send_response(HTTPStatus.NOT_FOUND)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Order not found'}).encode())
-            return
-        
-        conn.close()
-        
-        self.send_response(HTTPStatus.OK)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps({'message': 'Status updated successfully'}).encode())
-    
-    def handle_delete_order(self, order_id):
-        """Удаление заказа (только для отмененных)"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT status FROM orders WHERE id = ?", (order_id,))
-        order = cursor.fetchone()
-        
-        if not order:
-            conn.close()
-            self.send_response(HTTPStatus.NOT_FOUND)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Order not found'}).encode())
-            return
-        
-        if order[0] != 'Отменен':
-            conn.close()
-            self.send_response(HTTPStatus.BAD_REQUEST)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Only cancelled orders can be deleted'}).encode())
-            return
-        
-        cursor.execute("DELETE FROM orders WHERE id = ?", (order_id,))
-        conn.commit()
-        conn.close()
-        
-        self.send_response(HTTPStatus.OK)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps({'message': 'Order deleted successfully'}).encode())
-
-def json_serializer(obj):
-    """Сериализатор для JSON"""
-    if isinstance(obj, (datetime.date, datetime.datetime)):
-        return obj.isoformat()
-    raise TypeError(f"Type {type(obj)} not serializable")
-
-def get_db_connection():
-    """Получение соединения с БД"""
-    conn = sqlite3.connect('pvz_database.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_database():
-    """Инициализация базы данных"""
-    conn = sqlite3.connect('pvz_database.db')
-    cursor = conn.cursor()
-    
-    # Создание таблицы заказов
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_number TEXT UNIQUE NOT NULL,
-            order_date TEXT NOT NULL,
-            client_name TEXT NOT NULL,
-            phone TEXT NOT NULL,
-            status TEXT NOT NULL,
-            amount REAL NOT NULL,
-            delivery_method TEXT NOT NULL,
-            pickup_point TEXT NOT NULL
-        )
-    ''')
-    
-    # Добавление тестовых данных если таблица пуста
-    cursor.execute("SELECT COUNT(*) FROM orders")
-    count = cursor.fetchone()[0]
-    
-    if count == 0:
-        sample_orders = [
-            ('ORD-001', (datetime.datetime.now() - datetime.timedelta(days=2)).isoformat(), 
-             'Иванов Иван Иванович', '+7 (999) 123-45-67', 'Готов к выдаче', 3450.50, 'Самовывоз', 'ПВЗ №001'),
-            ('ORD-002', (datetime.datetime.now() - datetime.timedelta(days=1)).isoformat(), 
-             'Петрова Анна Сергеевна', '+7 (999) 765-43-21', 'Ожидает выдачи', 8900.00, 'Курьер', 'ПВЗ №001'),
-            ('ORD-003', datetime.datetime.now().isoformat(), 
-             'Сидоров Алексей Петрович', '+7 (999) 555-66-77', 'Выдан', 2300.00, 'Самовывоз', 'ПВЗ №001'),
-            ('ORD-004', (datetime.datetime.now() - datetime.timedelta(days=3)).isoformat(), 
-             'Козлова Елена Владимировна', '+7 (999) 111-22-33', 'Отменен', 5600.00, 'Самовывоз', 'ПВЗ №001'),
-            ('ORD-005', (datetime.datetime.now() - datetime.timedelta(days=1)).isoformat(), 
-             'Николаев Дмитрий Сергеевич', '+7 (999) 444-55-66', 'Готов к выдаче', 12500.00, 'Курьер', 'ПВЗ №001'),
-            ('ORD-006', datetime.datetime.now().isoformat(), 
-             'Соколова Мария Андреевна', '+7 (999) 777-88-99', 'Ожидает выдачи', 4300.50, 'Самовывоз', 'ПВЗ №001')
-        ]
-        
-        cursor.executemany('''
-            INSERT INTO orders (order_number, order_date, client_name, phone, status, amount, delivery_method, pickup_point)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', sample_orders)
-    
-    conn.commit()
-    conn.close()
-    print("✓ База данных инициализирована")
-
-def run_server():
-    """Запуск сервера"""
-    try:
-        # Инициализация БД
-        init_database()
-        
-        # Создание и запуск сервера
-        handler = PVZHandler
-        
-        # Пытаемся использовать разные адреса если порт занят
-        sockets_to_try = [
-            (HOST, PORT),
-            (HOST, PORT + 1),
-            (HOST, PORT + 2),
-            ('127.0.0.1', PORT),
-            ('0.0.0.0', PORT)
-        ]
-        
-        server = None
-        for host, port in sockets_to_try:
-            try:
-                server = socketserver.TCPServer((host, port), handler)
-                HOST = host
-                PORT = port
-                break
-            except OSError:
-                continue
-        
-        if not server:
-            print("✗ Не удалось запустить сервер. Все порты заняты.")
-            return
-        
-        print("\n" + "="*50)
-        print(f"✓ Сервер ПВЗ запущен!")
-        print(f"✓ Адрес: http://{HOST}:{PORT}")
-        print(f"✓ API endpoints:")
-        print(f"  - GET    /api/orders - список заказов")
-        print(f"  - GET    /api/orders/{{id}} - конкретный заказ")
-        print(f"  - GET    /api/stats - статистика")
-        print(f"  - POST   /api/orders - создать заказ")
-        print(f"  - POST   /api/orders/issue - выдать заказ")
-        print(f"  - POST   /api/orders/cancel - отменить заказ")
-        print(f"  - PUT    /api/orders/{{id}}/status - обновить статус")
-        print(f"  - DELETE /api/orders/{{id}} - удалить заказ")
-        print(f"✓ База данных: pvz_database.db")
-        print("="*50)
-        print("Нажмите Ctrl+C для остановки сервера\n")
-        
-        server.serve_forever()
-        
-    except KeyboardInterrupt:
-        print("\n\n⏹ Сервер остановлен")
-        if server:
-            server.shutdown()
-    except Exception as e:
-        print(f"✗ Ошибка: {e}")
-
-if __name__ == '__main__':
-    run_server()
\ No newline at end of file
+import http.server
+import socketserver
+import socket
+import json
+import sqlite3
+import datetime
+import urllib.parse
+from http import HTTPStatus
+import os
+import sys
+import signal
+import queue
+import threading
+import argparse
+import time
+import base64
+import csv
+import io
+import traceback
+import select
+import zlib
+import math
+import contextlib
+import ipaddress
+
+from migrations import migrate
+from search import match_expression
+import stats
+import analytics
+from sync import current_version, make_etag, etag_matches, changes_since, format_version, parse_version
+from events import stream_events, stream_events_async, subscribe_all, MAX_ASYNC_SUBSCRIBERS
+from group_commit import DEFAULT_WINDOW, DEFAULT_MAX_BATCH
+import orders
+import metrics
+import archive
+from router import Router
+from order_cache import OrderCache, DEFAULT_MAX_BYTES as DEFAULT_ORDER_CACHE_BYTES
+from idempotency import (IdempotencyStore, StoredResponse, request_hash, MAX_KEY_LENGTH,
+                         DEFAULT_TTL as DEFAULT_IDEMPOTENCY_TTL, DEFAULT_MAX_KEYS as DEFAULT_IDEMPOTENCY_KEYS)
+from archive import DEFAULT_ARCHIVE_AFTER_DAYS
+from shards import OrderStore, merge_pages, merge_cursors
+from async_server import AsyncHTTPServer, AsyncHandlerMixin, DEFAULT_MAX_CONNECTIONS
+from profiling import SlowRequestLog, Profiler, explain, DEFAULT_SLOW_THRESHOLD, DEFAULT_PROFILE_DIR
+from admission import (AdmissionControl, BUDGETS, default_limits, DEFAULT_RATE as DEFAULT_RATE_LIMIT,
+                       DEFAULT_BURST as DEFAULT_RATE_BURST)
+
+# Конфигурация сервера
+PORT = 8000
+HOST = 'localhost'
+DB_PATH = 'pvz_database.db'
+
+# Выдача списка заказов
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500      # строк за одно чтение из курсора при потоковой выдаче
+STREAM_CHUNK_SIZE = 64 * 1024  # байт в одном блоке chunked ответа
+ORDER_FIELDS = ('id', 'order_number', 'order_date', 'client_name', 'phone',
+                'status', 'amount', 'delivery_method', 'pickup_point', 'version')
+
+# Постоянные соединения (HTTP/1.1 keep-alive) и сжатие ответов
+KEEPALIVE_TIMEOUT = 5        # секунд простоя, после которых соединение закрывается
+KEEPALIVE_POLL_INTERVAL = 0.05  # как часто простаивающее соединение проверяет очередь сервера
+KEEPALIVE_MAX_REQUESTS = 1000   # запросов на одном соединении
+SOCKET_TIMEOUT = 30          # секунд на чтение запроса и запись ответа
+COMPRESS_MIN_SIZE = 1024     # байт: меньшие ответы не сжимаются
+COMPRESS_LEVEL = 6
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+# Методы, которые попадают в метки метрик как есть; остальные - 'other'
+HTTP_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'PATCH', 'OPTIONS')
+
+# Режимы обслуживания запросов
+SERVE_MODES = ('single', 'threads', 'processes', 'asyncio')
+DEFAULT_SERVE_MODE = 'threads'
+DEFAULT_WORKERS = 16         # рабочих потоков в одном процессе
+DEFAULT_QUEUE_SIZE = 128     # принятых соединений, ожидающих свободного потока
+DEFAULT_PROCESSES = os.cpu_count() or 1
+DRAIN_TIMEOUT = 30           # секунд на завершение обрабатываемых запросов
+
+# Готовые ответы GET /api/orders/{id} для часто запрашиваемых заказов
+order_cache = OrderCache()
+
+# Ответы на POST запросы записи по Idempotency-Key для безопасных повторов
+idempotency_keys = IdempotencyStore()
+
+# Бюджеты одновременных запросов по классам маршрутов и темп клиентов
+admission_control = AdmissionControl(DEFAULT_WORKERS)
+
+# Журнал медленных запросов и профилирование по требованию (/api/admin/...)
+slow_requests = SlowRequestLog()
+profiler = Profiler()
+
+def open_store(shards_dir=None):
+    """Хранилище заказов: единая БД DB_PATH или шарды из каталога shards_dir.
+    
+    У каждого шарда свои долгоживущие соединения (по одному на поток для
+    чтения и одно для записи), очередь групповой записи, перенос в архив и
+    рассылка изменений подписчикам /api/events; рассылка же сбрасывает кэш
+    заказов, измененных другими процессами.
+    """
+    opened = OrderStore.open(DB_PATH, shards_dir)
+    for shard in opened.shards:
+        shard.events.listeners.append(
+            lambda events: order_cache.invalidate(*(event.order['id'] for event in events)))
+    return opened
+
+# Хранилище заказов открывается при запуске по параметрам командной строки
+# (см. __main__): импорт модуля не открывает и не создает БД
+store = None
+
+# Метрики пулов, очередей записи, кэша и подписчиков рядом с метриками запросов
+def collect_component_metrics():
+    connections = sum(shard.pool.stats()['connections'] for shard in store.shards)
+    writes = store.write_stats()
+    cache = order_cache.stats()
+    keys = idempotency_keys.stats()
+    admission = admission_control.stats()
+    archived = sum(shard.archiver.stats()['archived'] for shard in store.shards)
+    lines = metrics.gauge('pvz_db_connections', 'Open SQLite connections in this process.', connections)
+    lines += metrics.counter('pvz_write_batches_total', 'Group-commit transactions.', writes['batches'])
+    lines += metrics.counter('pvz_write_operations_total', 'Write operations committed in batches.',
+                             writes['operations'])
+    lines += metrics.counter('pvz_write_operations_failed_total', 'Write operations that raised an error.',
+                             writes['failed'])
+    lines += [
+        '# HELP pvz_write_batch_size Operations per group-commit transaction.',
+        '# TYPE pvz_write_batch_size histogram',
+    ]
+    cumulative = 0
+    for bound, count in writes['batch_size_buckets']:
+        cumulative += count
+        lines.append(f'pvz_write_batch_size_bucket{{le="{bound or "+Inf"}"}} {cumulative}')
+    lines.append(f'pvz_write_batch_size_sum {writes["operations"]}')
+    lines.append(f'pvz_write_batch_size_count {writes["batches"]}')
+    lines += metrics.counter('pvz_write_commit_seconds_total', 'Time spent in group-commit transactions.',
+                             f'{writes["commit_seconds"]:.6f}')
+    for name in ('hits', 'misses', 'evictions', 'invalidations'):
+        lines += metrics.counter(f'pvz_order_cache_{name}_total', f'Order cache {name}.', cache[name])
+    lines += metrics.gauge('pvz_order_cache_bytes', 'Size of cached order bodies.', cache['bytes'])
+    lines += metrics.gauge('pvz_order_cache_entries', 'Orders in the cache.', cache['entries'])
+    lines += metrics.counter('pvz_idempotency_replays_total', 'Write requests answered from a stored response.',
+                             keys['replays'])
+    lines += metrics.counter('pvz_idempotency_conflicts_total',
+                             'Idempotency keys reused with a different request.', keys['conflicts'])
+    lines += metrics.counter('pvz_archived_orders_total', 'Orders moved to the archive by this process.',
+                             archived)
+    budgets = admission['budgets']
+    for name, help_text, kind in (
+            ('limit', 'Concurrent requests allowed per route class (0 - unlimited).', 'gauge'),
+            ('in_flight', 'Admitted requests being processed per route class.', 'gauge'),
+            ('waiting', 'Requests waiting for a place in the route class budget.', 'gauge'),
+            ('admitted', 'Requests admitted per route class.', 'counter'),
+            ('rejected', 'Requests rejected with 503 because the route class budget was exhausted.', 'counter')):
+        metric = f'pvz_admission_{name}_total' if kind == 'counter' else f'pvz_admission_{name}'
+        lines += metrics.labeled(metric, kind, help_text, 'budget',
+                                 {budget: stats[name] for budget, stats in budgets.items()})
+    rate_limit = admission['rate_limit']
+    lines += metrics.gauge('pvz_rate_limit_per_second', 'Requests per second allowed per client (0 - unlimited).',
+                           rate_limit['rate'])
+    lines += metrics.gauge('pvz_rate_limit_clients', 'Clients with a token bucket.', rate_limit['clients'])
+    lines += metrics.counter('pvz_rate_limited_total', 'Requests rejected with 429 by the per-client rate limit.',
+                             rate_limit['limited'])
+    # Подписчик шардов подписан на рассылки всех шардов сразу
+    lines += metrics.gauge('pvz_event_subscribers', 'Open /api/events streams.',
+                           store.shards[0].events.stats()['subscribers'])
+    return lines
+
+metrics.registry.collectors.append(collect_component_metrics)
+
+def choose_encoding(accept_encoding):
+    """Сжатие ответа по заголовку Accept-Encoding: 'gzip', 'deflate' или None"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        weight = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+    for encoding in ('gzip', 'deflate'):
+        if weights.get(encoding, weights.get('*', 0)) > 0:
+            return encoding
+    return None
+
+def make_compressor(encoding):
+    """zlib компрессор в формате gzip или deflate (zlib) для HTTP"""
+    return zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+
+class PVZHandler(http.server.SimpleHTTPRequestHandler):
+    
+    # Соединения остаются открытыми между запросами (keep-alive), если
+    # длина каждого ответа известна клиенту
+    protocol_version = 'HTTP/1.1'
+    timeout = SOCKET_TIMEOUT
+    disable_nagle_algorithm = True
+    # Отправка потока событий в отдельном потоке (detach_request)
+    event_stream = staticmethod(stream_events)
+    
+    def setup(self):
+        super().setup()
+        # Время записи ответа в сокет учитывается в метриках запроса
+        self.wfile = metrics.TimedWriter(self.wfile)
+        self.requests_served = 0
+        self._body_read = False
+        self._framed = False
+        self._response_code = None
+    
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self.wait_for_request():
+            self.handle_one_request()
+    
+    def wait_for_request(self):
+        """Ожидание следующего запроса на постоянном соединении.
+        
+        Простаивающее соединение занимает рабочий поток, поэтому оно
+        закрывается через KEEPALIVE_TIMEOUT, а если свободного потока ждут
+        другие соединения - сразу.
+        """
+        deadline = time.monotonic() + KEEPALIVE_TIMEOUT
+        readable = False
+        while True:
+            # Неблокирующий peek видит и уже прочитанные в буфер данные
+            # (конвейер запросов), и пришедшие в сокет
+            try:
+                self.connection.setblocking(False)
+                try:
+                    if self.rfile.peek(1):
+                        return True
+                finally:
+                    self.connection.settimeout(self.timeout)
+            except OSError:
+                return False
+            if readable:
+                # Сокет готов к чтению, но данных нет: клиент закрыл соединение
+                return False
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.keep_alive_allowed():
+                return False
+            readable = bool(select.select([self.connection], [], [],
+                                          min(remaining, KEEPALIVE_POLL_INTERVAL))[0])
+    
+    def keep_alive_allowed(self):
+        """Можно ли оставить соединение открытым после ответа"""
+        allowed = getattr(self.server, 'keep_alive_allowed', None)
+        return bool(allowed and allowed()) and self.requests_served < KEEPALIVE_MAX_REQUESTS
+    
+    def log_error(self, format, *args):
+        # Закрытие простаивающего соединения по таймауту - не ошибка
+        if format.startswith('Request timed out'):
+            return
+        super().log_error(format, *args)
+    
+    def parse_request(self):
+        self.request_body = b''
+        self._body_read = False
+        self._framed = False
+        self._response_code = None
+        if not super().parse_request():
+            return False
+        self.requests_served += 1
+        # Учет начинается после чтения заголовков: ожидание запроса на
+        # соединении в задержку не входит
+        self.request_timer, self._timer_token = metrics.start_request(slow_requests.enabled)
+        metrics.registry.request_started()
+        return True
+    
+    def handle_one_request(self):
+        self.request_timer = None
+        # Метка маршрута для метрик - шаблон пути, а не сам путь: число
+        # рядов не растет с числом заказов и случайных адресов
+        self.route_label = 'other'
+        try:
+            super().handle_one_request()
+        finally:
+            if self.request_timer is not None:
+                method = self.command if self.command in HTTP_METHODS else 'other'
+                duration = metrics.registry.request_finished(method, self.route_label, self.request_timer)
+                metrics.reset(self._timer_token)
+                if slow_requests.enabled and duration >= slow_requests.threshold:
+                    self.log_slow_request(method, duration)
+    
+    def log_slow_request(self, method, duration):
+        """Запись запроса в журнал медленных запросов (ответ уже отправлен)"""
+        timer = self.request_timer
+        try:
+            slow_requests.record(method, self.path, self.route_label, timer, duration)
+        except OSError as e:
+            self.log_error('Slow request log: %s', e)
+        self.log_message('Slow request "%s %s" %s: %.0f ms, SQL %.0f ms, %d bytes',
+                         self.command, self.path, timer.status, duration * 1000, timer.sql * 1000, timer.sent)
+    
+    def send_response_only(self, code, message=None):
+        if getattr(self, 'request_timer', None) is not None:
+            self.request_timer.status = int(code)
+        self._response_code = int(code)
+        super().send_response_only(code, message)
+    
+    def send_header(self, keyword, value):
+        # Конец ответа клиент находит по длине или по блокам chunked
+        name = keyword.lower()
+        if name == 'content-length' or (name == 'transfer-encoding' and value.lower() == 'chunked'):
+            self._framed = True
+        super().send_header(keyword, value)
+    
+    def end_headers(self):
+        # Соединение остается открытым, только если клиент найдет конец
+        # ответа, тело запроса прочитано и сервер не перегружен
+        if not self.close_connection:
+            framed = self._framed or self._response_code in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED)
+            if not framed or self.body_unread() or not self.keep_alive_allowed():
+                self.send_header('Connection', 'close')
+            elif self.request_version == 'HTTP/1.0':
+                self.send_header('Connection', 'keep-alive')
+        super().end_headers()
+    
+    def read_body(self):
+        """Тело запроса по Content-Length"""
+        self._body_read = True
+        self.request_body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        return self.request_body
+    
+    def body_unread(self):
+        """Осталось ли в соединении непрочитанное тело запроса"""
+        if self._body_read:
+            return False
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            return True
+        return length > 0 or 'Transfer-Encoding' in self.headers
+    
+    def send_body(self, status, content_type, body, headers=None):
+        """Ответ с телом известной длины.
+        
+        Текстовые ответы от COMPRESS_MIN_SIZE байт сжимаются, если клиент
+        принимает gzip или deflate.
+        """
+        compressible = content_type.startswith(COMPRESSIBLE_TYPES)
+        encoding = None
+        if compressible and len(body) >= COMPRESS_MIN_SIZE:
+            encoding = choose_encoding(self.headers.get('Accept-Encoding'))
+            if encoding:
+                with metrics.phase('serialize'):
+                    compressor = make_compressor(encoding)
+                    body = compressor.compress(body) + compressor.flush()
+        
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        for name, value in (headers or {}).items():
+            if encoding and name == 'ETag' and not value.startswith('W/'):
+                # Сжатое представление не совпадает побайтно с исходным
+                value = 'W/' + value
+            self.send_header(name, value)
+        if compressible:
+            self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_json(self, status, payload, headers=None):
+        """JSON ответ"""
+        self.send_body(status, 'application/json', encode_json(payload), headers)
+    
+    def idempotency_key(self):
+        """Заголовок Idempotency-Key и отпечаток запроса: (None, None) без ключа.
+        
+        При неверном ключе отправляет 400 и возвращает None.
+        """
+        key = self.headers.get('Idempotency-Key')
+        if key is None:
+            return None, None
+        if not key or len(key) > MAX_KEY_LENGTH:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': 'Invalid Idempotency-Key'})
+            return None
+        return key, request_hash(self.command, self.path, self.request_body)
+    
+    def submit_write(self, shard, operation, respond, after=None, batched=True):
+        """Операция записи в шарде и ответ на запрос с учетом заголовка Idempotency-Key.
+        
+        operation(conn) выполняется в транзакции записи шарда (см.
+        run_write), respond(result) строит по ее результату ответ (status,
+        payload, headers), after(result) вызывается после фиксации. Запрос с
+        уже известным ключом получает сохраненный ответ, и операция не
+        выполняется.
+        """
+        idempotency = self.idempotency_key()
+        if idempotency is None:
+            return
+        key, fingerprint = idempotency
+        if not self.claim_idempotency_key(key, fingerprint):
+            return
+        result, stored, replayed = run_write(shard, operation, respond, key, fingerprint, batched)
+        if replayed:
+            self.send_replay(stored, fingerprint)
+            return
+        if after:
+            after(result)
+        self.send_body(stored.status, 'application/json', stored.body, stored.headers)
+    
+    def claim_idempotency_key(self, key, fingerprint):
+        """Закрепление ключа за запросом в каталоге шардов (без шардов - не нужно).
+        
+        Ответ хранится в шарде записи, поэтому без каталога тот же ключ с
+        запросом для другого шарда выполнился бы заново. Для ключа другого
+        запроса отправляет 422 и возвращает False.
+        """
+        if key is None or not store.catalog:
+            return True
+        with store.catalog.writer() as conn:
+            claimed = idempotency_keys.claim(conn, key, fingerprint)
+        if not claimed:
+            self.send_key_conflict()
+        return claimed
+    
+    def send_key_conflict(self):
+        """422 для ключа, уже использованного другим запросом"""
+        idempotency_keys.record_conflict()
+        self.send_json(HTTPStatus.UNPROCESSABLE_ENTITY,
+                       {'error': 'Idempotency-Key was already used for a different request'})
+    
+    def send_replay(self, stored, fingerprint):
+        """Сохраненный ответ на повтор запроса или 422 для ключа другого запроса"""
+        if stored.request_hash != fingerprint:
+            self.send_key_conflict()
+            return
+        idempotency_keys.record_replay()
+        self.send_body(stored.status, 'application/json', stored.body,
+                       {**stored.headers, 'Idempotent-Replayed': 'true'})
+    
+    def submit_bulk(self, parts, summarize):
+        """Пакетная запись, разделенная по шардам.
+        
+        parts - [(shard, indexes, operation, after)]: operation(conn)
+        выполняется в отдельной транзакции своего шарда и возвращает
+        (first, last, results) с результатами для элементов запроса с
+        номерами indexes, after(result) вызывается после фиксации. Части
+        пишутся параллельно; атомарна каждая из них, но не весь пакет.
+        summarize(results) строит ответ по результатам всех элементов. С
+        Idempotency-Key каждая часть сохраняет свой ответ под ключом
+        "ключ/номер шарда".
+        """
+        def respond(result):
+            return HTTPStatus.OK, summarize(result[2]), None
+        
+        if len(parts) == 1:
+            shard, _, operation, after = parts[0]
+            self.submit_write(shard, operation, respond, after, batched=False)
+            return
+        
+        idempotency = self.idempotency_key()
+        if idempotency is None:
+            return
+        key, fingerprint = idempotency
+        if not self.claim_idempotency_key(key, fingerprint):
+            return
+        
+        def write(part):
+            shard, indexes, operation, after = part
+            result, stored, replayed = run_write(shard, operation, respond, key and f'{key}/{shard.index}',
+                                                 fingerprint, batched=False)
+            if not replayed and after:
+                after(result)
+            return indexes, stored, replayed
+        
+        written = store.scatter(write, parts)
+        for _, stored, replayed in written:
+            if replayed and stored.request_hash != fingerprint:
+                self.send_replay(stored, fingerprint)
+                return
+        
+        results = [None] * sum(len(indexes) for indexes, _, _ in written)
+        for indexes, stored, _ in written:
+            for index, item in zip(indexes, json.loads(stored.body)['results']):
+                results[index] = item
+        headers = None
+        if all(replayed for _, _, replayed in written):
+            idempotency_keys.record_replay()
+            headers = {'Idempotent-Replayed': 'true'}
+        self.send_json(HTTPStatus.OK, summarize(results), headers)
+    
+    def dispatch(self):
+        """Вызов обработчика маршрута из таблицы router.
+        
+        Неизвестный путь - 404, неподдерживаемый для пути метод - 405,
+        запрос сверх бюджета класса маршрута - 503, сверх темпа клиента -
+        429 (admission.py). Ошибки разбора тела запроса дают 400, прочие исключения
+        обработчика - 500, если ответ еще не начат.
+        """
+        url = urllib.parse.urlsplit(self.path)
+        route, params, template = router.match(self.command, url.path)
+        if template is None:
+            self.send_json(HTTPStatus.NOT_FOUND, {'error': 'Endpoint not found'})
+            return
+        self.route_label = template
+        if route is None:
+            self.send_json(HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'Method not allowed'},
+                           {'Allow': ', '.join(router.allowed_methods(template))})
+            return
+        
+        self.query_params = urllib.parse.parse_qs(url.query)
+        # Сверх бюджета класса маршрута или темпа клиента - сразу 503/429
+        rejection = admission_control.admit(route.budget, self.client_address[0])
+        if rejection:
+            self.send_json(rejection.status, {'error': rejection.error},
+                           {'Retry-After': str(rejection.retry_after)})
+            return
+        profile = profiler.begin(template) if profiler.remaining else None
+        try:
+            route.handler(self, **params, **route.defaults)
+        except Exception as e:
+            if self._response_code is not None:
+                # Ответ уже начат: его не исправить, соединение закрывается
+                self.close_connection = True
+                raise
+            if isinstance(e, (json.JSONDecodeError, UnicodeDecodeError)):
+                self.send_json(HTTPStatus.BAD_REQUEST, {'error': 'Invalid JSON body'})
+                return
+            self.log_error('Unhandled error in %s %s:\n%s', self.command, self.path, traceback.format_exc())
+            self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': 'Internal server error'})
+        finally:
+            admission_control.release(route.budget)
+            if profile:
+                # Ответ уже отправлен: ошибка записи профиля только в журнал
+                try:
+                    profiler.finish(profile, self.command, template, self._response_code)
+                except OSError as e:
+                    self.log_error('Profile: %s', e)
+    
+    do_GET = do_HEAD = do_POST = do_PUT = do_DELETE = do_PATCH = do_OPTIONS = dispatch
+    
+    def handle_static(self, path):
+        """Статические файлы из каталога static"""
+        # translate_path нормализует путь уже после раскодирования: %2e%2e
+        # вывел бы за пределы static
+        if '..' in path.replace('\\', '/').split('/'):
+            self.send_json(HTTPStatus.NOT_FOUND, {'error': 'Endpoint not found'})
+            return
+        if self.command == 'HEAD':
+            super().do_HEAD()
+        else:
+            super().do_GET()
+    
+    def handle_get_orders(self):
+        """Получение списка заказов с фильтрацией"""
+        params = self.query_params
+        
+        # Параметры фильтрации
+        filters = parse_order_filters(params)
+        
+        # Постраничная выдача и выбор полей
+        limit = params.get('limit', [None])[0]
+        cursor = params.get('cursor', [None])[0]
+        fields = params.get('fields', [None])[0]
+        paged = limit is not None or cursor is not None
+        ndjson = 'application/x-ndjson' in self.headers.get('Accept', '')
+        
+        # Заказы одного пункта выдачи лежат в одном шарде, остальные
+        # выборки собираются со всех. Результаты поиска по нескольким
+        # шардам упорядочены по дате, а не по релевантности
+        shards = store.shards_for_point(filters['pickup_point'])
+        ranked = len(shards) == 1
+        
+        try:
+            fields = parse_fields(fields)
+            limit = parse_limit(limit) if paged else None
+            after = decode_cursor(cursor) if cursor else None
+            query, args = build_orders_query(**filters, fields=fields, after=after, limit=limit, ranked=ranked)
+        except ValueError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+            return
+        
+        # Полный список отдается потоком прямо из курсоров БД:
+        # память не растет с размером выборки
+        if not paged:
+            with contextlib.ExitStack() as stack:
+                # Версия данных и сам список читаются из одного снимка каждого шарда
+                conns = [stack.enter_context(shard.pool.reader()) for shard in shards]
+                for conn in conns:
+                    conn.execute("BEGIN")
+                etag = make_etag(format_version([current_version(conn) for conn in conns]), self.path, ndjson)
+                if self.send_not_modified(etag):
+                    return
+                
+                cursor = merge_cursors([conn.execute(query, args) for conn in conns], STREAM_BATCH_SIZE)
+                if ndjson:
+                    self.send_stream('application/x-ndjson', iter_ndjson(cursor, fields), {'ETag': etag})
+                else:
+                    self.send_stream('application/json', iter_json_array(cursor, fields), {'ETag': etag})
+            return
+        
+        def read_page(shard):
+            with shard.pool.reader() as conn:
+                conn.execute("BEGIN")
+                return current_version(conn), conn.execute(query, args).fetchall()
+        
+        pages = store.scatter(read_page, shards)
+        etag = make_etag(format_version([version for version, _ in pages]), self.path, ndjson)
+        if self.send_not_modified(etag):
+            return
+        rows = merge_pages([rows for _, rows in pages], limit)
+        
+        # Курсор строится по последней строке страницы, поэтому берем
+        # ее до того, как лишние служебные поля будут отброшены
+        next_cursor = None
+        if len(rows) == limit:
+            if (ranked and filters['search'] and not filters['include_archived']
+                    and match_expression(filters['search'])):
+                next_cursor = encode_cursor((after or 0) + limit)
+            else:
+                next_cursor = encode_cursor((rows[-1]['order_date'], rows[-1]['id']))
+        
+        orders = [row_to_dict(row, fields) for row in rows]
+        
+        if ndjson:
+            with metrics.phase('serialize'):
+                body = ''.join(json.dumps(order, default=json_serializer) + '\n' for order in orders).encode()
+            headers = {'ETag': etag}
+            if next_cursor:
+                headers['X-Next-Cursor'] = next_cursor
+            self.send_body(HTTPStatus.OK, 'application/x-ndjson', body, headers)
+            return
+        
+        self.send_json(HTTPStatus.OK, {'orders': orders, 'next_cursor': next_cursor}, {'ETag': etag})
+    
+    def handle_export_orders(self):
+        """Выгрузка заказов в CSV для бухгалтерии (потоком)"""
+        params = self.query_params
+        filters = parse_order_filters(params)
+        
+        try:
+            fields = parse_fields(params.get('fields', [None])[0]) or list(ORDER_FIELDS)
+        except ValueError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+            return
+        
+        shards = store.shards_for_point(filters['pickup_point'])
+        query, args = build_orders_query(**filters, fields=fields, ranked=len(shards) == 1)
+        
+        with contextlib.ExitStack() as stack:
+            conns = [stack.enter_context(shard.pool.reader()) for shard in shards]
+            cursor = merge_cursors([conn.execute(query, args) for conn in conns], STREAM_BATCH_SIZE)
+            self.send_stream('text/csv; charset=utf-8', iter_csv(cursor, fields),
+                             {'Content-Disposition': 'attachment; filename="orders.csv"'})
+    
+    def send_not_modified(self, etag):
+        """Ответ 304, если у клиента уже есть актуальная версия (If-None-Match)"""
+        if not etag_matches(self.headers.get('If-None-Match'), etag):
+            return False
+        self.send_response(HTTPStatus.NOT_MODIFIED)
+        self.send_header('ETag', etag)
+        self.end_headers()
+        return True
+    
+    def send_stream(self, content_type, parts, headers=None):
+        """Потоковая отправка ответа 200 из итератора строк.
+        
+        Клиентам HTTP/1.1 тело отправляется с Transfer-Encoding: chunked
+        (соединение после него остается открытым), клиентам HTTP/1.0 - без
+        длины до закрытия соединения. Мелкие части склеиваются в блоки по
+        STREAM_CHUNK_SIZE байт; блоки сжимаются, если клиент это принимает.
+        """
+        chunked = self.request_version != 'HTTP/1.0'
+        compressible = content_type.startswith(COMPRESSIBLE_TYPES)
+        encoding = choose_encoding(self.headers.get('Accept-Encoding')) if compressible else None
+        compressor = make_compressor(encoding) if encoding else None
+        
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-type', content_type)
+        for name, value in (headers or {}).items():
+            if encoding and name == 'ETag' and not value.startswith('W/'):
+                value = 'W/' + value
+            self.send_header(name, value)
+        if compressible:
+            self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        
+        def write(data, final=False):
+            if compressor:
+                with metrics.phase('serialize'):
+                    data = compressor.compress(data) + (compressor.flush() if final else b'')
+            if not data:
+                return
+            if chunked:
+                self.wfile.write(b'%X\r\n%s\r\n' % (len(data), data))
+            else:
+                self.wfile.write(data)
+        
+        buffer = []
+        size = 0
+        try:
+            for part in parts:
+                data = part.encode()
+                buffer.append(data)
+                size += len(data)
+                if size >= STREAM_CHUNK_SIZE:
+                    write(b''.join(buffer))
+                    buffer = []
+                    size = 0
+            write(b''.join(buffer), final=True)
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент закрыл соединение, не дочитав ответ
+            self.close_connection = True
+        except BaseException:
+            # Ответ оборван на середине: на этом соединении его уже не завершить
+            self.close_connection = True
+            raise
+    
+    def handle_get_order(self, order_id=None, order_number=None):
+        """Получение конкретного заказа по id или номеру"""
+        # Часто запрашиваемые заказы отдаются из кэша без запроса к БД и сериализации
+        cached = order_cache.get(order_id=order_id, order_number=order_number)
+        if cached:
+            version, body = cached.version, cached.body
+        else:
+            generation = order_cache.generation()
+            
+            def find(shard):
+                with shard.pool.reader() as conn:
+                    if order_number is not None:
+                        order = conn.execute("SELECT * FROM orders WHERE order_number = ?",
+                                             (order_number,)).fetchone()
+                    else:
+                        order = conn.execute("SELECT * FROM orders WHERE id = ?", (order_id,)).fetchone()
+                    if not order:
+                        # Закрытые заказы могли уйти в архив
+                        order = archive.find_order(conn, order_id=order_id, order_number=order_number)
+                return order
+            
+            # Шард заказа известен по id, а по номеру - из каталога шардов
+            shards = store.shards_of_number(order_number) if order_id is None else [store.shard_of_order(order_id)]
+            order = store.first(find, shards)
+            
+            if not order:
+                self.send_json(HTTPStatus.NOT_FOUND, {'error': 'Order not found'})
+                return
+            
+            version = order['version']
+            body = encode_json(order)
+            order_cache.put(generation, order['id'], order['order_number'], version, body)
+        
+        # Версия строки меняется при каждом изменении заказа
+        etag = make_etag(version)
+        if self.send_not_modified(etag):
+            return
+        self.send_body(HTTPStatus.OK, 'application/json', body, {'ETag': etag})
+    
+    def handle_get_stats(self):
+        """Получение статистики"""
+        # Счетчики ведутся триггерами при каждом изменении заказов,
+        # поэтому здесь только чтение нескольких строк агрегатов каждого
+        # шарда. Счетчик "сегодня" меняется и без изменения данных, в полночь
+        today = datetime.date.today().isoformat()
+        
+        def read(shard):
+            with shard.pool.reader() as conn:
+                conn.execute("BEGIN")
+                return current_version(conn), stats.read_stats(conn, today)
+        
+        parts = store.scatter(read)
+        etag = make_etag(format_version([version for version, _ in parts]), today)
+        if self.send_not_modified(etag):
+            return
+        
+        self.send_json(HTTPStatus.OK, stats.combine([result for _, result in parts]), {'ETag': etag})
+    
+    def handle_get_changes(self):
+        """Изменения заказов после версии since для синхронизации локальной копии"""
+        params = self.query_params
+        
+        try:
+            since = parse_version(params.get('since', ['0'])[0], len(store.shards), 'since')
+            limit = parse_limit(params.get('limit', [str(MAX_PAGE_SIZE)])[0])
+        except ValueError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+            return
+        
+        # У каждого шарда свой журнал версий: version в ответе - версии
+        # всех шардов, а лимит делится между ними
+        shard_limit = math.ceil(limit / len(store.shards))
+        
+        def read(shard):
+            with shard.pool.reader() as conn:
+                conn.execute("BEGIN")
+                return changes_since(conn, since[shard.index], shard_limit)
+        
+        parts = store.scatter(read)
+        self.send_json(HTTPStatus.OK, {
+            'changes': [order for changes, _, _, _ in parts for order in changes],
+            'deleted': [order for _, deleted, _, _ in parts for order in deleted],
+            'version': format_version([version for _, _, version, _ in parts]),
+            'has_more': any(has_more for _, _, _, has_more in parts)
+        })
+    
+    def handle_get_events(self):
+        """Поток изменений заказов (Server-Sent Events) вместо опроса списка"""
+        params = self.query_params
+        
+        try:
+            last_event_id = self.headers.get('Last-Event-ID') or params.get('last_event_id', [None])[0]
+            if last_event_id is not None:
+                last_event_id = parse_version(last_event_id, len(store.shards), 'Last-Event-ID')
+        except ValueError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+            return
+        
+        hubs = [shard.events for shard in store.shards]
+        subscription = None
+        # Поток событий держится вне рабочего потока, поэтому нужен сервер с detach_request
+        if hasattr(self.server, 'detach_request'):
+            subscription, backlog, complete = subscribe_all(
+                hubs,
+                statuses=params.get('status'),
+                pickup_points=params.get('pickup_point'),
+                last_event_ids=last_event_id
+            )
+        
+        if not subscription:
+            self.send_json(HTTPStatus.SERVICE_UNAVAILABLE, {'error': 'Event stream is not available'},
+                           {'Retry-After': '5'})
+            return
+        
+        try:
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-type', 'text/event-stream; charset=utf-8')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('X-Accel-Buffering', 'no')
+            self.end_headers()
+            self.wfile.write(b'retry: 3000\n\n')
+            self.wfile.flush()
+        except OSError:
+            for hub in hubs:
+                hub.unsubscribe(subscription)
+            raise
+        
+        self.close_connection = True
+        self.server.detach_request(self.request, self.event_stream, hubs, subscription, backlog, complete)
+    
+    def handle_get_metrics(self):
+        """Метрики процесса в текстовом формате Prometheus"""
+        self.send_body(HTTPStatus.OK, 'text/plain; version=0.0.4; charset=utf-8',
+                       metrics.registry.render().encode())
+    
+    def require_admin(self):
+        """Служебные маршруты доступны только с локального адреса"""
+        try:
+            address = ipaddress.ip_address(self.client_address[0].partition('%')[0])
+            if (getattr(address, 'ipv4_mapped', None) or address).is_loopback:
+                return True
+        except ValueError:
+            pass
+        self.send_json(HTTPStatus.FORBIDDEN, {'error': 'Admin endpoints are available only from localhost'})
+        return False
+    
+    def handle_get_slow_requests(self):
+        """Порог и последние записи журнала медленных запросов"""
+        if not self.require_admin():
+            return
+        self.send_json(HTTPStatus.OK, {**slow_requests.stats(), 'requests': slow_requests.entries()})
+    
+    def handle_set_slow_requests(self):
+        """Порог журнала медленных запросов: {"threshold_ms": 250}, 0 - выключить"""
+        if not self.require_admin():
+            return
+        data = json.loads(self.read_body().decode())
+        threshold = data.get('threshold_ms') if isinstance(data, dict) else None
+        if isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or threshold < 0:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': 'threshold_ms must be a non-negative number'})
+            return
+        slow_requests.threshold = threshold / 1000
+        self.send_json(HTTPStatus.OK, slow_requests.stats())
+    
+    def handle_get_profile(self):
+        """Состояние профилирования и последние файлы .pstats"""
+        if not self.require_admin():
+            return
+        self.send_json(HTTPStatus.OK, profiler.stats())
+    
+    def handle_start_profile(self):
+        """Профилирование следующих запросов: {"requests": 20, "sample": 0.1, "route": "/api/orders"}"""
+        if not self.require_admin():
+            return
+        data = json.loads(self.read_body().decode())
+        if not isinstance(data, dict):
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': 'JSON object expected'})
+            return
+        requests = data.get('requests')
+        sample = data.get('sample', 1)
+        route = data.get('route')
+        if isinstance(requests, bool) or not isinstance(requests, int):
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': 'requests must be an integer'})
+            return
+        if isinstance(sample, bool) or not isinstance(sample, (int, float)):
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': 'sample must be a number'})
+            return
+        if route is not None and route not in {r.template for r in router.routes()}:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': f'Unknown route: {route}'})
+            return
+        try:
+            profiler.start(requests, sample, route)
+        except ValueError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+            return
+        self.send_json(HTTPStatus.ACCEPTED, profiler.stats())
+    
+    def handle_stop_profile(self):
+        """Остановка профилирования"""
+        if not self.require_admin():
+            return
+        profiler.stop()
+        self.send_json(HTTPStatus.OK, profiler.stats())
+    
+    def handle_get_timeseries(self):
+        """Число заказов и выручка по часам/дням/неделям из сверток"""
+        params = self.query_params
+        
+        try:
+            options = analytics.parse_timeseries_params(params)
+        except ValueError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+            return
+        
+        def read(shard):
+            with shard.pool.reader() as conn:
+                return analytics.timeseries(conn, **options)
+        
+        shards = store.shards_for_point(options['filters'].get('pickup_point'))
+        series = analytics.combine(store.scatter(read, shards), options['group_by'])
+        
+        result = {
+            'granularity': options['granularity'],
+            'date_from': options['date_from'].isoformat(),
+            'date_to': options['date_to'].isoformat(),
+            'group_by': options['group_by'],
+            'series': series,
+        }
+        
+        self.send_json(HTTPStatus.OK, result)
+    
+    def handle_create_order(self):
+        """Создание нового заказа"""
+        post_data = self.read_body()
+        order_data = json.loads(post_data.decode())
+        
+        # Валидация данных
+        error = orders.validate_order(order_data)
+        if error:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': error})
+            return
+        
+        shard = store.shard_for_point(order_data['pickup_point'])
+        # Номер, закрепленный за другим шардом, - дубликат (см. shards.py)
+        taken = store.claim_numbers([order_data['order_number']], shard)
+        
+        def create(conn):
+            # Номер проверяется и среди архивных заказов (см. orders.existing_numbers)
+            if taken or orders.existing_numbers(conn, [order_data['order_number']]):
+                return None, None
+            cursor = conn.execute(orders.INSERT_ORDER_SQL, orders.order_values(order_data))
+            return cursor.lastrowid, current_version(conn)
+        
+        def created(result):
+            if result[1]:
+                shard.events.notify(result[1], 'created')
+        
+        def respond(result):
+            order_id = result[0]
+            if order_id is None:
+                return HTTPStatus.BAD_REQUEST, {'error': 'Duplicate order_number'}, None
+            return (HTTPStatus.CREATED, {'id': order_id, 'message': 'Order created successfully'},
+                    {'Location': f'/api/orders/{order_id}'})
+        
+        self.submit_write(shard, create, respond, created)
+    
+    def send_order_missing(self, archived):
+        """404 для несуществующего заказа, 409 для перенесенного в архив"""
+        if archived:
+            self.send_json(HTTPStatus.CONFLICT, {'error': 'Order is archived'})
+            return
+        self.send_json(HTTPStatus.NOT_FOUND, {'error': 'Order not found'})
+    
+    def read_json_object(self):
+        """JSON объект из тела запроса. Если тело - не объект, отправляет 400 и возвращает None"""
+        data = json.loads(self.read_body().decode())
+        if not isinstance(data, dict):
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': 'JSON object expected'})
+            return None
+        return data
+    
+    def read_bulk_items(self, field=None):
+        """Массив из тела пакетного запроса (все тело или его поле field).
+        
+        При ошибке отправляет 400 и возвращает None.
+        """
+        try:
+            data = json.loads(self.read_body().decode())
+            items = data.get(field) if field and isinstance(data, dict) else data
+            if not isinstance(items, list):
+                raise ValueError(f'Expected an array{" in " + field if field else ""}')
+            if len(items) > orders.MAX_BULK_ITEMS:
+                raise ValueError(f'At most {orders.MAX_BULK_ITEMS} items per request')
+        except ValueError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+            return None
+        return items
+    
+    def handle_bulk_create_orders(self):
+        """Создание пакета заказов одной транзакцией на шард с результатом по каждому"""
+        items = self.read_bulk_items()
+        if items is None:
+            return
+        
+        def part(shard, indexes):
+            part_items = [items[index] for index in indexes]
+            taken = store.claim_numbers((items[index]['order_number'] for index in indexes if valid[index]),
+                                        shard)
+            
+            def create(conn):
+                first = current_version(conn) + 1
+                results = orders.create_orders(conn, part_items, taken)
+                for result in results:
+                    result['index'] = indexes[result['index']]
+                return first, current_version(conn), results
+            
+            def created(result):
+                first, last, _ = result
+                if last >= first:
+                    shard.events.notify_range(first, last, 'created')
+            
+            return shard, indexes, create, created
+        
+        def summarize(results):
+            created = sum(1 for item in results if 'id' in item)
+            return {
+                'results': results,
+                'created': created,
+                'failed': len(results) - created
+            }
+        
+        # Некорректные заказы получают ошибку в любом шарде; их пункт выдачи
+        # не закрепляется за шардом в каталоге
+        valid = [orders.validate_order(item) is None for item in items]
+        shards = [store.shard_for_point(item['pickup_point']) if item_valid else store.shards[0]
+                  for item, item_valid in zip(items, valid)]
+        self.submit_bulk([part(shard, indexes) for shard, indexes in store.group(shards)], summarize)
+    
+    def handle_bulk_close_orders(self, status, action):
+        """Пакетная выдача или отмена заказов {"order_ids": [...]}"""
+        order_ids = self.read_bulk_items('order_ids')
+        if order_ids is None:
+            return
+        
+        def part(shard, indexes):
+            part_ids = [order_ids[index] for index in indexes]
+            
+            def close(conn):
+                first = current_version(conn) + 1
+                results = orders.close_orders(conn, part_ids, status)
+                return first, current_version(conn), results
+            
+            def closed(result):
+                first, last, results = result
+                order_cache.invalidate(*(item['order_id'] for item in results if 'error' not in item))
+                if last >= first:
+                    shard.events.notify_range(first, last, action)
+            
+            return shard, indexes, close, closed
+        
+        def summarize(results):
+            succeeded = sum(1 for item in results if 'error' not in item)
+            return {
+                'results': results,
+                action: succeeded,
+                'failed': len(results) - succeeded
+            }
+        
+        groups = store.group(store.shards_of_orders(order_ids))
+        self.submit_bulk([part(shard, indexes) for shard, indexes in groups], summarize)
+    
+    def handle_issue_order(self):
+        """Выдача заказа"""
+        data = self.read_json_object()
+        if data is None:
+            return
+        
+        order_id = data.get('order_id')
+        if not order_id:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': 'order_id is required'})
+            return
+        
+        shard = store.shard_of_order(order_id)
+        
+        def issue(conn):
+            # Проверяем существование заказа
+            order = conn.execute("SELECT status FROM orders WHERE id = ?", (order_id,)).fetchone()
+            if order and order[0] not in ['Выдан', 'Отменен']:
+                conn.execute("UPDATE orders SET status = 'Выдан' WHERE id = ?", (order_id,))
+                return order, current_version(conn)
+            return order, None
+        
+        def issued(result):
+            if result[1]:
+                order_cache.invalidate(order_id)
+                shard.events.notify(result[1], 'issued')
+        
+        def respond(result):
+            order = result[0]
+            if not order:
+                return HTTPStatus.NOT_FOUND, {'error': 'Order not found'}, None
+            if order[0] in ['Выдан', 'Отменен']:
+                return HTTPStatus.BAD_REQUEST, {'error': f'Order already {order[0].lower()}'}, None
+            return HTTPStatus.OK, {'message': 'Order issued successfully'}, None
+        
+        self.submit_write(shard, issue, respond, issued)
+    
+    def handle_cancel_order(self):
+        """Отмена заказа"""
+        data = self.read_json_object()
+        if data is None:
+            return
+        
+        order_id = data.get('order_id')
+        reason = data.get('reason', '')
+        
+        if not order_id:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': 'order_id is required'})
+            return
+        
+        shard = store.shard_of_order(order_id)
+        
+        def cancel(conn):
+            order = conn.execute("SELECT status FROM orders WHERE id = ?", (order_id,)).fetchone()
+            if order and order[0] not in ['Выдан', 'Отменен']:
+                conn.execute("UPDATE orders SET status = 'Отменен' WHERE id = ?", (order_id,))
+                return order, current_version(conn)
+            return order, None
+        
+        def cancelled(result):
+            if result[1]:
+                order_cache.invalidate(order_id)
+                shard.events.notify(result[1], 'cancelled')
+        
+        def respond(result):
+            order = result[0]
+            if not order:
+                return HTTPStatus.NOT_FOUND, {'error': 'Order not found'}, None
+            if order[0] in ['Выдан', 'Отменен']:
+                return HTTPStatus.BAD_REQUEST, {'error': f'Order already {order[0].lower()}'}, None
+            return HTTPStatus.OK, {'message': 'Order cancelled successfully'}, None
+        
+        self.submit_write(shard, cancel, respond, cancelled)
+    
+    def handle_update_order_status(self, order_id):
+        """Обновление статуса заказа"""
+        data = self.read_json_object()
+        if data is None:
+            return
+        
+        new_status = data.get('status')
+        valid_statuses = ['Ожидает выдачи', 'Готов к выдаче', 'Выдан', 'Отменен']
+        
+        if not new_status or new_status not in valid_statuses:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': 'Invalid status'})
+            return
+        
+        def update_status(conn):
+            cursor = conn.execute("UPDATE orders SET status = ? WHERE id = ?", (new_status, order_id))
+            if cursor.rowcount == 0:
+                return 0, is_archived(conn, order_id)
+            return cursor.rowcount, current_version(conn)
+        
+        shard = store.shard_of_order(order_id)
+        updated, version = shard.writes.submit(update_status)
+        if updated:
+            order_cache.invalidate(order_id)
+            shard.events.notify(version, 'status_changed')
+        
+        if updated == 0:
+            self.send_order_missing(version)
+            return
+        
+        self.send_json(HTTPStatus.OK, {'message': 'Status updated successfully'})
+    
+    def handle_delete_order(self, order_id):
+        """Удаление заказа (только для отмененных)"""
+        def delete(conn):
+            order = conn.execute("SELECT status, order_number FROM orders WHERE id = ?", (order_id,)).fetchone()
+            if order and order[0] == 'Отменен':
+                conn.execute("DELETE FROM orders WHERE id = ?", (order_id,))
+                return order, current_version(conn)
+            if not order:
+                return None, is_archived(conn, order_id)
+            return order, None
+        
+        shard = store.shard_of_order(order_id)
+        order, version = shard.writes.submit(delete)
+        if order and version:
+            order_cache.invalidate(order_id)
+            store.release_number(order[1], shard)
+            shard.events.notify(version, 'deleted')
+        
+        if not order:
+            self.send_order_missing(version)
+            return
+        
+        if order[0] != 'Отменен':
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': 'Only cancelled orders can be deleted'})
+            return
+        
+        self.send_json(HTTPStatus.OK, {'message': 'Order deleted successfully'})
+
+class AsyncPVZHandler(AsyncHandlerMixin, PVZHandler):
+    """Обработчик PVZHandler для режима asyncio: запросы передает цикл событий"""
+    
+    # Подписчик ждет событий в цикле, не занимая поток
+    event_stream = staticmethod(stream_events_async)
+
+# Маршруты API. Описание выводится в списке адресов при запуске сервера,
+# budget - класс маршрута для допуска запросов: тяжелое чтение, запись и
+# выдача/отмена, которые ждет клиент у стойки
+router = Router()
+router.add('GET', '/static/{path:path}', PVZHandler.handle_static)
+router.add('HEAD', '/static/{path:path}', PVZHandler.handle_static)
+router.add('GET', '/api/orders', PVZHandler.handle_get_orders, summary='список заказов', budget='read')
+router.add('GET', '/api/orders/export', PVZHandler.handle_export_orders, summary='выгрузка заказов в CSV',
+           budget='read')
+router.add('GET', '/api/orders/changes', PVZHandler.handle_get_changes,
+           summary='изменения после версии N (?since=N)', budget='read')
+router.add('GET', '/api/events', PVZHandler.handle_get_events,
+           summary='поток изменений заказов (Server-Sent Events)')
+router.add('GET', '/api/orders/{order_id:int}', PVZHandler.handle_get_order, summary='конкретный заказ')
+router.add('GET', '/api/orders/by-number/{order_number}', PVZHandler.handle_get_order, summary='заказ по номеру')
+router.add('GET', '/api/stats', PVZHandler.handle_get_stats, summary='статистика')
+router.add('GET', '/api/stats/timeseries', PVZHandler.handle_get_timeseries,
+           summary='заказы и выручка по периодам', budget='read')
+router.add('GET', '/api/metrics', PVZHandler.handle_get_metrics, summary='метрики процесса (Prometheus)')
+router.add('POST', '/api/orders', PVZHandler.handle_create_order, summary='создать заказ', budget='write')
+router.add('POST', '/api/orders/issue', PVZHandler.handle_issue_order, summary='выдать заказ',
+           budget='priority')
+router.add('POST', '/api/orders/cancel', PVZHandler.handle_cancel_order, summary='отменить заказ',
+           budget='priority')
+router.add('POST', '/api/orders/bulk', PVZHandler.handle_bulk_create_orders, summary='создать пакет заказов',
+           budget='write')
+router.add('POST', '/api/orders/issue/bulk', PVZHandler.handle_bulk_close_orders,
+           defaults={'status': 'Выдан', 'action': 'issued'}, summary='выдать пакет заказов', budget='write')
+router.add('POST', '/api/orders/cancel/bulk', PVZHandler.handle_bulk_close_orders,
+           defaults={'status': 'Отменен', 'action': 'cancelled'}, summary='отменить пакет заказов', budget='write')
+router.add('PUT', '/api/orders/{order_id:int}/status', PVZHandler.handle_update_order_status,
+           summary='обновить статус', budget='write')
+router.add('DELETE', '/api/orders/{order_id:int}', PVZHandler.handle_delete_order, summary='удалить заказ',
+           budget='write')
+router.add('GET', '/api/admin/slow-requests', PVZHandler.handle_get_slow_requests,
+           summary='журнал медленных запросов')
+router.add('PUT', '/api/admin/slow-requests', PVZHandler.handle_set_slow_requests,
+           summary='порог журнала медленных запросов ({"threshold_ms": N}, 0 - выключить)')
+router.add('GET', '/api/admin/profile', PVZHandler.handle_get_profile, summary='состояние профилирования')
+router.add('POST', '/api/admin/profile', PVZHandler.handle_start_profile,
+           summary='профилировать следующие запросы в .pstats ({"requests": N, "sample", "route"})')
+router.add('DELETE', '/api/admin/profile', PVZHandler.handle_stop_profile, summary='остановить профилирование')
+router.compile()
+
+def parse_fields(fields):
+    """Разбор параметра fields=id,order_number,... (None - все поля)"""
+    if not fields:
+        return None
+    
+    result = []
+    for field in fields.split(','):
+        field = field.strip()
+        if field not in ORDER_FIELDS:
+            raise ValueError(f'Unknown field: {field}')
+        if field not in result:
+            result.append(field)
+    return result
+
+def parse_limit(limit):
+    """Размер страницы: по умолчанию DEFAULT_PAGE_SIZE, не больше MAX_PAGE_SIZE"""
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+def encode_cursor(position):
+    """Курсор страницы.
+    
+    position - (order_date, id) последнего отданного заказа или, для
+    результатов поиска, упорядоченных по релевантности, число уже
+    отданных строк.
+    """
+    raw = json.dumps(position).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Разбор курсора, полученного от encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        position = json.loads(raw)
+    except ValueError:
+        raise ValueError('Invalid cursor')
+    
+    if isinstance(position, int) and not isinstance(position, bool) and position >= 0:
+        return position
+    if (isinstance(position, list) and len(position) == 2
+            and isinstance(position[0], str) and isinstance(position[1], int)):
+        return tuple(position)
+    raise ValueError('Invalid cursor')
+
+def parse_order_filters(params):
+    """Параметры фильтрации списка заказов из строки запроса"""
+    return {
+        'status': params.get('status', [None])[0],
+        'search': params.get('search', [None])[0],
+        'date_from': params.get('date_from', [None])[0],
+        'date_to': params.get('date_to', [None])[0],
+        'pickup_point': params.get('pickup_point', [None])[0],
+        'include_archived': params.get('include_archived', ['0'])[0] in ('1', 'true'),
+    }
+
+def build_orders_query(status=None, search=None, date_from=None, date_to=None, pickup_point=None,
+                       include_archived=False, fields=None, after=None, limit=None, ranked=True):
+    """SQL запрос списка заказов с фильтрами.
+    
+    after - позиция из курсора (см. encode_cursor), после которой
+    начинается страница, limit - размер страницы. Для курсора в выборку
+    всегда попадают id и order_date. include_archived - выборка и из
+    архива закрытых заказов; поиск по ней идет без триграммного индекса.
+    ranked=False - результаты поиска по дате, как и остальные списки:
+    так их можно слить со страницами других шардов.
+    """
+    if fields:
+        columns = ', '.join([field for field in ('id', 'order_date') if field not in fields] + fields)
+    elif include_archived:
+        columns = ', '.join(ORDER_FIELDS)
+    else:
+        columns = 'orders.*'
+    
+    # Поиск идет по триграммному индексу orders_fts, результаты
+    # упорядочиваются по релевантности
+    match = match_expression(search) if search and not include_archived else None
+    if match:
+        source = "orders_fts JOIN orders ON orders.id = orders_fts.rowid"
+        where = " WHERE orders_fts MATCH ?"
+        args = [match]
+    else:
+        source = "orders"
+        where = " WHERE 1=1"
+        args = []
+    
+    if pickup_point:
+        where += " AND pickup_point = ?"
+        args.append(pickup_point)
+    
+    if status:
+        where += " AND status = ?"
+        args.append(status)
+    
+    if search and not match:
+        # Слишком короткая строка для триграмм или поиск вместе с архивом
+        where += " AND (order_number LIKE ? OR client_name LIKE ? OR phone LIKE ?)"
+        search_term = f"%{search}%"
+        args.extend([search_term, search_term, search_term])
+    
+    if date_from:
+        where += " AND order_date >= ?"
+        args.append(date_from)
+    
+    if date_to:
+        where += " AND order_date <= ?"
+        args.append(date_to)
+    
+    ranked = bool(match) and ranked
+    if after is not None and isinstance(after, int) != ranked:
+        raise ValueError('Invalid cursor')
+    
+    if ranked:
+        # Совпадений с поисковой строкой немного, поэтому страницы
+        # результатов поиска отсчитываются смещением
+        query = f"SELECT {columns} FROM {source}{where} ORDER BY orders_fts.rank, order_date DESC, id DESC"
+        if limit:
+            query += " LIMIT ? OFFSET ?"
+            args.extend([limit, after or 0])
+        return query, args
+    
+    # Keyset-пагинация: продолжение с места, где закончилась прошлая страница,
+    # без OFFSET, поэтому стоимость не растет с номером страницы
+    if after:
+        where += " AND (order_date, id) < (?, ?)"
+        args.extend(after)
+    
+    order = " ORDER BY order_date DESC, id DESC"
+    page = " LIMIT ?" if limit else ""
+    if include_archived:
+        # Каждая таблица отдает не больше страницы по своему индексу,
+        # и страница собирается из двух упорядоченных частей
+        part_args = args + ([limit] if limit else [])
+        query = (f"SELECT * FROM (SELECT {columns} FROM orders{where}{order}{page})"
+                 f" UNION ALL SELECT * FROM (SELECT {columns} FROM archive.orders{where}{order}{page})"
+                 f"{order}{page}")
+        return query, part_args + part_args + ([limit] if limit else [])
+    
+    query = f"SELECT {columns} FROM {source}{where}{order}{page}"
+    if limit:
+        args.append(limit)
+    return query, args
+
+def row_to_dict(row, fields=None):
+    """Заказ в виде словаря (только выбранные поля, если заданы)"""
+    if fields:
+        return {field: row[field] for field in fields}
+    return dict(row)
+
+def iter_rows(cursor, batch_size=STREAM_BATCH_SIZE):
+    """Чтение результата запроса пачками"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+def iter_json_array(cursor, fields=None):
+    """JSON массив заказов по частям"""
+    yield '['
+    first = True
+    for rows in iter_rows(cursor):
+        with metrics.phase('serialize'):
+            part = ', '.join(json.dumps(row_to_dict(row, fields), default=json_serializer) for row in rows)
+        yield part if first else ', ' + part
+        first = False
+    yield ']'
+
+def iter_ndjson(cursor, fields=None):
+    """Заказы в формате NDJSON: по одному JSON объекту на строку"""
+    for rows in iter_rows(cursor):
+        with metrics.phase('serialize'):
+            part = ''.join(json.dumps(row_to_dict(row, fields), default=json_serializer) + '\n' for row in rows)
+        yield part
+
+def iter_csv(cursor, fields):
+    """Заказы в формате CSV с заголовком"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM, чтобы Excel открывал кириллицу в UTF-8
+    buffer.write('\ufeff')
+    writer.writerow(fields)
+    for rows in iter_rows(cursor):
+        with metrics.phase('serialize'):
+            writer.writerows([row[field] for field in fields] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def run_write(shard, operation, respond, key=None, fingerprint=None, batched=True):
+    """operation(conn) в транзакции записи шарда и ответ на нее.
+    
+    Операция идет в очередь групповой записи шарда или, если
+    batched=False, в отдельную транзакцию; respond(result) строит ответ
+    (status, payload, headers). С ключом идемпотентности ответ сохраняется
+    в той же транзакции, а для уже известного ключа операция не
+    выполняется. Возвращает (result, StoredResponse, replayed).
+    """
+    submit = shard.writes.submit if batched else shard.transaction
+    if key is None:
+        result = submit(operation)
+        status, payload, headers = respond(result)
+        return result, StoredResponse(None, status, headers, encode_json(payload)), False
+    
+    # Повтор обычно приходит после фиксации первого запроса: такой
+    # ответ находится чтением, без очереди записи
+    with shard.pool.reader() as conn:
+        stored = idempotency_keys.lookup(conn, key)
+    if stored is not None:
+        return None, stored, True
+    
+    def keyed(conn):
+        # Одновременный запрос с тем же ключом мог быть зафиксирован раньше
+        stored = idempotency_keys.lookup(conn, key)
+        if stored is not None:
+            return False, None, stored
+        result = operation(conn)
+        status, payload, headers = respond(result)
+        body = encode_json(payload)
+        idempotency_keys.store(conn, key, fingerprint, status, headers, body)
+        return True, result, StoredResponse(fingerprint, status, headers, body)
+    
+    executed, result, stored = submit(keyed)
+    return result, stored, not executed
+
+def is_archived(conn, order_id):
+    """Перенесен ли заказ в архив.
+    
+    Архивные заказы только читаются: статус меняется и заказы удаляются
+    в рабочей таблице, где их учитывают триггеры статистики.
+    """
+    return archive.is_available(conn) and archive.find_order(conn, order_id=order_id) is not None
+
+def encode_json(payload):
+    """Тело JSON ответа; время учитывается как сериализация"""
+    with metrics.phase('serialize'):
+        return json.dumps(payload, default=json_serializer).encode()
+
+def json_serializer(obj):
+    """Сериализатор для JSON"""
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+    if isinstance(obj, sqlite3.Row):
+        return dict(obj)
+    raise TypeError(f"Type {type(obj)} not serializable")
+
+def init_database():
+    """Инициализация базы данных (всех шардов)"""
+    for shard in store.shards:
+        with shard.pool.writer() as conn:
+            # Создание и обновление схемы
+            for version, description in migrate(conn):
+                print(f"✓ Миграция {version}: {description}" + (f" ({shard.path})" if store.sharded else ""))
+            archive.ensure_schema(conn)
+    store.load()
+    
+    # Тестовые данные - только в пустую единую БД
+    if store.sharded:
+        print("✓ База данных инициализирована")
+        return
+    
+    with store.shards[0].pool.writer() as conn:
+        cursor = conn.cursor()
+        
+        # Добавление тестовых данных если таблица пуста
+        cursor.execute("SELECT COUNT(*) FROM orders")
+        count = cursor.fetchone()[0]
+        
+        if count == 0:
+            sample_orders = [
+                ('ORD-001', (datetime.datetime.now() - datetime.timedelta(days=2)).isoformat(), 
+                 'Иванов Иван Иванович', '+7 (999) 123-45-67', 'Готов к выдаче', 3450.50, 'Самовывоз', 'ПВЗ №001'),
+                ('ORD-002', (datetime.datetime.now() - datetime.timedelta(days=1)).isoformat(), 
+                 'Петрова Анна Сергеевна', '+7 (999) 765-43-21', 'Ожидает выдачи', 8900.00, 'Курьер', 'ПВЗ №001'),
+                ('ORD-003', datetime.datetime.now().isoformat(), 
+                 'Сидоров Алексей Петрович', '+7 (999) 555-66-77', 'Выдан', 2300.00, 'Самовывоз', 'ПВЗ №001'),
+                ('ORD-004', (datetime.datetime.now() - datetime.timedelta(days=3)).isoformat(), 
+                 'Козлова Елена Владимировна', '+7 (999) 111-22-33', 'Отменен', 5600.00, 'Самовывоз', 'ПВЗ №001'),
+                ('ORD-005', (datetime.datetime.now() - datetime.timedelta(days=1)).isoformat(), 
+                 'Николаев Дмитрий Сергеевич', '+7 (999) 444-55-66', 'Готов к выдаче', 12500.00, 'Курьер', 'ПВЗ №001'),
+                ('ORD-006', datetime.datetime.now().isoformat(), 
+                 'Соколова Мария Андреевна', '+7 (999) 777-88-99', 'Ожидает выдачи', 4300.50, 'Самовывоз', 'ПВЗ №001')
+            ]
+        
+            cursor.executemany('''
+                INSERT INTO orders (order_number, order_date, client_name, phone, status, amount, delivery_method, pickup_point)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', sample_orders)
+        
+    print("✓ База данных инициализирована")
+
+def explain_queries():
+    """Вывод планов выполнения запросов API (--explain)"""
+    today = datetime.date.today().isoformat()
+    week_ago = (datetime.date.today() - datetime.timedelta(days=7)).isoformat()
+    
+    queries = [
+        ('GET /api/orders', *build_orders_query()),
+        ('GET /api/orders?status', *build_orders_query(status='Готов к выдаче')),
+        ('GET /api/orders?date_from&date_to', *build_orders_query(date_from=week_ago, date_to=today)),
+        ('GET /api/orders?status&date_from', *build_orders_query(status='Выдан', date_from=week_ago)),
+        ('GET /api/orders?pickup_point&status',
+         *build_orders_query(status='Готов к выдаче', pickup_point='ПВЗ №001')),
+        ('GET /api/orders?search', *build_orders_query(search='ORD-001')),
+        ('GET /api/orders?search&limit (несколько шардов)',
+         *build_orders_query(search='ORD-001', limit=DEFAULT_PAGE_SIZE, ranked=False)),
+        ('GET /api/orders?limit&cursor',
+         *build_orders_query(after=(week_ago, 1000), limit=DEFAULT_PAGE_SIZE)),
+        ('GET /api/orders?status&limit&cursor',
+         *build_orders_query(status='Выдан', after=(week_ago, 1000), limit=DEFAULT_PAGE_SIZE)),
+        ('GET /api/orders?include_archived&limit&cursor',
+         *build_orders_query(include_archived=True, after=(week_ago, 1000), limit=DEFAULT_PAGE_SIZE)),
+        ('GET /api/orders/{id}', "SELECT * FROM orders WHERE id = ?", [1]),
+        ('GET /api/stats (статусы)', "SELECT status, orders, amount_cents FROM stats_by_status", []),
+        ('GET /api/stats (сегодня)', "SELECT orders FROM stats_by_day WHERE day = ?", [today]),
+        ('GET /api/stats/timeseries?granularity=day&group_by=status&pickup_point',
+         "SELECT bucket, status, SUM(orders), SUM(amount_cents) FROM rollup_day"
+         " WHERE bucket >= ? AND bucket < ? AND pickup_point = ? GROUP BY bucket, status",
+         [week_ago, today, 'ПВЗ №001']),
+    ]
+    
+    with store.shards[0].pool.reader() as conn:
+        for name, query, args in queries:
+            print(f"\n{name}")
+            print(f"  {query}")
+            for step in explain(conn, query, args):
+                print(f"  {step}")
+
+def check_stats(rebuild=False):
+    """Сверка агрегатов статистики (--verify-stats) и их пересчет (--rebuild-stats).
+    
+    Возвращает код выхода: 1, если найдены расхождения и пересчет не запрошен.
+    """
+    found = False
+    for shard in store.shards:
+        where = f" ({shard.path})" if store.sharded else ""
+        with shard.pool.writer() as conn:
+            drift = stats.verify(conn) + analytics.verify(conn)
+            for table, key, stored, actual in drift:
+                print(f"✗ {table}[{key!r}]{where}: хранится {stored}, по заказам {actual}")
+            if not drift:
+                print(f"✓ Агрегаты статистики совпадают с таблицей заказов{where}")
+            if rebuild:
+                stats.rebuild(conn)
+                analytics.rebuild(conn)
+                print(f"✓ Агрегаты статистики пересчитаны{where}")
+        found = found or bool(drift)
+    return 1 if found and not rebuild else 0
+
+class ThreadPoolHTTPServer(socketserver.TCPServer):
+    """TCP сервер с ограниченным пулом рабочих потоков.
+
+    Принятые соединения складываются в очередь ограниченной длины и
+    разбираются фиксированным числом потоков. Если очередь заполнена,
+    клиент сразу получает 503, а не ждет неограниченно долго.
+    """
+
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, workers=DEFAULT_WORKERS,
+                 queue_size=DEFAULT_QUEUE_SIZE, reuse_port=False, bind_and_activate=True):
+        self.workers = workers
+        self.reuse_port = reuse_port
+        # Очередь ядра на listen() под стать своей: по умолчанию в socketserver всего 5
+        self.request_queue_size = max(queue_size, socketserver.TCPServer.request_queue_size)
+        self._requests = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._detached = set()
+        self._detached_lock = threading.Lock()
+        super().__init__(server_address, handler_class, bind_and_activate)
+
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f'pvz-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def process_request(self, request, client_address):
+        """Передача соединения в очередь рабочих потоков"""
+        try:
+            self._requests.put_nowait((request, client_address))
+        except queue.Full:
+            self.reject_request(request)
+
+    def reject_request(self, request):
+        """Ответ 503 при переполненной очереди"""
+        body = json.dumps({'error': 'Server is busy'}).encode()
+        try:
+            request.sendall(
+                b'HTTP/1.0 503 Service Unavailable\r\n'
+                b'Content-Type: application/json\r\n'
+                b'Retry-After: 1\r\n'
+                b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body
+            )
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def detach_request(self, request, target, *args):
+        """Передача соединения отдельному потоку target(request, *args).
+
+        Для долгих ответов (поток событий): рабочий поток освобождается,
+        а сокет после выхода из обработчика не закрывается - за это
+        отвечает target.
+        """
+        with self._detached_lock:
+            self._detached.add(request)
+        threading.Thread(target=target, args=(request, *args), daemon=True).start()
+
+    def keep_alive_allowed(self):
+        """Постоянные соединения держатся, пока никто не ждет свободного потока"""
+        return self._requests.empty()
+
+    def shutdown_request(self, request):
+        with self._detached_lock:
+            if request in self._detached:
+                self._detached.discard(request)
+                return
+        super().shutdown_request(request)
+
+    def _worker(self):
+        while True:
+            item = self._requests.get()
+            try:
+                if item is None:
+                    return
+                request, client_address = item
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    self.shutdown_request(request)
+            finally:
+                self._requests.task_done()
+
+    def drain(self, timeout=DRAIN_TIMEOUT):
+        """Дожидается обработки уже принятых запросов и останавливает потоки.
+
+        Вызывается после shutdown(), когда новые соединения больше не
+        принимаются. Возвращает True, если все потоки успели завершиться.
+        """
+        deadline = time.monotonic() + timeout
+        for _ in self._threads:
+            try:
+                self._requests.put(None, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self._threads)
+
+
+def create_server(mode, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, reuse_port=False,
+                  sockets_to_try=None, max_connections=DEFAULT_MAX_CONNECTIONS):
+    """Создание сервера на первом свободном адресе.
+
+    Возвращает (server, host, port) или (None, None, None), если все адреса заняты.
+    """
+    # Пытаемся использовать разные адреса если порт занят
+    if sockets_to_try is None:
+        sockets_to_try = [
+            (HOST, PORT),
+            (HOST, PORT + 1),
+            (HOST, PORT + 2),
+            ('127.0.0.1', PORT),
+            ('0.0.0.0', PORT)
+        ]
+
+    for host, port in sockets_to_try:
+        try:
+            if mode == 'single':
+                server = socketserver.TCPServer((host, port), PVZHandler)
+            elif mode == 'asyncio':
+                server = AsyncHTTPServer((host, port), AsyncPVZHandler, workers=workers,
+                                         max_connections=max_connections, queue_size=queue_size)
+            else:
+                server = ThreadPoolHTTPServer((host, port), PVZHandler, workers=workers,
+                                              queue_size=queue_size, reuse_port=reuse_port)
+            return server, host, port
+        except OSError:
+            continue
+
+    return None, None, None
+
+
+def serve_until_stopped(server, drain_timeout=DRAIN_TIMEOUT):
+    """Обслуживание запросов до SIGINT/SIGTERM с корректным завершением"""
+    def request_shutdown(signum, frame):
+        # shutdown() блокируется до выхода из serve_forever, поэтому из отдельного потока
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGINT, request_shutdown)
+    signal.signal(signal.SIGTERM, request_shutdown)
+
+    for shard in store.shards:
+        shard.events.start()
+        shard.archiver.start()
+    try:
+        server.serve_forever()
+    finally:
+        for shard in store.shards:
+            shard.archiver.stop()
+            shard.events.stop()
+        if isinstance(server, (ThreadPoolHTTPServer, AsyncHTTPServer)) and not server.drain(drain_timeout):
+            print(f"✗ Не все запросы завершились за {drain_timeout} с")
+        server.server_close()
+        for shard in store.shards:
+            shard.writes.close()
+        writes = store.write_stats()
+        if writes['batches']:
+            print(f"✓ Запись: {writes['operations']} операций в {writes['batches']} транзакциях "
+                  f"(в среднем {writes['average_batch']:.1f}, максимум {writes['largest_batch']})")
+        cache = order_cache.stats()
+        if cache['hits'] or cache['misses']:
+            print(f"✓ Кэш заказов: {cache['hits']} попаданий, {cache['misses']} промахов, "
+                  f"{cache['evictions']} вытеснений")
+        store.close()
+
+
+def run_worker_processes(address, processes, workers, queue_size, drain_timeout):
+    """Pre-fork режим: несколько процессов слушают один порт через SO_REUSEPORT.
+
+    Родительский процесс только следит за дочерними: перезапускает упавшие
+    и при остановке рассылает им SIGTERM.
+    """
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                server, _, _ = create_server('processes', workers, queue_size, reuse_port=True,
+                                             sockets_to_try=[address])
+                if not server:
+                    code = 1
+                else:
+                    serve_until_stopped(server, drain_timeout)
+            except Exception as e:
+                print(f"✗ Ошибка в процессе {os.getpid()}: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    # Соединения нельзя наследовать через fork: каждый процесс откроет свои
+    store.close()
+    for index in range(processes):
+        spawn(index)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            print(f"✗ Процесс {pid} завершился (код {os.waitstatus_to_exitcode(status)}), перезапуск")
+            time.sleep(1)
+            spawn(index)
+
+
+def run_server(mode=DEFAULT_SERVE_MODE, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+               processes=DEFAULT_PROCESSES, drain_timeout=DRAIN_TIMEOUT,
+               write_window=DEFAULT_WINDOW, write_max_batch=DEFAULT_MAX_BATCH,
+               order_cache_bytes=DEFAULT_ORDER_CACHE_BYTES, idempotency_ttl=DEFAULT_IDEMPOTENCY_TTL,
+               idempotency_max_keys=DEFAULT_IDEMPOTENCY_KEYS, archive_after_days=DEFAULT_ARCHIVE_AFTER_DAYS,
+               max_connections=DEFAULT_MAX_CONNECTIONS, read_concurrency=None, write_concurrency=None,
+               priority_concurrency=None, rate_limit=DEFAULT_RATE_LIMIT, rate_burst=DEFAULT_RATE_BURST,
+               slow_threshold=DEFAULT_SLOW_THRESHOLD, slow_log=None, profile_dir=DEFAULT_PROFILE_DIR):
+    """Запуск сервера.
+
+    Бюджеты *_concurrency по умолчанию (None) выводятся из числа потоков workers.
+    """
+    server = None
+    limits = dict(zip(BUDGETS, default_limits(workers)))
+    for name, limit in zip(BUDGETS, (read_concurrency, write_concurrency, priority_concurrency)):
+        if limit is not None:
+            limits[name] = limit
+    admission_control.configure(limits, rate_limit, rate_burst)
+    slow_requests.threshold = slow_threshold
+    slow_requests.path = slow_log
+    profiler.directory = profile_dir
+    for shard in store.shards:
+        shard.writes.window = write_window
+        shard.writes.max_batch = write_max_batch
+        shard.archiver.after_days = archive_after_days
+        if mode == 'asyncio':
+            shard.events.max_subscribers = MAX_ASYNC_SUBSCRIBERS
+    order_cache.max_bytes = order_cache_bytes
+    idempotency_keys.ttl = idempotency_ttl
+    idempotency_keys.max_keys = idempotency_max_keys
+    try:
+        if mode == 'processes' and not (hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT')):
+            print("✗ Режим processes недоступен на этой платформе, используется threads")
+            mode = 'threads'
+
+        # Инициализация БД
+        init_database()
+
+        if mode == 'processes':
+            # Занимаем адрес в родителе, чтобы все процессы слушали один и тот же порт
+            server, host, port = create_server(mode, workers=0, queue_size=1, reuse_port=True)
+        else:
+            server, host, port = create_server(mode, workers, queue_size, max_connections=max_connections)
+
+        if not server:
+            print("✗ Не удалось запустить сервер. Все порты заняты.")
+            return
+
+        if mode == 'processes':
+            # Родитель не принимает соединения: закрываем его сокет,
+            # дочерние процессы привяжутся к тому же адресу
+            server.server_close()
+            server = None
+
+        print("\n" + "="*50)
+        print(f"✓ Сервер ПВЗ запущен!")
+        print(f"✓ Адрес: http://{host}:{port}")
+        if mode == 'single':
+            print(f"✓ Режим: single (один запрос за раз)")
+        elif mode == 'threads':
+            print(f"✓ Режим: threads ({workers} потоков, очередь {queue_size})")
+        elif mode == 'asyncio':
+            print(f"✓ Режим: asyncio (до {max_connections} соединений, {workers} потоков для обработчиков, "
+                  f"очередь {queue_size})")
+        else:
+            print(f"✓ Режим: processes ({processes} процессов × {workers} потоков, очередь {queue_size})")
+        print(f"✓ Групповая запись: окно {write_window * 1000:g} мс, до {write_max_batch} операций")
+        budgets = ', '.join(f"{name} {limit or 'без ограничения'}" for name, limit in limits.items())
+        rate = f"{rate_limit:g} запр./с на клиента, запас {rate_burst}" if rate_limit else "без ограничения"
+        print(f"✓ Допуск: одновременных запросов {budgets}; темп: {rate}")
+        if slow_threshold:
+            print(f"✓ Журнал медленных запросов: от {slow_threshold * 1000:g} мс"
+                  + (f", файл {slow_log}" if slow_log else ""))
+        if archive_after_days:
+            print(f"✓ Архив: выданные и отмененные заказы старше {archive_after_days:g} дн.")
+        print(f"✓ API endpoints:")
+        for route in router.routes():
+            if route.summary:
+                print(f"  - {route.method:<6} {route.template} - {route.summary}")
+        if store.catalog:
+            print(f"✓ База данных: {os.path.dirname(store.shards[0].path) or '.'} "
+                  f"(шардов по пунктам выдачи: {len(store.shards)}, WAL)")
+        else:
+            print(f"✓ База данных: {DB_PATH} (WAL)")
+        print("="*50)
+        print("Нажмите Ctrl+C для остановки сервера\n")
+
+        if mode == 'processes':
+            run_worker_processes((host, port), processes, workers, queue_size, drain_timeout)
+        else:
+            serve_until_stopped(server, drain_timeout)
+
+        print("\n\n⏹ Сервер остановлен")
+
+    except KeyboardInterrupt:
+        print("\n\n⏹ Сервер остановлен")
+        if server:
+            server.server_close()
+    except Exception as e:
+        print(f"✗ Ошибка: {e}")
+
+
+def parse_args(argv=None):
+    """Разбор параметров командной строки"""
+    parser = argparse.ArgumentParser(description='Сервер API пункта выдачи заказов')
+    parser.add_argument('--mode', choices=SERVE_MODES, default=DEFAULT_SERVE_MODE,
+                        help='режим обслуживания запросов')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='число рабочих потоков в процессе')
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help='глубина очереди принятых соединений (asyncio - запросов, ждущих потока)')
+    parser.add_argument('--processes', type=int, default=DEFAULT_PROCESSES,
+                        help='число процессов в режиме processes')
+    parser.add_argument('--max-connections', type=int, default=DEFAULT_MAX_CONNECTIONS,
+                        help='наибольшее число открытых соединений в режиме asyncio')
+    parser.add_argument('--read-concurrency', type=int,
+                        help='одновременных тяжелых чтений: списки, выгрузка, изменения, графики '
+                             '(по умолчанию половина --workers, 0 - без ограничения)')
+    parser.add_argument('--write-concurrency', type=int,
+                        help='одновременных записей (по умолчанию четверть --workers, 0 - без ограничения)')
+    parser.add_argument('--priority-concurrency', type=int,
+                        help='одновременных выдач и отмен заказов (по умолчанию --workers, 0 - без ограничения)')
+    parser.add_argument('--rate-limit', type=float, default=DEFAULT_RATE_LIMIT,
+                        help='запросов в секунду с одного адреса клиента (по умолчанию 0 - без ограничения)')
+    parser.add_argument('--rate-burst', type=int, default=DEFAULT_RATE_BURST,
+                        help='запросов подряд сверх темпа с одного адреса клиента')
+    parser.add_argument('--slow-threshold-ms', type=float, default=DEFAULT_SLOW_THRESHOLD * 1000,
+                        help='записывать в журнал запросы дольше, мс (0 - журнал выключен; '
+                             'меняется через PUT /api/admin/slow-requests)')
+    parser.add_argument('--slow-log',
+                        help='файл журнала медленных запросов (JSON Lines); без него - только в памяти')
+    parser.add_argument('--profile-dir', default=DEFAULT_PROFILE_DIR,
+                        help='каталог файлов .pstats профилирования (POST /api/admin/profile)')
+    parser.add_argument('--drain-timeout', type=float, default=DRAIN_TIMEOUT,
+                        help='время на завершение запросов при остановке, с')
+    parser.add_argument('--write-window-ms', type=float, default=DEFAULT_WINDOW * 1000,
+                        help='сколько ждать другие записи для общей транзакции, мс')
+    parser.add_argument('--write-batch', type=int, default=DEFAULT_MAX_BATCH,
+                        help='наибольшее число записей в одной транзакции')
+    parser.add_argument('--order-cache-mb', type=float, default=DEFAULT_ORDER_CACHE_BYTES / 2**20,
+                        help='память под кэш заказов в процессе, МБ (0 - без кэша)')
+    parser.add_argument('--idempotency-ttl-hours', type=float, default=DEFAULT_IDEMPOTENCY_TTL / 3600,
+                        help='сколько хранить ответы по Idempotency-Key, ч')
+    parser.add_argument('--idempotency-max-keys', type=int, default=DEFAULT_IDEMPOTENCY_KEYS,
+                        help='наибольшее число хранимых ключей Idempotency-Key')
+    parser.add_argument('--archive-after-days', type=float, default=DEFAULT_ARCHIVE_AFTER_DAYS,
+                        help='через сколько дней переносить закрытые заказы в архив (0 - не переносить)')
+    parser.add_argument('--shards-dir',
+                        help='каталог шардов по пунктам выдачи (см. split_shards.py) вместо единой БД')
+    parser.add_argument('--archive-now', action='store_true',
+                        help='перенести подходящие заказы в архив и выйти')
+    parser.add_argument('--explain', action='store_true',
+                        help='вывести планы выполнения запросов API и выйти')
+    parser.add_argument('--verify-stats', action='store_true',
+                        help='сверить агрегаты статистики с таблицей заказов и выйти')
+    parser.add_argument('--rebuild-stats', action='store_true',
+                        help='пересчитать агрегаты статистики с нуля и выйти')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    args = parse_args()
+    try:
+        store = open_store(args.shards_dir)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"✗ Ошибка: {e}")
+        sys.exit(1)
+    if args.explain:
+        init_database()
+        explain_queries()
+        sys.exit(0)
+    if args.archive_now:
+        init_database()
+        moved = 0
+        for shard in store.shards:
+            shard.archiver.after_days = args.archive_after_days
+            moved += shard.archiver.run_once()
+        print(f"✓ В архив перенесено заказов: {moved}")
+        sys.exit(0)
+    if args.verify_stats or args.rebuild_stats:
+        init_database()
+        sys.exit(check_stats(rebuild=args.rebuild_stats))
+    run_server(mode=args.mode, workers=args.workers, queue_size=args.queue_size,
+               processes=args.processes, drain_timeout=args.drain_timeout,
+               write_window=args.write_window_ms / 1000, write_max_batch=args.write_batch,
+               order_cache_bytes=int(args.order_cache_mb * 2**20),
+               idempotency_ttl=args.idempotency_ttl_hours * 3600,
+               idempotency_max_keys=args.idempotency_max_keys,
+               archive_after_days=args.archive_after_days, max_connections=args.max_connections,
+               read_concurrency=args.read_concurrency, write_concurrency=args.write_concurrency,
+               priority_concurrency=args.priority_concurrency, rate_limit=args.rate_limit,
+               rate_burst=args.rate_burst, slow_threshold=args.slow_threshold_ms / 1000,
+               slow_log=args.slow_log, profile_dir=args.profile_dir)
\ No newline at end of file
@@ -0,0 +1,395 @@
+import concurrent.futures
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+
+import archive
+import metrics
+from archive import Archiver
+from db_pool import ConnectionPool
+from events import EventHub
+from group_commit import GroupCommitWriter
+from idempotency import IDEMPOTENCY_CLAIMS_SCHEMA
+
+# Хранилище заказов из нескольких БД-шардов.
+# Все заказы одного пункта выдачи живут в одном шарде - отдельном файле
+# SQLite со своей схемой, агрегатами статистики, журналом версий и
+# архивом. Каталог (CATALOG_FILE в каталоге шардов) сопоставляет пункты
+# выдачи шардам; новый пункт попадает в шард с наименьшим числом заказов.
+# Запросы в рамках пункта выдачи идут в один шард, а у каждого шарда свой
+# писатель и своя очередь групповой записи, поэтому записи разных шардов
+# не ждут друг друга. Общие списки и статистика собираются со всех шардов
+# параллельно (scatter) и сливаются.
+#
+# id заказа уникален во всех шардах: шард k из N выдает id с остатком k от
+# деления на N (orders.NEXT_ID_SQL), поэтому шард заказа находится по id
+# без каталога. Заказы единой БД сохраняют при разделении свои id (не
+# больше legacy_max_id), и их шард записан в каталоге (legacy_orders).
+#
+# Номер заказа уникален во всех шардах: перед созданием заказа номер
+# закрепляется в каталоге за шардом (order_numbers), и номер, закрепленный
+# за другим шардом, считается дубликатом. По каталогу же заказ по номеру
+# ищется в одном шарде.
+#
+# Единая БД - частный случай: один шард без каталога.
+CATALOG_FILE = 'catalog.db'
+SHARD_FILE = 'orders-{index}.db'
+SCATTER_THREADS = 16         # потоков для параллельных запросов к шардам
+
+CATALOG_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS shards (
+        shard INTEGER PRIMARY KEY,
+        path TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS pickup_points (
+        pickup_point TEXT PRIMARY KEY,
+        shard INTEGER NOT NULL REFERENCES shards (shard)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS legacy_orders (
+        id INTEGER PRIMARY KEY,
+        shard INTEGER NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS order_numbers (
+        order_number TEXT PRIMARY KEY,
+        shard INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+] + IDEMPOTENCY_CLAIMS_SCHEMA
+
+
+def order_position(row):
+    """Ключ сортировки списков заказов: ORDER BY order_date DESC, id DESC"""
+    return row['order_date'], row['id']
+
+
+def merge_pages(pages, limit=None):
+    """Слияние упорядоченных страниц шардов в одну (первые limit строк)"""
+    if len(pages) == 1:
+        return pages[0]
+    merged = heapq.merge(*pages, key=order_position, reverse=True)
+    return list(itertools.islice(merged, limit))
+
+
+class MergedCursor:
+    """Курсоры шардов, упорядоченные по дате и id, как один курсор (fetchmany)"""
+
+    def __init__(self, cursors, batch_size):
+        def rows(cursor):
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    return
+                yield from batch
+
+        self._rows = heapq.merge(*(rows(cursor) for cursor in cursors), key=order_position, reverse=True)
+
+    def fetchmany(self, size):
+        return list(itertools.islice(self._rows, size))
+
+
+def merge_cursors(cursors, batch_size):
+    """Один курсор для потоковой выдачи из курсоров шардов"""
+    if len(cursors) == 1:
+        return cursors[0]
+    return MergedCursor(cursors, batch_size)
+
+
+def create_catalog(path, shard_paths, points, legacy_orders=(), order_numbers=()):
+    """Каталог шардов: файлы шардов, распределение пунктов выдачи {пункт: шард},
+    шарды заказов единой БД [(id, шард)] и номеров заказов [(номер, шард)]"""
+    pool = ConnectionPool(path)
+    try:
+        with pool.writer() as conn:
+            for step in CATALOG_SCHEMA:
+                conn.execute(step)
+            conn.executemany("INSERT INTO shards (shard, path) VALUES (?, ?)",
+                             [(index, os.path.basename(shard_path)) for index, shard_path in enumerate(shard_paths)])
+            conn.executemany("INSERT INTO pickup_points (pickup_point, shard) VALUES (?, ?)", points.items())
+            conn.executemany("INSERT INTO legacy_orders (id, shard) VALUES (?, ?)", legacy_orders)
+            # Повторы номеров единой БД (если они есть) остаются за первым шардом
+            conn.executemany("INSERT OR IGNORE INTO order_numbers (order_number, shard) VALUES (?, ?)",
+                             order_numbers)
+    finally:
+        pool.close_all()
+
+
+class Shard:
+    """БД одного шарда со своими соединениями, записью, событиями и архивом"""
+
+    def __init__(self, index, path):
+        self.index = index
+        self.path = path
+        # К каждому соединению присоединен архив закрытых заказов шарда
+        self.pool = ConnectionPool(path, attach=archive.attachments(path))
+        # Одиночные записи из обработчиков фиксируются пакетами
+        self.writes = GroupCommitWriter(self.pool)
+        # Рассылка изменений шарда подписчикам /api/events
+        self.events = EventHub(self.pool, shard=index)
+        # Фоновый перенос старых выданных и отмененных заказов в архив
+        self.archiver = Archiver(self.pool)
+
+    def transaction(self, operation):
+        """operation(conn) в отдельной транзакции записи, минуя очередь writes"""
+        with self.pool.writer() as conn:
+            return operation(conn)
+
+
+class OrderStore:
+    """Шарды заказов и выбор шарда по пункту выдачи или id заказа"""
+
+    def __init__(self, paths, catalog=None):
+        self.shards = [Shard(index, path) for index, path in enumerate(paths)]
+        self.catalog = catalog
+        self.legacy_max_id = 0
+        self._points = {}
+        self._lock = threading.Lock()
+        self._executor_lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    @classmethod
+    def open(cls, db_path, shards_dir=None):
+        """Единая БД db_path или шарды из каталога shards_dir"""
+        if not shards_dir:
+            return cls([db_path])
+        path = os.path.join(shards_dir, CATALOG_FILE)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'Shard catalog not found: {path}')
+        catalog = ConnectionPool(path)
+        with catalog.reader() as conn:
+            paths = [os.path.join(shards_dir, row[0]) for row in conn.execute("SELECT path FROM shards ORDER BY shard")]
+        if not paths:
+            raise ValueError(f'No shards in {path}')
+        return cls(paths, catalog)
+
+    @property
+    def sharded(self):
+        return len(self.shards) > 1
+
+    def load(self):
+        """Проверка номеров шардов и чтение каталога (после миграций шардов)"""
+        for shard in self.shards:
+            with shard.pool.reader() as conn:
+                index, count, legacy_max_id = conn.execute(
+                    "SELECT shard, shard_count, legacy_max_id FROM shard_info WHERE id = 1").fetchone()
+            if (index, count) != (shard.index, len(self.shards)):
+                raise ValueError(f'{shard.path} is shard {index} of {count}, '
+                                 f'expected {shard.index} of {len(self.shards)}')
+            self.legacy_max_id = legacy_max_id
+        if self.catalog:
+            # Таблицы, добавленные в каталог после разделения на шарды
+            with self.catalog.writer() as conn:
+                for step in CATALOG_SCHEMA:
+                    conn.execute(step)
+                points = dict(conn.execute("SELECT pickup_point, shard FROM pickup_points"))
+                numbered = conn.execute("SELECT 1 FROM order_numbers LIMIT 1").fetchone() is not None
+            with self._lock:
+                self._points = points
+            if not numbered:
+                self._fill_numbers()
+
+    def shards_for_point(self, pickup_point=None):
+        """Шарды, в которых могут быть заказы пункта выдачи (все - без пункта)"""
+        if pickup_point is None or not self.catalog:
+            return self.shards
+        index = self._lookup(pickup_point)
+        # В неизвестном пункте заказов нет: достаточно пустой выборки из одного шарда
+        return [self.shards[index or 0]]
+
+    def shard_for_point(self, pickup_point):
+        """Шард для нового заказа пункта выдачи; новый пункт получает шард"""
+        if not self.catalog:
+            return self.shards[0]
+        index = self._lookup(pickup_point)
+        if index is None:
+            index = self._assign(pickup_point)
+        return self.shards[index]
+
+    def shard_for_id(self, order_id):
+        """Шард заказа с id больше legacy_max_id или None для id единой БД"""
+        if len(self.shards) == 1:
+            return self.shards[0]
+        if order_id > self.legacy_max_id:
+            return self.shards[order_id % len(self.shards)]
+        return None
+
+    def shard_of_order(self, order_id):
+        """Шард, где хранится заказ (для несуществующего - любой подходящий)"""
+        try:
+            order_id = int(order_id)
+        except (TypeError, ValueError):
+            return self.shards[0]
+        shard = self.shard_for_id(order_id)
+        if shard:
+            return shard
+
+        with self.catalog.reader() as conn:
+            row = conn.execute("SELECT shard FROM legacy_orders WHERE id = ?", (order_id,)).fetchone()
+        return self.shards[row[0]] if row else self.shards[0]
+
+    def shards_of_number(self, order_number):
+        """Шарды, в которых может быть заказ с номером (без записи в каталоге - все)"""
+        if not self.catalog:
+            return self.shards
+        with self.catalog.reader() as conn:
+            row = conn.execute("SELECT shard FROM order_numbers WHERE order_number = ?", (order_number,)).fetchone()
+        return [self.shards[row[0]]] if row else self.shards
+
+    def claim_numbers(self, numbers, shard):
+        """Закрепление номеров новых заказов за шардом. Возвращает номера, занятые другими шардами.
+
+        Номер остается за шардом и после неудачной записи заказа: в том же
+        шарде его проверит UNIQUE, а в другом он будет дубликатом.
+        """
+        numbers = list(numbers)
+        if not self.catalog or not numbers:
+            return set()
+        with self.catalog.writer() as conn:
+            conn.executemany("INSERT OR IGNORE INTO order_numbers (order_number, shard) VALUES (?, ?)",
+                             [(number, shard.index) for number in numbers])
+            return {row[0] for row in conn.execute(
+                "SELECT order_number FROM order_numbers WHERE order_number IN (SELECT value FROM json_each(?))"
+                " AND shard != ?", (json.dumps(numbers), shard.index))}
+
+    def release_number(self, order_number, shard):
+        """Освобождение номера удаленного заказа шарда"""
+        if not self.catalog:
+            return
+        with self.catalog.writer() as conn:
+            conn.execute("DELETE FROM order_numbers WHERE order_number = ? AND shard = ?", (order_number, shard.index))
+
+    def shards_of_orders(self, order_ids):
+        """Шард для каждого из order_ids (как shard_of_order, одним запросом к каталогу)"""
+        result = []
+        unknown = []
+        for order_id in order_ids:
+            shard = None
+            if isinstance(order_id, int) and not isinstance(order_id, bool):
+                shard = self.shard_for_id(order_id)
+                if shard is None:
+                    unknown.append(order_id)
+            result.append(shard)
+
+        found = {}
+        if unknown:
+            with self.catalog.reader() as conn:
+                found = {order_id: self.shards[index] for order_id, index in conn.execute(
+                    "SELECT id, shard FROM legacy_orders WHERE id IN (SELECT value FROM json_each(?))",
+                    (json.dumps(unknown),))}
+        return [shard or found.get(order_id, self.shards[0]) for shard, order_id in zip(result, order_ids)]
+
+    def group(self, shards):
+        """Номера элементов по шардам: [(shard, [index, ...])] в порядке шардов"""
+        groups = {}
+        for index, shard in enumerate(shards):
+            groups.setdefault(shard.index, []).append(index)
+        return [(self.shards[shard], indexes) for shard, indexes in sorted(groups.items())]
+
+    def scatter(self, function, items=None):
+        """function(item) для каждого из items (по умолчанию - шардов) параллельно.
+
+        Результаты возвращаются в порядке items; первое исключение
+        выбрасывается после завершения остальных вызовов. Ожидание
+        относится к фазе SQL запроса.
+        """
+        items = self.shards if items is None else list(items)
+        if len(items) == 1:
+            return [function(items[0])]
+        started = time.perf_counter()
+        # SQL запросы других потоков попадают в журнал медленных запросов
+        function = metrics.propagate(function)
+        futures = [self._pool().submit(function, item) for item in items]
+        concurrent.futures.wait(futures)
+        metrics.add('sql', time.perf_counter() - started)
+        return [future.result() for future in futures]
+
+    def first(self, function, items=None):
+        """Первый не None результат scatter(function, items) или None"""
+        return next((result for result in self.scatter(function, items) if result is not None), None)
+
+    def write_stats(self):
+        """Счетчики групповой записи всех шардов"""
+        total = None
+        for shard in self.shards:
+            writes = shard.writes.stats()
+            if total is None:
+                total = writes
+                continue
+            for name in ('batches', 'operations', 'failed', 'commit_seconds'):
+                total[name] += writes[name]
+            total['largest_batch'] = max(total['largest_batch'], writes['largest_batch'])
+            total['batch_size_buckets'] = [
+                (bound, count + other)
+                for (bound, count), (_, other) in zip(total['batch_size_buckets'], writes['batch_size_buckets'])]
+        total['average_batch'] = total['operations'] / total['batches'] if total['batches'] else 0
+        return total
+
+    def close(self):
+        """Закрытие соединений всех шардов (после остановки записи)"""
+        for shard in self.shards:
+            shard.pool.close_all()
+        if self.catalog:
+            self.catalog.close_all()
+        with self._executor_lock:
+            executor = self._executor if self._pid == os.getpid() else None
+            self._executor = None
+        if executor:
+            executor.shutdown(wait=False)
+
+    def _pool(self):
+        with self._executor_lock:
+            # После fork() потоки родителя в дочернем процессе не существуют
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    SCATTER_THREADS, thread_name_prefix='pvz-scatter')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _fill_numbers(self):
+        # Каталог, созданный до order_numbers: номера собираются из шардов
+        def numbers(shard):
+            with shard.pool.reader() as conn:
+                return [(row[0], shard.index) for row in conn.execute(
+                    f"SELECT order_number FROM {archive.orders_source(conn)}")]
+
+        with self.catalog.writer() as conn:
+            for rows in self.scatter(numbers):
+                conn.executemany("INSERT OR IGNORE INTO order_numbers (order_number, shard) VALUES (?, ?)", rows)
+
+    def _lookup(self, pickup_point):
+        index = self._points.get(pickup_point)
+        if index is None:
+            # Пункт мог появиться в другом процессе
+            with self.catalog.reader() as conn:
+                row = conn.execute("SELECT shard FROM pickup_points WHERE pickup_point = ?",
+                                   (pickup_point,)).fetchone()
+            if row:
+                index = self._points[pickup_point] = row[0]
+        return index
+
+    def _assign(self, pickup_point):
+        def total_orders(shard):
+            with shard.pool.reader() as conn:
+                return conn.execute("SELECT ifnull(sum(orders), 0) FROM stats_by_status").fetchone()[0]
+
+        with self._lock:
+            totals = self.scatter(total_orders)
+            lightest = min(range(len(totals)), key=totals.__getitem__)
+            # Одновременно тот же пункт мог получить шард другой процесс
+            with self.catalog.writer() as conn:
+                conn.execute("INSERT OR IGNORE INTO pickup_points (pickup_point, shard) VALUES (?, ?)",
+                             (pickup_point, lightest))
+                index = conn.execute("SELECT shard FROM pickup_points WHERE pickup_point = ?",
+                                     (pickup_point,)).fetchone()[0]
+            self._points[pickup_point] = index
+        return index
\ No newline at end of file
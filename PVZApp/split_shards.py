@@ -0,0 +1,159 @@
+import argparse
+import heapq
+import json
+import os
+import sys
+import time
+
+from db_pool import ConnectionPool
+from migrations import migrate
+from import_orders import defer_schema, restore_schema
+import archive
+import shards
+
+# Разделение единой БД заказов на шарды по пунктам выдачи (см. shards.py).
+#
+# Пункты выдачи распределяются жадно: от самого крупного по числу заказов
+# (вместе с архивными) к самому мелкому, каждый - в шард, где заказов
+# пока меньше всего. Заказы и архив копируются с прежними id, а каждый
+# шард запоминает наибольший id единой БД (legacy_max_id): новые id он
+# выдает больше него и со своим остатком от деления на число шардов, а
+# шарды прежних id и всех номеров заказов записываются в каталог. Как
+# и при загрузке файлов, индексы и триггеры создаются после копирования,
+# а поиск и агрегаты статистики пересчитываются в каждом шарде.
+#
+# Заказы сохраняют версии, но журнал удалений и ключи идемпотентности не
+# переносятся, а версия данных становится составной (по шарду), поэтому
+# клиентам синхронизации после переключения нужна полная загрузка (since=0). Исходная БД
+# не меняется (кроме миграций схемы) и может остаться резервной копией.
+DB_PATH = 'pvz_database.db'
+DEFAULT_SHARDS = 4
+
+_COLUMNS = ', '.join(archive.ARCHIVE_COLUMNS)
+
+
+def assign_points(points, count):
+    """Распределение пунктов выдачи {пункт: число заказов} по count шардам"""
+    loads = [(0, index) for index in range(count)]
+    assignment = {}
+    for point, orders in sorted(points.items(), key=lambda item: (-item[1], item[0])):
+        load, index = heapq.heappop(loads)
+        assignment[point] = index
+        heapq.heappush(loads, (load + orders, index))
+    return assignment
+
+
+def copy_shard(source, path, index, count, legacy_max_id, points):
+    """Создание шарда index из заказов пунктов выдачи points. Возвращает их [(id, номер)]"""
+    pool = ConnectionPool(path, attach=archive.attachments(path))
+    # ATTACH невозможен внутри транзакции, поэтому соединение без pool.writer()
+    conn = pool.connect()
+    try:
+        conn.execute("ATTACH DATABASE ? AS source", (source,))
+        conn.execute("ATTACH DATABASE ? AS source_archive", (archive.archive_path(source),))
+        conn.execute("BEGIN IMMEDIATE")
+        migrate(conn)
+        archive.ensure_schema(conn)
+        conn.execute("UPDATE shard_info SET shard = ?, shard_count = ?, legacy_max_id = ? WHERE id = 1",
+                     (index, count, legacy_max_id))
+
+        deferred = defer_schema(conn)
+        selected = json.dumps(points)
+        conn.execute(f'''
+            INSERT INTO orders ({_COLUMNS})
+            SELECT {_COLUMNS} FROM source.orders WHERE pickup_point IN (SELECT value FROM json_each(?))
+        ''', (selected,))
+        conn.execute(f'''
+            INSERT INTO archive.orders ({_COLUMNS}, archived_at)
+            SELECT {_COLUMNS}, archived_at FROM source_archive.orders
+            WHERE pickup_point IN (SELECT value FROM json_each(?))
+        ''', (selected,))
+        copied = conn.execute("SELECT id, order_number FROM orders UNION ALL "
+                              "SELECT id, order_number FROM archive.orders").fetchall()
+        # Заказы сохраняют свои версии, а счетчик шарда продолжает счетчик
+        # единой БД: выдача изменений страницами работает с первой версии
+        conn.execute("UPDATE sync_state SET version = (SELECT version FROM source.sync_state WHERE id = 1)")
+        restore_schema(conn, deferred, legacy_max_id)
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return copied
+
+
+def split_database(source, shards_dir, count):
+    """Разделение единой БД source на count шардов в каталоге shards_dir. Возвращает код выхода"""
+    paths = [os.path.join(shards_dir, shards.SHARD_FILE.format(index=index)) for index in range(count)]
+    catalog = os.path.join(shards_dir, shards.CATALOG_FILE)
+    existing = [path for path in [catalog] + paths if os.path.exists(path)]
+    if existing:
+        print(f"✗ Файлы шардов уже существуют: {', '.join(existing)}")
+        return 1
+
+    started = time.monotonic()
+    pool = ConnectionPool(source, attach=archive.attachments(source))
+    try:
+        with pool.writer() as conn:
+            for version, description in migrate(conn):
+                print(f"✓ Миграция {version}: {description}")
+            archive.ensure_schema(conn)
+            if conn.execute("SELECT shard_count FROM shard_info WHERE id = 1").fetchone()[0] > 1:
+                print(f"✗ {source} уже является шардом")
+                return 1
+            points = dict(conn.execute(
+                f"SELECT pickup_point, count(*) FROM {archive.orders_source(conn)} GROUP BY pickup_point"))
+            legacy_max_id = conn.execute(
+                "SELECT ifnull(max(seq), 0) FROM sqlite_sequence WHERE name = 'orders'").fetchone()[0]
+    finally:
+        pool.close_all()
+
+    assignment = assign_points(points, count)
+    os.makedirs(shards_dir, exist_ok=True)
+    legacy_orders = []
+    order_numbers = []
+    for index, path in enumerate(paths):
+        shard_points = sorted(point for point, shard in assignment.items() if shard == index)
+        copied = copy_shard(source, path, index, count, legacy_max_id, shard_points)
+        legacy_orders.extend((order_id, index) for order_id, _ in copied)
+        order_numbers.extend((order_number, index) for _, order_number in copied)
+        print(f"✓ Шард {index}: {path}, пунктов выдачи {len(shard_points)}, заказов {len(copied)}")
+
+    total = len(legacy_orders)
+    expected = sum(points.values())
+    if total != expected:
+        print(f"✗ Скопировано заказов {total} из {expected}, каталог не создан")
+        return 1
+
+    # Каталог создается последним: без него шарды не используются
+    shards.create_catalog(catalog, paths, assignment, legacy_orders, order_numbers)
+    print(f"✓ Заказов: {total}, наибольший id единой БД: {legacy_max_id}, "
+          f"за {time.monotonic() - started:.1f} с")
+    print(f"✓ Запуск сервера на шардах: python server.py --shards-dir {shards_dir}")
+    return 0
+
+
+def parse_args(argv=None):
+    """Разбор параметров командной строки"""
+    parser = argparse.ArgumentParser(description='Разделение БД заказов на шарды по пунктам выдачи')
+    parser.add_argument('shards_dir', help='каталог для файлов шардов и каталога пунктов выдачи')
+    parser.add_argument('--db', default=DB_PATH, help='файл единой базы данных')
+    parser.add_argument('--shards', type=int, default=DEFAULT_SHARDS, help='число шардов')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.shards < 1:
+        print("✗ Число шардов должно быть положительным")
+        sys.exit(2)
+    if not os.path.exists(args.db):
+        print(f"✗ Файл {args.db} не найден")
+        sys.exit(2)
+    try:
+        sys.exit(split_database(args.db, args.shards_dir, args.shards))
+    except KeyboardInterrupt:
+        print("\n⏹ Разделение прервано: удалите файлы шардов и запустите заново")
+        sys.exit(130)
\ No newline at end of file
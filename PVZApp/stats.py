@@ -0,0 +1,148 @@
+import datetime
+
+from archive import orders_source
+
+# Агрегаты для /api/stats ведутся триггерами в той же транзакции, что и
+# изменение заказа, поэтому любая запись (API, пакетная загрузка,
+# ручная правка в sqlite3) сразу отражается в счетчиках. Суммы хранятся
+# в копейках целыми числами, чтобы многократные +/- не накапливали
+# ошибку округления.
+AMOUNT_CENTS_SQL = "CAST(round({amount} * 100) AS INTEGER)"
+DAY_SQL = "ifnull(date({order_date}), '')"
+
+
+def _apply(row, sign):
+    # Шаги триггера, добавляющие (sign='+') или вычитающие (sign='-') строку
+    amount = AMOUNT_CENTS_SQL.format(amount=f'{row}.amount')
+    day = DAY_SQL.format(order_date=f'{row}.order_date')
+    return f'''
+        INSERT INTO stats_by_status (status, orders, amount_cents)
+        VALUES ({row}.status, {sign}1, {sign}{amount})
+        ON CONFLICT (status) DO UPDATE SET
+            orders = orders + excluded.orders,
+            amount_cents = amount_cents + excluded.amount_cents;
+        INSERT INTO stats_by_day (day, orders, amount_cents)
+        VALUES ({day}, {sign}1, {sign}{amount})
+        ON CONFLICT (day) DO UPDATE SET
+            orders = orders + excluded.orders,
+            amount_cents = amount_cents + excluded.amount_cents;
+    '''
+
+
+STATS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS stats_by_status (
+        status TEXT PRIMARY KEY,
+        orders INTEGER NOT NULL,
+        amount_cents INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS stats_by_day (
+        day TEXT PRIMARY KEY,
+        orders INTEGER NOT NULL,
+        amount_cents INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS stats_insert AFTER INSERT ON orders BEGIN
+        {_apply('NEW', '+')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS stats_delete AFTER DELETE ON orders BEGIN
+        {_apply('OLD', '-')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS stats_update AFTER UPDATE OF status, amount, order_date ON orders BEGIN
+        {_apply('OLD', '-')}
+        {_apply('NEW', '+')}
+    END
+    ''',
+]
+
+STATS_TRIGGERS = ('stats_insert', 'stats_delete', 'stats_update')
+
+
+def read_stats(conn, today=None):
+    """Статистика для /api/stats из агрегатов: два чтения по ключу"""
+    today = today or datetime.date.today().isoformat()
+
+    by_status = {row['status']: row for row in conn.execute(
+        "SELECT status, orders, amount_cents FROM stats_by_status")}
+    today_row = conn.execute(
+        "SELECT orders FROM stats_by_day WHERE day = ?", (today,)).fetchone()
+
+    def count(status):
+        row = by_status.get(status)
+        return row['orders'] if row else 0
+
+    return {
+        'total_orders': sum(row['orders'] for row in by_status.values()),
+        'ready_orders': count('Готов к выдаче'),
+        'pending_orders': count('Ожидает выдачи'),
+        'completed_orders': count('Выдан'),
+        'cancelled_orders': count('Отменен'),
+        'today_orders': today_row['orders'] if today_row else 0,
+        'total_amount': sum(row['amount_cents'] for status, row in by_status.items()
+                            if status != 'Отменен') / 100,
+    }
+
+
+def combine(results):
+    """Статистика всех шардов из результатов read_stats по каждому"""
+    if len(results) == 1:
+        return results[0]
+    combined = {key: sum(result[key] for result in results) for key in results[0]}
+    combined['total_amount'] = round(combined['total_amount'], 2)
+    return combined
+
+
+def _compute(conn):
+    # Агрегаты, посчитанные заново по заказам, включая архивные
+    amount = AMOUNT_CENTS_SQL.format(amount='amount')
+    day = DAY_SQL.format(order_date='order_date')
+    source = orders_source(conn)
+    by_status = {row[0]: (row[1], row[2]) for row in conn.execute(
+        f"SELECT status, COUNT(*), SUM({amount}) FROM {source} GROUP BY status")}
+    by_day = {row[0]: (row[1], row[2]) for row in conn.execute(
+        f"SELECT {day}, COUNT(*), SUM({amount}) FROM {source} GROUP BY 1")}
+    return by_status, by_day
+
+
+def _stored(conn):
+    # Агрегаты из таблиц статистики без нулевых строк
+    by_status = {row[0]: (row[1], row[2]) for row in conn.execute(
+        "SELECT status, orders, amount_cents FROM stats_by_status WHERE orders != 0 OR amount_cents != 0")}
+    by_day = {row[0]: (row[1], row[2]) for row in conn.execute(
+        "SELECT day, orders, amount_cents FROM stats_by_day WHERE orders != 0 OR amount_cents != 0")}
+    return by_status, by_day
+
+
+def verify(conn):
+    """Сравнение агрегатов с пересчетом по orders.
+
+    Возвращает список расхождений (таблица, ключ, хранимое, фактическое);
+    пустой список - агрегаты верны. (orders, amount_cents) отсутствующего
+    ключа считается равным (0, 0).
+    """
+    drift = []
+    for table, stored, actual in zip(('stats_by_status', 'stats_by_day'), _stored(conn), _compute(conn)):
+        for key in sorted(set(stored) | set(actual), key=str):
+            expected = stored.get(key, (0, 0))
+            real = actual.get(key, (0, 0))
+            if expected != real:
+                drift.append((table, key, expected, real))
+    return drift
+
+
+def rebuild(conn):
+    """Пересчет агрегатов с нуля по заказам, включая архивные"""
+    by_status, by_day = _compute(conn)
+    conn.execute("DELETE FROM stats_by_status")
+    conn.execute("DELETE FROM stats_by_day")
+    conn.executemany("INSERT INTO stats_by_status (status, orders, amount_cents) VALUES (?, ?, ?)",
+                     [(key, *value) for key, value in by_status.items()])
+    conn.executemany("INSERT INTO stats_by_day (day, orders, amount_cents) VALUES (?, ?, ?)",
+                     [(key, *value) for key, value in by_day.items()])
\ No newline at end of file
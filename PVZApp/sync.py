@@ -0,0 +1,152 @@
+import zlib
+
+# Версия данных для условных GET и дельта-синхронизации.
+# sync_state хранит глобальный счетчик изменений. Триггеры увеличивают
+# его при каждой вставке, изменении и удалении заказа и записывают новое
+# значение в orders.version изменившейся строки, а для удаленных заказов -
+# в order_tombstones. Счетчик живет в БД, поэтому одинаков для всех
+# рабочих процессов.
+DATA_COLUMNS = ('order_number', 'order_date', 'client_name', 'phone', 'status',
+                'amount', 'delivery_method', 'pickup_point')
+
+_BUMP = "UPDATE sync_state SET version = version + 1 WHERE id = 1;"
+_CURRENT = "(SELECT version FROM sync_state WHERE id = 1)"
+
+SYNC_SCHEMA = [
+    # Существующие строки получают версию 1 без перезаписи таблицы
+    "ALTER TABLE orders ADD COLUMN version INTEGER NOT NULL DEFAULT 1",
+    "CREATE INDEX IF NOT EXISTS idx_orders_version ON orders (version)",
+    '''
+    CREATE TABLE IF NOT EXISTS sync_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    ''',
+    "INSERT OR IGNORE INTO sync_state (id, version) VALUES (1, 1)",
+    '''
+    CREATE TABLE IF NOT EXISTS order_tombstones (
+        id INTEGER PRIMARY KEY,
+        order_number TEXT NOT NULL,
+        version INTEGER NOT NULL
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_order_tombstones_version ON order_tombstones (version)",
+    f'''
+    CREATE TRIGGER IF NOT EXISTS sync_insert AFTER INSERT ON orders BEGIN
+        {_BUMP}
+        UPDATE orders SET version = {_CURRENT} WHERE id = NEW.id;
+    END
+    ''',
+    # Срабатывает только на изменение данных, а не самой версии
+    f'''
+    CREATE TRIGGER IF NOT EXISTS sync_update AFTER UPDATE OF {', '.join(DATA_COLUMNS)} ON orders BEGIN
+        {_BUMP}
+        UPDATE orders SET version = {_CURRENT} WHERE id = NEW.id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS sync_delete AFTER DELETE ON orders BEGIN
+        {_BUMP}
+        INSERT OR REPLACE INTO order_tombstones (id, order_number, version)
+        VALUES (OLD.id, OLD.order_number, {_CURRENT});
+    END
+    ''',
+]
+
+# Статус и пункт выдачи удаленного заказа, чтобы подписчики событий с
+# фильтром по ним получали и удаления
+TOMBSTONE_DETAILS = [
+    "ALTER TABLE order_tombstones ADD COLUMN status TEXT",
+    "ALTER TABLE order_tombstones ADD COLUMN pickup_point TEXT",
+    "DROP TRIGGER IF EXISTS sync_delete",
+    f'''
+    CREATE TRIGGER sync_delete AFTER DELETE ON orders BEGIN
+        {_BUMP}
+        INSERT OR REPLACE INTO order_tombstones (id, order_number, status, pickup_point, version)
+        VALUES (OLD.id, OLD.order_number, OLD.status, OLD.pickup_point, {_CURRENT});
+    END
+    ''',
+]
+
+SYNC_TRIGGERS = ('sync_insert', 'sync_update', 'sync_delete')
+
+
+def current_version(conn):
+    """Текущая версия данных"""
+    return conn.execute("SELECT version FROM sync_state WHERE id = 1").fetchone()[0]
+
+
+def format_version(versions):
+    """Версия данных по шардам для ответов: число для одной БД, "v0.v1..." для шардов"""
+    if len(versions) == 1:
+        return versions[0]
+    return '.'.join(str(version) for version in versions)
+
+
+def parse_version(value, shards=1, name='version'):
+    """Разбор версии от format_version в список версий по шардам.
+
+    0 означает начало журнала при любом числе шардов.
+    """
+    try:
+        versions = [int(part) for part in str(value).split('.')]
+    except ValueError:
+        versions = None
+    if versions == [0]:
+        return [0] * shards
+    if versions is None or len(versions) != shards:
+        raise ValueError(f'{name} must be an integer' if shards == 1
+                         else f'{name} must be {shards} dot-separated integers')
+    if any(version < 0 for version in versions):
+        raise ValueError(f'{name} must not be negative')
+    return versions
+
+
+def make_etag(version, *parts):
+    """ETag ответа: версия данных и все, от чего еще зависит представление"""
+    if not parts:
+        return f'"{version}"'
+    digest = zlib.crc32('\0'.join(str(part) for part in parts).encode())
+    return f'"{version}-{digest:08x}"'
+
+
+def etag_matches(if_none_match, etag):
+    """Проверка заголовка If-None-Match (слабое сравнение)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return etag in tags or 'W/' + etag in tags
+
+
+def changes_since(conn, since, limit):
+    """Заказы, измененные после версии since, и удаленные заказы.
+
+    Изменения отдаются по возрастанию версии не больше limit за раз.
+    Возвращает (changes, deleted, version, has_more), где version - значение
+    since для следующего запроса.
+    """
+    changes = conn.execute(
+        "SELECT * FROM orders WHERE version > ? ORDER BY version LIMIT ?", (since, limit + 1)).fetchall()
+    deleted = conn.execute(
+        "SELECT id, order_number, status, pickup_point, version FROM order_tombstones WHERE version > ? ORDER BY version LIMIT ?",
+        (since, limit + 1)).fetchall()
+
+    # Объединяем две упорядоченные по версии выборки и берем первые limit
+    merged = sorted([(row['version'], 0, row) for row in changes] +
+                    [(row['version'], 1, row) for row in deleted], key=lambda item: item[:2])
+    has_more = len(merged) > limit
+    merged = merged[:limit]
+
+    if has_more:
+        version = merged[-1][0]
+    else:
+        version = current_version(conn)
+
+    return (
+        [dict(row) for _, kind, row in merged if kind == 0],
+        [dict(row) for _, kind, row in merged if kind == 1],
+        version,
+        has_more,
+    )
\ No newline at end of file
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+# Модули приложения лежат в каталоге PVZApp без пакета
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive
+import orders
+from db_pool import ConnectionPool
+from migrations import migrate
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """Путь к новой БД заказов во временном каталоге"""
+    return str(tmp_path / 'pvz_database.db')
+
+
+@pytest.fixture
+def pool(db_path):
+    """Пул соединений с БД, в которой созданы схема и архив"""
+    pool = ConnectionPool(db_path, attach=archive.attachments(db_path))
+    with pool.writer() as conn:
+        migrate(conn)
+        archive.ensure_schema(conn)
+    yield pool
+    pool.close_all()
+
+
+@pytest.fixture
+def add_order():
+    """Добавление заказа в транзакции conn. Возвращает его id"""
+    def add(conn, order_number, status=orders.DEFAULT_STATUS, amount=100.0, pickup_point='ПВЗ №001',
+            order_date=None):
+        data = {'order_number': order_number, 'client_name': 'Иванов Иван', 'phone': '+7 (999) 123-45-67',
+                'amount': amount, 'delivery_method': 'Самовывоз', 'pickup_point': pickup_point, 'status': status}
+        return conn.execute(orders.INSERT_ORDER_SQL, orders.order_values(data, order_date)).lastrowid
+    return add
\ No newline at end of file
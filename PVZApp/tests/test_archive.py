@@ -0,0 +1,68 @@
+import archive
+import orders
+
+OLD = '2000-01-01T10:00:00'
+CUTOFF = '2001-01-01'
+
+
+def number_index(conn):
+    return conn.execute("SELECT sql FROM archive.sqlite_master WHERE name = 'idx_orders_number'").fetchone()[0]
+
+
+def test_closed_old_orders_move_to_archive(pool, add_order):
+    with pool.writer() as conn:
+        issued = add_order(conn, 'ORD-1', status='Выдан', order_date=OLD)
+        add_order(conn, 'ORD-2', order_date=OLD)
+        add_order(conn, 'ORD-3', status='Отменен')
+        assert archive.archive_batch(conn, CUTOFF) == 1
+    with pool.reader() as conn:
+        assert archive.find_order(conn, order_id=issued)['order_number'] == 'ORD-1'
+        assert archive.find_order(conn, order_number='ORD-1')['id'] == issued
+        assert conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0] == 2
+
+
+def test_archived_numbers_are_taken(pool, add_order):
+    with pool.writer() as conn:
+        add_order(conn, 'ORD-1', status='Выдан', order_date=OLD)
+        add_order(conn, 'ORD-2')
+        archive.archive_batch(conn, CUTOFF)
+        assert orders.existing_numbers(conn, ['ORD-1', 'ORD-2', 'ORD-3']) == {'ORD-1', 'ORD-2'}
+        results = orders.create_orders(conn, [
+            {'order_number': 'ORD-1', 'client_name': 'Петрова Анна', 'phone': '+7 999 765-43-21',
+             'amount': 10, 'delivery_method': 'Курьер', 'pickup_point': 'ПВЗ №001'},
+        ])
+    assert results == [{'index': 0, 'order_number': 'ORD-1', 'error': 'Duplicate order_number'}]
+
+
+def test_archive_number_index_is_unique(pool):
+    with pool.reader() as conn:
+        assert number_index(conn).startswith('CREATE UNIQUE INDEX')
+
+
+def test_old_index_stays_plain_while_numbers_repeat(pool, add_order):
+    with pool.writer() as conn:
+        conn.execute("DROP INDEX archive.idx_orders_number")
+        conn.execute("CREATE INDEX archive.idx_orders_number ON orders (order_number)")
+        for order_id in (1, 2):
+            conn.execute(f'''
+                INSERT INTO archive.orders ({', '.join(archive.ARCHIVE_COLUMNS)}, archived_at)
+                VALUES (?, 'ORD-1', ?, 'Иванов Иван', '1', 'Выдан', 1, 'Курьер', 'ПВЗ №001', 1, ?)
+            ''', (order_id, OLD, OLD))
+        archive.ensure_schema(conn)
+        assert not number_index(conn).startswith('CREATE UNIQUE')
+
+        conn.execute("DELETE FROM archive.orders WHERE id = 2")
+        archive.ensure_schema(conn)
+        assert number_index(conn).startswith('CREATE UNIQUE')
+
+
+def test_order_reusing_archived_number_stays_in_orders(pool, add_order):
+    with pool.writer() as conn:
+        archived = add_order(conn, 'ORD-1', status='Выдан', order_date=OLD)
+        archive.archive_batch(conn, CUTOFF)
+        # Номер занят до проверки по архиву при создании
+        reused = add_order(conn, 'ORD-1', status='Выдан', order_date=OLD)
+        assert archive.archive_batch(conn, CUTOFF) == 0
+    with pool.reader() as conn:
+        assert archive.find_order(conn, order_number='ORD-1')['id'] == archived
+        assert conn.execute("SELECT id FROM orders").fetchone()[0] == reused
\ No newline at end of file
@@ -0,0 +1,106 @@
+import sqlite3
+import threading
+
+import pytest
+
+
+def count_orders(conn):
+    return conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+
+def archive_attached(conn):
+    return any(row[1] == 'archive' for row in conn.execute("PRAGMA database_list"))
+
+
+def test_reader_is_reused_within_thread(pool):
+    with pool.reader() as first:
+        pass
+    with pool.reader() as second:
+        assert second is first
+
+
+def test_each_thread_gets_own_reader(pool):
+    with pool.reader() as main:
+        pass
+    other = []
+
+    def read():
+        with pool.reader() as conn:
+            other.append(conn)
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    thread.join()
+    assert other[0] is not main
+    # Два читателя и соединение записи, создавшее схему
+    assert pool.stats()['connections'] == 3
+
+
+def test_reader_is_read_only(pool, add_order):
+    with pool.reader() as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            add_order(conn, 'ORD-1')
+
+
+def test_connections_use_wal_with_archive_attached(pool):
+    with pool.reader() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        assert archive_attached(conn)
+    with pool.writer() as conn:
+        assert archive_attached(conn)
+
+
+def test_writer_commits(pool, add_order):
+    with pool.writer() as conn:
+        add_order(conn, 'ORD-1')
+    with pool.reader() as conn:
+        assert count_orders(conn) == 1
+
+
+def test_writer_rolls_back_on_error(pool, add_order):
+    with pytest.raises(RuntimeError):
+        with pool.writer() as conn:
+            add_order(conn, 'ORD-1')
+            raise RuntimeError('boom')
+    with pool.reader() as conn:
+        assert count_orders(conn) == 0
+    # Соединение записи пригодно для следующей транзакции
+    with pool.writer() as conn:
+        add_order(conn, 'ORD-2')
+    with pool.reader() as conn:
+        assert count_orders(conn) == 1
+
+
+def test_writer_recovers_from_failed_commit(pool, add_order):
+    with pool.writer() as conn:
+        conn.execute("CREATE TABLE parent (id INTEGER PRIMARY KEY)")
+        conn.execute("CREATE TABLE child (parent_id REFERENCES parent (id) DEFERRABLE INITIALLY DEFERRED)")
+    conn.execute("PRAGMA foreign_keys = ON")
+    # Отложенная проверка внешнего ключа срывает COMMIT
+    with pytest.raises(sqlite3.IntegrityError):
+        with pool.writer() as conn:
+            add_order(conn, 'ORD-1')
+            conn.execute("INSERT INTO child VALUES (1)")
+    with pool.writer() as conn:
+        add_order(conn, 'ORD-2')
+    with pool.reader() as conn:
+        assert [row[0] for row in conn.execute("SELECT order_number FROM orders")] == ['ORD-2']
+
+
+def test_reader_does_not_wait_for_open_write(pool, add_order):
+    with pool.writer() as conn:
+        add_order(conn, 'ORD-1')
+        # WAL: читатель видит последнее зафиксированное состояние
+        with pool.reader() as reader:
+            assert count_orders(reader) == 0
+    with pool.reader() as reader:
+        assert count_orders(reader) == 1
+
+
+def test_close_all_closes_connections(pool):
+    with pool.reader() as conn:
+        pass
+    pool.close_all()
+    assert pool.stats() == {'connections': 0, 'writer': False}
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
\ No newline at end of file
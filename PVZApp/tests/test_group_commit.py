@@ -0,0 +1,140 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+from group_commit import GroupCommitWriter
+
+
+def order_numbers(pool):
+    with pool.reader() as conn:
+        return sorted(row[0] for row in conn.execute("SELECT order_number FROM orders"))
+
+
+@pytest.fixture
+def writer(pool):
+    writer = GroupCommitWriter(pool, window=0.05)
+    yield writer
+    writer.close()
+
+
+def test_submit_returns_result_after_commit(pool, writer, add_order):
+    order_id = writer.submit(lambda conn: add_order(conn, 'ORD-1'))
+    assert isinstance(order_id, int)
+    assert order_numbers(pool) == ['ORD-1']
+
+
+def test_concurrent_writes_share_a_transaction(pool, writer, add_order):
+    start = threading.Barrier(8)
+
+    def write(index):
+        start.wait()
+        writer.submit(lambda conn: add_order(conn, f'ORD-{index}'))
+
+    threads = [threading.Thread(target=write, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = writer.stats()
+    assert stats['operations'] == 8
+    assert stats['batches'] < 8
+    assert len(order_numbers(pool)) == 8
+
+
+def test_failed_operation_rolls_back_only_itself(pool, writer, add_order):
+    start = threading.Barrier(3)
+    errors = {}
+
+    def failing(conn):
+        add_order(conn, 'ORD-FAILED')
+        raise ValueError('invalid order')
+
+    def write(name, operation):
+        start.wait()
+        try:
+            writer.submit(operation)
+        except Exception as e:
+            errors[name] = e
+
+    threads = [threading.Thread(target=write, args=('first', lambda conn: add_order(conn, 'ORD-1'))),
+               threading.Thread(target=write, args=('failing', failing)),
+               threading.Thread(target=write, args=('last', lambda conn: add_order(conn, 'ORD-2')))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Ошибка достается только своей операции, ее изменения откачены
+    assert list(errors) == ['failing']
+    assert isinstance(errors['failing'], ValueError)
+    assert order_numbers(pool) == ['ORD-1', 'ORD-2']
+    assert writer.stats()['failed'] == 1
+
+
+def test_sqlite_error_is_raised_to_caller(pool, writer, add_order):
+    writer.submit(lambda conn: add_order(conn, 'ORD-1'))
+    with pytest.raises(sqlite3.IntegrityError):
+        writer.submit(lambda conn: add_order(conn, 'ORD-1'))
+    assert order_numbers(pool) == ['ORD-1']
+
+
+class FailingCommitPool:
+    """Пул, у которого фиксация транзакции записи завершается ошибкой"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @contextmanager
+    def writer(self):
+        with self.pool.writer() as conn:
+            yield conn
+            raise sqlite3.OperationalError('disk I/O error')
+
+
+def test_commit_error_reaches_every_operation(pool, add_order):
+    writer = GroupCommitWriter(FailingCommitPool(pool))
+    try:
+        with pytest.raises(sqlite3.OperationalError, match='disk I/O error'):
+            writer.submit(lambda conn: add_order(conn, 'ORD-1'))
+    finally:
+        writer.close()
+    assert order_numbers(pool) == []
+
+
+class WriterCrash(BaseException):
+    """Ошибка, которая завершает поток записи"""
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_stopped_writer_fails_fast(pool, add_order):
+    writer = GroupCommitWriter(pool)
+
+    def crash(conn):
+        raise WriterCrash()
+
+    with pytest.raises(WriterCrash):
+        writer.submit(crash)
+    writer._thread.join()
+    # Следующие операции не ждут остановленный поток
+    with pytest.raises(RuntimeError, match='Writer thread has stopped') as error:
+        writer.submit(lambda conn: add_order(conn, 'ORD-1'))
+    assert isinstance(error.value.__cause__, WriterCrash)
+    # После close() поток записи запускается заново
+    writer.close()
+    writer.submit(lambda conn: add_order(conn, 'ORD-2'))
+    writer.close()
+    assert order_numbers(pool) == ['ORD-2']
+
+
+def test_close_runs_queued_operations(pool, add_order):
+    writer = GroupCommitWriter(pool)
+    writer.submit(lambda conn: add_order(conn, 'ORD-1'))
+    writer.close()
+    assert order_numbers(pool) == ['ORD-1']
+    # После остановки поток записи запускается заново
+    writer.submit(lambda conn: add_order(conn, 'ORD-2'))
+    writer.close()
+    assert order_numbers(pool) == ['ORD-1', 'ORD-2']
\ No newline at end of file
@@ -0,0 +1,103 @@
+import time
+from http import HTTPStatus
+
+import pytest
+
+from idempotency import IDEMPOTENCY_CLAIMS_SCHEMA, IdempotencyStore, request_hash
+from shards import Shard
+
+
+@pytest.fixture
+def shard(pool, db_path):
+    """Шард над БД фикстуры pool (схема уже создана)"""
+    shard = Shard(0, db_path)
+    yield shard
+    shard.writes.close()
+    shard.pool.close_all()
+
+
+def test_request_hash_covers_method_path_and_body():
+    first = request_hash('POST', '/api/orders', b'{"a": 1}')
+    assert first == request_hash('POST', '/api/orders', b'{"a": 1}')
+    assert first != request_hash('POST', '/api/orders', b'{"a": 2}')
+    assert first != request_hash('POST', '/api/orders/bulk', b'{"a": 1}')
+
+
+def test_stored_response_is_found_until_ttl(pool):
+    store = IdempotencyStore(ttl=60)
+    with pool.writer() as conn:
+        store.store(conn, 'key-1', 'hash', HTTPStatus.CREATED, {'Location': '/api/orders/1'}, b'{"id": 1}')
+    with pool.reader() as conn:
+        stored = store.lookup(conn, 'key-1')
+        assert store.lookup(conn, 'key-2') is None
+    assert (stored.request_hash, stored.status, stored.headers, stored.body) == \
+        ('hash', 201, {'Location': '/api/orders/1'}, b'{"id": 1}')
+
+    store.ttl = 0
+    with pool.reader() as conn:
+        assert store.lookup(conn, 'key-1') is None
+
+
+def test_prune_keeps_newest_keys(pool):
+    store = IdempotencyStore(max_keys=2)
+    with pool.writer() as conn:
+        for index in range(4):
+            store.store(conn, f'key-{index}', 'hash', 200, None, b'{}')
+            conn.execute("UPDATE idempotency_keys SET created_at = ? WHERE key = ?",
+                         (time.time() - 10 + index, f'key-{index}'))
+        store.prune(conn)
+        keys = sorted(row[0] for row in conn.execute("SELECT key FROM idempotency_keys"))
+    assert keys == ['key-2', 'key-3']
+
+
+def test_claim_accepts_same_request_only(pool):
+    store = IdempotencyStore()
+    with pool.writer() as conn:
+        for step in IDEMPOTENCY_CLAIMS_SCHEMA:
+            conn.execute(step)
+        assert store.claim(conn, 'key-1', 'first')
+        assert store.claim(conn, 'key-1', 'first')
+        assert not store.claim(conn, 'key-1', 'second')
+        assert store.claim(conn, 'key-2', 'second')
+
+
+def test_run_write_replays_stored_response(shard, add_order):
+    import server
+    calls = []
+
+    def create(conn):
+        calls.append(1)
+        return add_order(conn, 'ORD-1')
+
+    def respond(order_id):
+        return HTTPStatus.CREATED, {'id': order_id}, {'Location': f'/api/orders/{order_id}'}
+
+    fingerprint = request_hash('POST', '/api/orders', b'{}')
+    order_id, stored, replayed = server.run_write(shard, create, respond, 'key-1', fingerprint)
+    assert not replayed and stored.status == HTTPStatus.CREATED
+
+    # Повтор получает тот же ответ, запись не выполняется
+    result, again, replayed = server.run_write(shard, create, respond, 'key-1', fingerprint)
+    assert replayed and result is None
+    assert (again.status, again.body, again.headers) == (stored.status, stored.body, stored.headers)
+    assert len(calls) == 1
+
+    # Тот же ключ с другим запросом: обработчик ответит 422 по несовпадению отпечатка
+    other = request_hash('POST', '/api/orders', b'{"other": 1}')
+    _, conflict, replayed = server.run_write(shard, create, respond, 'key-1', other)
+    assert replayed and conflict.request_hash != other
+    assert len(calls) == 1
+
+
+def test_run_write_without_key_always_executes(shard, add_order):
+    import server
+    numbers = iter(['ORD-1', 'ORD-2'])
+
+    def respond(order_id):
+        return HTTPStatus.CREATED, {'id': order_id}, None
+
+    for _ in range(2):
+        _, stored, replayed = server.run_write(shard, lambda conn: add_order(conn, next(numbers)), respond)
+        assert not replayed and stored.request_hash is None
+    with shard.pool.reader() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0] == 2
\ No newline at end of file
@@ -0,0 +1,81 @@
+import concurrent.futures
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def request_timer(pool):
+    """Учет запроса в текущем контексте с запоминанием SQL запросов (после создания БД)"""
+    timer, token = metrics.start_request(record_queries=True)
+    yield timer
+    metrics.reset(token)
+
+
+def executed(timer, sql):
+    # Кроме запросов теста учитываются и настройки новых соединений
+    return [record for record in timer.queries if record.sql == sql]
+
+
+def test_histogram_quantile_interpolates_within_bucket():
+    histogram = metrics.Histogram()
+    assert histogram.quantile(0.5) == 0.0
+    for _ in range(10):
+        histogram.observe(0.003)     # корзина (0.0025, 0.005]
+    assert histogram.count == 10
+    assert histogram.quantile(0.5) == pytest.approx(0.00375)
+    assert histogram.quantile(1) == pytest.approx(0.005)
+
+
+def test_phases_and_queries_go_to_current_request(request_timer, pool):
+    with metrics.phase('serialize'):
+        pass
+    with pool.reader() as conn:
+        conn.execute("SELECT COUNT(*) FROM orders").fetchall()
+    assert request_timer.serialize > 0
+    assert request_timer.sql > 0
+    [record] = executed(request_timer, "SELECT COUNT(*) FROM orders")
+    assert record.rows == 1
+    assert record.pool is pool
+
+
+def test_writer_queries_have_no_pool(request_timer, pool):
+    with pool.writer() as conn:
+        conn.execute("SELECT 1").fetchall()
+    assert [record.pool for record in executed(request_timer, "SELECT 1")] == [None]
+
+
+def test_propagate_records_queries_from_other_threads(request_timer, pool):
+    def count(_):
+        with pool.reader() as conn:
+            return conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        assert list(executor.map(metrics.propagate(count), range(2))) == [0, 0]
+    assert len(executed(request_timer, "SELECT COUNT(*) FROM orders")) == 2
+
+
+def test_no_accounting_outside_request(pool):
+    assert metrics.current() is None
+    with pool.reader() as conn:
+        conn.execute("SELECT 1").fetchall()
+    assert metrics.propagate(len) is len
+
+
+def test_registry_renders_prometheus_text():
+    registry = metrics.Registry()
+    registry.collectors.append(lambda: metrics.counter('pvz_test_total', 'Test counter.', 7))
+    timer, token = metrics.start_request()
+    metrics.reset(token)
+    timer.status = 200
+    registry.request_started()
+    registry.request_finished('GET', '/api/orders/{order_id:int}', timer)
+
+    text = registry.render()
+    labels = 'method="GET",route="/api/orders/{order_id:int}"'
+    assert f'pvz_http_requests_total{{{labels},code="200"}} 1' in text
+    assert f'pvz_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1' in text
+    assert f'pvz_http_request_phase_seconds_count{{{labels},phase="sql"}} 1' in text
+    assert 'pvz_http_requests_in_flight 0' in text
+    assert text.endswith('pvz_test_total 7\n')
\ No newline at end of file
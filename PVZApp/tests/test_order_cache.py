@@ -0,0 +1,140 @@
+import sys
+import threading
+
+import pytest
+
+import order_cache
+from order_cache import ENTRY_OVERHEAD, OrderCache
+
+
+def put(cache, order_id, order_number, body=b'{}', version=1):
+    cache.put(cache.generation(), order_id, order_number, version, body)
+
+
+def test_get_by_id_and_number():
+    cache = OrderCache()
+    put(cache, 1, 'ORD-1', b'{"id": 1}')
+    assert cache.get(order_id=1).body == b'{"id": 1}'
+    # id из пути запроса приходит строкой
+    assert cache.get(order_id='1').body == b'{"id": 1}'
+    assert cache.get(order_number='ORD-1').id == 1
+    assert cache.get(order_id=2) is None
+    assert cache.get(order_number='ORD-2') is None
+    assert (cache.hits, cache.misses) == (3, 2)
+
+
+def test_invalidate_drops_id_and_number():
+    cache = OrderCache()
+    put(cache, 1, 'ORD-1')
+    cache.invalidate('1')
+    assert cache.get(order_id=1) is None
+    assert cache.get(order_number='ORD-1') is None
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['bytes'] == 0
+
+
+def test_put_after_invalidate_with_older_generation_is_ignored():
+    cache = OrderCache()
+    # Чтение заказа из БД началось до изменения и его сброса
+    generation = cache.generation()
+    cache.invalidate(1)
+    cache.put(generation, 1, 'ORD-1', 1, b'{"status": "old"}')
+    assert cache.get(order_id=1) is None
+    put(cache, 1, 'ORD-1', b'{"status": "new"}', version=2)
+    assert cache.get(order_id=1).version == 2
+
+
+def test_invalidation_of_other_orders_keeps_put():
+    cache = OrderCache()
+    generation = cache.generation()
+    # Пока заказ 1 читается из БД, изменяются другие заказы
+    cache.invalidate(2, '3')
+    cache.put(generation, 1, 'ORD-1', 1, b'{}')
+    assert cache.get(order_id=1) is not None
+
+
+def test_forgotten_invalidations_reject_older_puts(monkeypatch):
+    monkeypatch.setattr(order_cache, 'INVALIDATION_HISTORY', 2)
+    cache = OrderCache()
+    generation = cache.generation()
+    cache.invalidate(1)
+    cache.invalidate(2)
+    cache.invalidate(3)
+    # Сброс заказа 1 забыт: метка до него отбрасывается для любого заказа
+    cache.put(generation, 1, 'ORD-1', 1, b'{}')
+    cache.put(generation, 4, 'ORD-4', 1, b'{}')
+    assert cache.stats()['entries'] == 0
+    put(cache, 1, 'ORD-1')
+    assert cache.get(order_id=1) is not None
+
+
+@pytest.fixture
+def frequent_switches():
+    # Частое переключение потоков: чтение и сброс перемежаются чаще
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_concurrent_invalidation_never_leaves_stale_entry(frequent_switches):
+    cache = OrderCache()
+    version = [0]
+
+    def writer():
+        for _ in range(200):
+            # Изменение заказа в БД, затем сброс
+            version[0] += 1
+            cache.invalidate(1)
+
+    for _ in range(20):
+        thread = threading.Thread(target=writer)
+        thread.start()
+        while thread.is_alive():
+            # Как в обработчике GET: метка, чтение из БД, сохранение
+            generation = cache.generation()
+            read = version[0]
+            cache.put(generation, 1, 'ORD-1', read, b'{}')
+        thread.join()
+        # Прочитанное до последнего изменения в кэше не осталось
+        entry = cache.get(order_id=1)
+        assert entry is None or entry.version == version[0]
+
+
+def test_number_reused_by_another_order():
+    cache = OrderCache()
+    put(cache, 1, 'ORD-1')
+    put(cache, 2, 'ORD-1')
+    assert cache.get(order_number='ORD-1').id == 2
+    # Сброс прежнего заказа не трогает номер нового
+    cache.invalidate(1)
+    assert cache.get(order_number='ORD-1').id == 2
+
+
+def test_lru_eviction_by_size():
+    body = b'x' * 100
+    size = len(body) + len('ORD-1') + ENTRY_OVERHEAD
+    cache = OrderCache(max_bytes=size * 2)
+    put(cache, 1, 'ORD-1', body)
+    put(cache, 2, 'ORD-2', body)
+    cache.get(order_id=1)
+    put(cache, 3, 'ORD-3', body)
+    assert cache.get(order_id=2) is None
+    assert cache.get(order_id=1) is not None
+    assert cache.get(order_id=3) is not None
+    assert cache.evictions == 1
+    assert cache.stats()['bytes'] == size * 2
+
+
+def test_entries_expire():
+    cache = OrderCache(ttl=0)
+    put(cache, 1, 'ORD-1')
+    assert cache.get(order_id=1) is None
+    assert cache.expirations == 1
+
+
+def test_zero_budget_disables_cache():
+    cache = OrderCache(max_bytes=0)
+    put(cache, 1, 'ORD-1')
+    assert cache.get(order_id=1) is None
+    assert cache.stats()['entries'] == 0
\ No newline at end of file
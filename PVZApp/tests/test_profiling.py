@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+import metrics
+import profiling
+
+
+@pytest.fixture
+def request_timer(pool):
+    timer, token = metrics.start_request(record_queries=True)
+    yield timer
+    metrics.reset(token)
+
+
+def summary(timer, sql):
+    return next(query for query in profiling.summarize_queries(timer.queries) if query['sql'] == sql)
+
+
+def test_plan_marks():
+    assert profiling.plan_mark('SEARCH orders USING INDEX idx_orders_status (status=?)') == '✓'
+    assert profiling.plan_mark('SCAN orders USING INDEX idx_orders_date') == '~'
+    assert profiling.plan_mark('SCAN orders') == '✗'
+    assert profiling.plan_mark('SCAN orders_fts VIRTUAL TABLE INDEX 0:M3') == '✓'
+
+
+def test_plan_for_query_from_another_thread(request_timer, pool):
+    sql = "SELECT * FROM orders WHERE order_number = ?"
+
+    def find():
+        with pool.reader() as conn:
+            conn.execute(sql, ('ORD-1',)).fetchall()
+
+    thread = threading.Thread(target=metrics.propagate(find))
+    thread.start()
+    thread.join()
+    # План строится на читателе этого потока: соединение потока, где
+    # выполнился запрос, может быть уже занято или закрыто
+    pool.close_all()
+    query = summary(request_timer, sql)
+    assert query['calls'] == 1
+    assert query['plan'] == ['✓ SEARCH orders USING INDEX sqlite_autoindex_orders_1 (order_number=?)']
+
+
+def test_no_plan_for_writes(request_timer, pool, add_order):
+    with pool.writer() as conn:
+        add_order(conn, 'ORD-1')
+        conn.execute("SELECT * FROM orders WHERE status = ?", ('Выдан',)).fetchall()
+    assert summary(request_timer, "SELECT * FROM orders WHERE status = ?")['plan'] is None
+
+
+def test_long_and_binary_parameters_are_shortened(request_timer, pool):
+    with pool.reader() as conn:
+        conn.execute("SELECT ?, ?", (b'\x00' * 10, 'x' * 500)).fetchall()
+    parameters = summary(request_timer, "SELECT ?, ?")['parameters']
+    assert parameters[0] == '<10 bytes>'
+    assert parameters[1] == 'x' * profiling.MAX_PARAMETER_LENGTH + '…'
+
+
+def test_slow_log_keeps_newest_entries(request_timer, tmp_path):
+    path = tmp_path / 'slow.log'
+    log = profiling.SlowRequestLog(threshold=0.001, path=str(path), size=2)
+    request_timer.status = 200
+    for index in range(3):
+        log.record('GET', f'/api/orders?page={index}', '/api/orders', request_timer, 0.5)
+    assert [entry['path'] for entry in log.entries()] == ['/api/orders?page=2', '/api/orders?page=1']
+    assert len(path.read_text(encoding='utf-8').splitlines()) == 3
+    assert log.stats()['logged'] == 3
\ No newline at end of file
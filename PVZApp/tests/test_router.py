@@ -0,0 +1,77 @@
+import pytest
+
+from router import Router
+
+
+def handler(**params):
+    return params
+
+
+@pytest.fixture
+def router():
+    router = Router()
+    router.add('GET', '/api/orders', handler, budget='read')
+    router.add('POST', '/api/orders', handler, budget='write')
+    router.add('GET', '/api/orders/{order_id:int}', handler)
+    router.add('PUT', '/api/orders/{order_id:int}/status', handler)
+    router.add('DELETE', '/api/orders/{order_id:int}', handler)
+    router.add('GET', '/api/orders/by-number/{order_number}', handler)
+    router.add('POST', '/api/orders/issue', handler, defaults={'status': 'Выдан'})
+    router.add('GET', '/static/{path:path}', handler)
+    return router
+
+
+def test_static_path(router):
+    route, params, template = router.match('POST', '/api/orders')
+    assert (route.method, route.budget, params, template) == ('POST', 'write', {}, '/api/orders')
+
+
+def test_parameters_are_converted(router):
+    route, params, template = router.match('GET', '/api/orders/42')
+    assert params == {'order_id': 42}
+    assert template == '/api/orders/{order_id:int}'
+    _, params, _ = router.match('GET', '/api/orders/by-number/ORD%20001')
+    assert params == {'order_number': 'ORD 001'}
+    _, params, _ = router.match('GET', '/static/css/app.css')
+    assert params == {'path': 'css/app.css'}
+
+
+def test_constant_path_wins_over_template(router):
+    route, params, template = router.match('POST', '/api/orders/issue')
+    assert template == '/api/orders/issue'
+    assert route.defaults == {'status': 'Выдан'}
+
+
+def test_unknown_path_is_404(router):
+    assert router.match('GET', '/api/unknown') == (None, None, None)
+    # Параметр не подходит по типу
+    assert router.match('GET', '/api/orders/abc') == (None, None, None)
+    assert router.match('GET', '/api/orders/42/extra') == (None, None, None)
+
+
+def test_unknown_method_is_405_with_allow(router):
+    route, params, template = router.match('PATCH', '/api/orders/42')
+    assert route is None and template == '/api/orders/{order_id:int}'
+    assert router.allowed_methods(template) == ['GET', 'DELETE']
+
+
+def test_routes_added_after_match_are_found(router):
+    router.match('GET', '/api/orders')
+    router.add('GET', '/api/orders/{order_id:int}/history', handler)
+    assert router.match('GET', '/api/orders/7/history')[1] == {'order_id': 7}
+
+
+def test_invalid_declarations_are_rejected(router):
+    with pytest.raises(ValueError):
+        router.add('GET', '/api/orders', handler)
+    with pytest.raises(ValueError):
+        router.add('GET', '/api/points/{point:uuid}', handler)
+
+
+def test_server_route_table():
+    import server
+    route, params, template = server.router.match('PUT', '/api/orders/5/status')
+    assert route.handler is server.PVZHandler.handle_update_order_status
+    assert params == {'order_id': 5}
+    _, _, template = server.router.match('POST', '/api/orders/5')
+    assert sorted(server.router.allowed_methods(template)) == ['DELETE', 'GET']
\ No newline at end of file
@@ -0,0 +1,34 @@
+import sqlite3
+
+import pytest
+
+import search
+
+
+def found(conn, term):
+    return [row[0] for row in conn.execute(
+        "SELECT rowid FROM orders_fts WHERE orders_fts MATCH ? ORDER BY rowid", (search.match_expression(term),))]
+
+
+@pytest.fixture
+def plain(pool, db_path):
+    """Соединение с БД заказов без настроек пула, как у любого клиента SQLite"""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    yield conn
+    conn.close()
+
+
+def test_orders_can_be_changed_by_any_sqlite_client(plain, pool, add_order):
+    order_id = add_order(plain, 'ORD-1')
+    plain.execute("UPDATE orders SET phone = '+7 999_765 43 21' WHERE id = ?", (order_id,))
+    with pool.reader() as conn:
+        assert found(conn, '999765432') == [order_id]
+        assert found(conn, '+7 (999) 765-43') == [order_id]
+        assert found(conn, '1234567') == []
+
+
+@pytest.mark.parametrize('phone', ['+7 (999) 123-45-67', '8 999 123 45 67', '+7 999 123–45–67',
+                                   '+7/999/123.45.67', '+7\xa0999\xa0123\xa045\xa067'])
+def test_phone_separators_are_not_indexed(plain, phone):
+    digits = plain.execute(f"SELECT {search.PHONE_DIGITS_SQL.format(phone='?')}", (phone,)).fetchone()[0]
+    assert digits == search.normalize_phone(phone)
\ No newline at end of file
@@ -0,0 +1,60 @@
+import pytest
+
+import split_shards
+from shards import OrderStore
+
+
+@pytest.fixture
+def store(pool, add_order, db_path, tmp_path):
+    """Два шарда из единой БД с заказами двух пунктов выдачи"""
+    with pool.writer() as conn:
+        add_order(conn, 'ORD-1', pickup_point='ПВЗ №001')
+        add_order(conn, 'ORD-2', pickup_point='ПВЗ №001')
+        add_order(conn, 'ORD-3', pickup_point='ПВЗ №002')
+    shards_dir = str(tmp_path / 'shards')
+    assert split_shards.split_database(db_path, shards_dir, 2) == 0
+    store = OrderStore.open(db_path, shards_dir)
+    store.load()
+    yield store
+    store.close()
+
+
+def order_count(shard):
+    with shard.pool.reader() as conn:
+        return conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+
+def test_points_are_split_between_shards(store):
+    first, second = store.shard_for_point('ПВЗ №001'), store.shard_for_point('ПВЗ №002')
+    assert first is not second
+    assert (order_count(first), order_count(second)) == (2, 1)
+    # Заказы единой БД сохраняют id, их шард - из каталога
+    assert [store.shard_of_order(order_id) for order_id in (1, 2, 3)] == [first, first, second]
+
+
+def test_order_numbers_point_to_their_shard(store):
+    first, second = store.shard_for_point('ПВЗ №001'), store.shard_for_point('ПВЗ №002')
+    assert store.shards_of_number('ORD-1') == [first]
+    assert store.shards_of_number('ORD-3') == [second]
+    assert store.shards_of_number('ORD-404') == store.shards
+
+
+def test_number_is_claimed_by_one_shard(store):
+    first, second = store.shard_for_point('ПВЗ №001'), store.shard_for_point('ПВЗ №002')
+    assert store.claim_numbers(['ORD-3', 'ORD-4'], first) == {'ORD-3'}
+    # Повторное закрепление за тем же шардом - не дубликат
+    assert store.claim_numbers(['ORD-4'], first) == set()
+    assert store.claim_numbers(['ORD-4'], second) == {'ORD-4'}
+    assert store.shards_of_number('ORD-4') == [first]
+
+    store.release_number('ORD-4', second)
+    assert store.shards_of_number('ORD-4') == [first]
+    store.release_number('ORD-4', first)
+    assert store.claim_numbers(['ORD-4'], second) == set()
+
+
+def test_catalog_without_numbers_is_filled_on_load(store):
+    with store.catalog.writer() as conn:
+        conn.execute("DELETE FROM order_numbers")
+    store.load()
+    assert store.shards_of_number('ORD-3') == [store.shard_for_point('ПВЗ №002')]
\ No newline at end of file
@@ -0,0 +1,56 @@
+import archive
+import stats
+
+
+def test_triggers_keep_aggregates_in_sync(pool, add_order):
+    with pool.writer() as conn:
+        ready = add_order(conn, 'ORD-1', status='Готов к выдаче', amount=100.10)
+        add_order(conn, 'ORD-2', amount=200.20)
+        cancelled = add_order(conn, 'ORD-3', status='Отменен', amount=50)
+        conn.execute("UPDATE orders SET status = 'Выдан' WHERE id = ?", (ready,))
+        conn.execute("DELETE FROM orders WHERE id = ?", (cancelled,))
+    with pool.reader() as conn:
+        assert stats.verify(conn) == []
+        result = stats.read_stats(conn)
+    assert result['total_orders'] == 2
+    assert result['completed_orders'] == 1
+    assert result['pending_orders'] == 1
+    assert result['cancelled_orders'] == 0
+    assert result['today_orders'] == 2
+    assert result['total_amount'] == 300.30
+
+
+def test_verify_reports_drift_and_rebuild_fixes_it(pool, add_order):
+    with pool.writer() as conn:
+        add_order(conn, 'ORD-1', amount=10)
+        conn.execute("UPDATE stats_by_status SET orders = orders + 5 WHERE status = 'Ожидает выдачи'")
+        conn.execute("INSERT INTO stats_by_day (day, orders, amount_cents) VALUES ('2000-01-01', 1, 100)")
+    with pool.reader() as conn:
+        drift = stats.verify(conn)
+    assert ('stats_by_status', 'Ожидает выдачи', (6, 1000), (1, 1000)) in drift
+    assert ('stats_by_day', '2000-01-01', (1, 100), (0, 0)) in drift
+
+    with pool.writer() as conn:
+        stats.rebuild(conn)
+    with pool.reader() as conn:
+        assert stats.verify(conn) == []
+        assert stats.read_stats(conn)['total_orders'] == 1
+
+
+def test_archived_orders_stay_in_aggregates(pool, add_order):
+    with pool.writer() as conn:
+        add_order(conn, 'ORD-1', status='Выдан', order_date='2000-01-01T10:00:00')
+        add_order(conn, 'ORD-2')
+        before = stats.read_stats(conn)
+        # Перенос в архив не считается удалением, а сверка учитывает архив
+        assert archive.archive_batch(conn, '2001-01-01') == 1
+    with pool.reader() as conn:
+        assert stats.verify(conn) == []
+        assert stats.read_stats(conn) == before
+
+
+def test_combine_sums_shards():
+    first = {'total_orders': 2, 'today_orders': 1, 'total_amount': 0.1}
+    second = {'total_orders': 3, 'today_orders': 0, 'total_amount': 0.2}
+    assert stats.combine([first]) is first
+    assert stats.combine([first, second]) == {'total_orders': 5, 'today_orders': 1, 'total_amount': 0.3}
\ No newline at end of file